@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio 分片下载引擎
+
+与线程池引擎相比，一个事件循环即可维持数百个在途请求：
+- 固定数量的 worker 协程从有界队列取任务，在途请求数 = worker 数
+- 队列有界，生产者在队列满时挂起，形成背压
+- 自适应并发窗口已满时协程挂起等待，限流器释放名额时从释放线程唤醒事件循环（不轮询）
+- 解密和写盘通常只需几毫秒，直接在事件循环中执行；大分片和流式合并（put 可能因重排窗口阻塞）放到线程池
+跳过 / 重试间隔（retry_delay）/ 自适应并发 / 大分片拆分 / 0x47 同步字节 / 令牌过期恢复的语义
+与 M3U8Downloader.download_segment 一致
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from token_refresh import auth_status
+
+# 引入 aiohttp（可选依赖）
+try:
+    import aiohttp
+
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+
+logger = logging.getLogger(__name__)
+
+RETRY_TIMES = 3
+WRITE_WORKERS = 4  # 解密 + 写盘线程数
+INLINE_SAVE_SIZE = 1024 * 1024  # 不超过该大小的分片直接在事件循环中解密写盘，省去线程切换
+
+
+class AsyncSegmentEngine:
+    def __init__(self, downloader, max_inflight=64, timeout=30, retry_delay=None, split_size=0):
+        """
+        downloader: M3U8Downloader 实例，复用其请求头、密钥、限流器、Range 下载器和 save_segment
+        max_inflight: 同时在途的最大请求数（启用自适应并发时再受限流器窗口约束）
+        retry_delay: retry_delay(error) 返回重试前的等待秒数，None 时固定 1 秒
+        split_size: 超过该大小的分片交给 downloader.ranges 拆成并发 Range 请求，0 表示不拆分
+        """
+        self.downloader = downloader
+        self.max_inflight = max_inflight
+        self.timeout = timeout
+        self.retry_delay = retry_delay or (lambda error: 1)
+        self.split_size = split_size
+
+    def run(self, segments, progress=None):
+        """下载全部分片，返回成功数量；progress(done, ok) 用于刷新进度"""
+        if not segments:
+            return 0
+        return asyncio.run(self._run(segments, progress))
+
+    async def _run(self, segments, progress):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.max_inflight * 2)
+        state = {"done": 0, "ok": 0}
+        limiter = self.downloader.limiter
+        self.released = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(self.released.set)
+            except RuntimeError:
+                pass  # 其他线程在本引擎退出、事件循环关闭之后才释放名额
+
+        if limiter:
+            limiter.subscribe(wake)
+
+        try:
+            connector = aiohttp.TCPConnector(limit=self.max_inflight, ssl=False)
+            client_timeout = aiohttp.ClientTimeout(total=self.timeout)
+            headers = dict(self.downloader.session.headers)
+
+            with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as writer:
+                async with aiohttp.ClientSession(connector=connector, timeout=client_timeout,
+                                                 headers=headers) as session:
+
+                    async def worker():
+                        while True:
+                            segment = await queue.get()
+                            if segment is None:
+                                queue.task_done()
+                                return
+                            try:
+                                ok = await self._download(session, loop, writer, segment)
+                            except Exception as e:
+                                logger.warning(f"分片 {segment.index} 下载异常: {e}")
+                                ok = self.downloader.segment_failed(segment.index)
+                            state["done"] += 1
+                            state["ok"] += ok
+                            if progress:
+                                progress(state["done"], state["ok"])
+                            queue.task_done()
+
+                    workers = [asyncio.create_task(worker())
+                               for _ in range(min(self.max_inflight, len(segments)))]
+                    for segment in segments:
+                        await queue.put(segment)  # 队列满时挂起（背压）
+                    for _ in workers:
+                        await queue.put(None)
+                    await asyncio.gather(*workers)
+        finally:
+            if limiter:
+                limiter.unsubscribe(wake)
+
+        return state["ok"]
+
+    async def _acquire(self, limiter):
+        """占用限流器的一个并发名额；限流器是线程间共享的，不能在事件循环里阻塞等待，名额释放时由 wake 唤醒"""
+        while True:
+            self.released.clear()  # 先清除再尝试：两步之间的释放也会重新置位，不会丢失唤醒
+            if limiter.try_acquire():
+                return
+            await self.released.wait()
+
+    def _splittable(self, segment, resp):
+        """完整 GET 的响应是否值得改为并发 Range 下载（判断条件同 RangeFetcher.splittable）"""
+        ranges = self.downloader.ranges
+        length = resp.content_length
+        return (ranges is not None and self.split_size and segment.byterange is None
+                and resp.status == 200 and length is not None and length > self.split_size
+                and resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+                and not resp.headers.get("Content-Encoding")
+                and ranges.supports_range(segment.url))
+
+    async def _fetch(self, session, loop, segment):
+        """单次下载尝试，返回分片内容"""
+        ranges = self.downloader.ranges
+        metrics = self.downloader.metrics
+        if ranges and self.split_size and segment.byterange and segment.byterange[1] > self.split_size:
+            # 很大的字节范围：直接拆成多个 Range 请求并发下载
+            start = time.perf_counter()
+            content = await loop.run_in_executor(None, ranges.fetch, segment.url, *segment.byterange)
+            metrics.observe("transfer", time.perf_counter() - start)
+            return content
+
+        start = time.perf_counter()
+        async with session.get(segment.url, headers=segment.range_header) as resp:
+            metrics.observe("ttfb", time.perf_counter() - start)
+            resp.raise_for_status()
+            start = time.perf_counter()
+            if self._splittable(segment, resp):
+                # 大分片：放弃这个响应，整个资源改为并发 Range 请求
+                resp.release()
+                content = await loop.run_in_executor(None, ranges.fetch, segment.url, 0, resp.content_length)
+            else:
+                content = await resp.read()
+                if segment.byterange and resp.status == 200:
+                    # 服务器忽略了 Range，返回了整个资源
+                    offset, length = segment.byterange
+                    content = content[offset:offset + length]
+            metrics.observe("transfer", time.perf_counter() - start)
+        return content
+
+    async def _download(self, session, loop, writer, segment):
+        """下载单个分片，最多重试 RETRY_TIMES 次"""
+        idx = segment.index
+        if self.downloader.segment_done(idx):
+            return True
+        if self.downloader.cache and await loop.run_in_executor(writer, self.downloader.load_cached, segment):
+            return True
+
+        metrics = self.downloader.metrics
+        recovery = self.downloader.recovery
+        limiter = self.downloader.limiter
+        begin = time.perf_counter()
+        attempt = 0
+        while attempt < RETRY_TIMES:
+            if self.downloader.cancel.is_set():
+                return False
+            if recovery and not recovery.ready.is_set():
+                await loop.run_in_executor(None, recovery.wait)  # 正在刷新播放列表
+            generation = recovery.generation if recovery else 0
+            segment = self.downloader.current_segment(segment)
+            if limiter:
+                await self._acquire(limiter)
+            start = time.perf_counter()
+            content, error = None, None
+            try:
+                content = await self._fetch(session, loop, segment)
+                if content:
+                    if self.downloader.merger is None and len(content) <= INLINE_SAVE_SIZE:
+                        self.downloader.save_segment(segment, content)
+                    else:
+                        await loop.run_in_executor(writer, self.downloader.save_segment, segment, content)
+            except Exception as e:
+                error = e
+            finally:
+                if limiter:
+                    limiter.release(time.perf_counter() - start, len(content) if content and not error else 0, error)
+
+            if content and error is None:
+                metrics.record_segment(idx, time.perf_counter() - begin, len(content), True, attempts=attempt + 1)
+                return True
+            if error is not None and recovery and auth_status(error) and \
+                    await loop.run_in_executor(None, recovery.auth_failure, generation):
+                continue  # 播放列表已刷新，换用新地址立即重试
+            attempt += 1
+            if error is None:
+                continue  # 空响应立即重试
+            if attempt == RETRY_TIMES:
+                logger.warning(f"分片 {idx} 下载失败: {error}")
+            await asyncio.sleep(self.retry_delay(error))
+        metrics.record_segment(idx, time.perf_counter() - begin, 0, False, attempts=RETRY_TIMES)
+        return self.downloader.segment_failed(idx)
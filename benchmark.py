@@ -0,0 +1,987 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试（基于本地 HLS 替身服务器，不访问真实 CDN）
+
+用法:
+    python benchmark.py [--json out.json] engine [--segments 400] [--size 262144] [--latency 0.05]
+    python benchmark.py remux [--segments 200] [--size 1048576]
+    python benchmark.py adaptive [--segments 400] [--max-concurrent 12]
+    python benchmark.py hedge [--segments 400] [--stall-rate 0.02] [--stall 8]
+    python benchmark.py estimate [--segments 2700] [--samples 30] [--trials 20]
+    python benchmark.py parser [--segments 100000] [--repeat 5]
+    python benchmark.py store [--segments 3000] [--size 65536]
+    python benchmark.py pipeline [--lessons 4] [--segments 100] [--bandwidth 8388608]
+    python benchmark.py validate [--segments 300] [--corrupt-rate 0.05]
+    python benchmark.py queue [--lessons 8] [--workers 3] [--kill-after 2]
+    python benchmark.py rendition [--lessons 3] [--segments 60] [--budget-ratio 0.5]
+    python benchmark.py range [--large-segments 2] [--large-size 25165824] [--rate 4194304]
+    python benchmark.py --json e2e.json e2e [--segments 300] [--error-rate 0.02] [--baseline old.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import re
+import subprocess
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from urllib.parse import urljoin
+
+import concurrency
+import http_pool
+import key_manager
+import main as downloader_main
+import range_fetch
+import ts_validate
+from hls_parser import parse_playlist
+from hls_standin import HLSStandIn, HAS_CRYPTO, make_av_segment
+
+
+def _max_rss_mb(who):
+    """进程峰值 RSS（MB），仅支持 POSIX"""
+    import resource
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def _fresh_run():
+    """
+    每轮对比前丢弃进程内共享的会话、Range 下载器、密钥缓存和限流器，并关闭分片缓存：
+    否则后一轮复用前一轮的 keep-alive 连接、已缓存的密钥和分片以及学到的并发窗口，结果偏向后一轮
+    """
+    downloader_main.SEGMENT_CACHE_SIZE = 0
+    http_pool.reset()
+    range_fetch.reset()
+    key_manager.reset()
+    concurrency.reset()
+
+
+def bench_engine(args):
+    """对比线程池引擎与 async 引擎的分片下载耗时（两者在途请求数相同）"""
+    import async_engine  # noqa: F401  提前导入 aiohttp（约 0.3s），一次性的导入耗时不计入下载时间
+    results = []
+    downloader_main.ASYNC_MAX_INFLIGHT = downloader_main.MAX_THREADS
+    with HLSStandIn(segments=args.segments, segment_size=args.size,
+                    latency=args.latency, encrypt=HAS_CRYPTO) as server:
+        for engine in args.engines:
+            downloader_main.DOWNLOAD_ENGINE = engine
+            _fresh_run()
+            with tempfile.TemporaryDirectory() as tmp:
+                d = downloader_main.M3U8Downloader(server.playlist_url, f"bench_{engine}", tmp)
+                d.temp_dir.mkdir(parents=True, exist_ok=True)
+                if not d.parse_m3u8():
+                    raise RuntimeError("解析替身播放列表失败")
+
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):  # 屏蔽进度条输出
+                    completed = d.download_all()
+                elapsed = time.perf_counter() - start
+
+            total_bytes = completed * args.size
+            results.append({
+                "engine": engine,
+                "segments": completed,
+                "seconds": round(elapsed, 3),
+                "segments_per_sec": round(completed / elapsed, 1),
+                "mb_per_sec": round(total_bytes / elapsed / 1024 / 1024, 2),
+            })
+
+    print("\n" + "=" * 60)
+    print(f"{'引擎':<10}{'分片':>8}{'耗时(s)':>12}{'分片/s':>12}{'MB/s':>12}")
+    for r in results:
+        print(f"{r['engine']:<10}{r['segments']:>8}{r['seconds']:>12}"
+              f"{r['segments_per_sec']:>12}{r['mb_per_sec']:>12}")
+    print("=" * 60)
+    return results
+
+
+def bench_adaptive(args):
+    """在限流的替身服务器上对比固定线程数与自适应并发"""
+    results = []
+    downloader_main.DOWNLOAD_ENGINE = "thread"
+    for mode in ("fixed", "adaptive"):
+        downloader_main.ADAPTIVE_CONCURRENCY = mode == "adaptive"
+        downloader_main.MAX_THREADS = args.threads
+        _fresh_run()  # 自适应一轮从初始窗口 args.threads 开始
+        with HLSStandIn(segments=args.segments, segment_size=args.size, latency=args.latency,
+                        max_concurrent=args.max_concurrent) as server, \
+                tempfile.TemporaryDirectory() as tmp:
+            d = downloader_main.M3U8Downloader(server.playlist_url, f"bench_{mode}", tmp)
+            d.temp_dir.mkdir(parents=True, exist_ok=True)
+            if not d.parse_m3u8():
+                raise RuntimeError("解析替身播放列表失败")
+
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                completed = d.download_all()
+            elapsed = time.perf_counter() - start
+
+            results.append({
+                "mode": mode,
+                "segments": completed,
+                "seconds": round(elapsed, 3),
+                "mb_per_sec": round(completed * args.size / elapsed / 1024 / 1024, 2),
+                "throttled": server.throttled,
+                "final_window": d.limiter.limit if d.limiter else args.threads,
+                "adjustments": len(d.limiter.history) if d.limiter else 0,
+            })
+
+    print("\n" + "=" * 72)
+    print(f"{'模式':<10}{'分片':>8}{'耗时(s)':>10}{'MB/s':>10}{'429次数':>10}{'最终并发':>10}{'调整次数':>10}")
+    for r in results:
+        print(f"{r['mode']:<10}{r['segments']:>8}{r['seconds']:>10}{r['mb_per_sec']:>10}"
+              f"{r['throttled']:>10}{r['final_window']:>10}{r['adjustments']:>10}")
+    print("=" * 72)
+    return results
+
+
+def bench_hedge(args):
+    """在有慢节点的替身服务器上对比关闭 / 开启对冲请求"""
+    results = []
+    downloader_main.DOWNLOAD_ENGINE = "thread"
+    for hedging in (False, True):
+        downloader_main.HEDGE_REQUESTS = hedging
+        _fresh_run()
+        with HLSStandIn(segments=args.segments, segment_size=args.size, latency=args.latency,
+                        stall_rate=args.stall_rate, stall=args.stall) as server, \
+                tempfile.TemporaryDirectory() as tmp:
+            d = downloader_main.M3U8Downloader(server.playlist_url, f"bench_hedge_{hedging}", tmp)
+            d.temp_dir.mkdir(parents=True, exist_ok=True)
+            if not d.parse_m3u8():
+                raise RuntimeError("解析替身播放列表失败")
+
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                completed = d.download_all()
+            elapsed = time.perf_counter() - start
+            stats = d.hedger.stats() if d.hedger else {}
+            if d.hedger:
+                d.hedger.close()
+
+            results.append({
+                "hedging": hedging,
+                "segments": completed,
+                "seconds": round(elapsed, 3),
+                **stats,
+            })
+
+    print("\n" + "=" * 72)
+    print(f"{'对冲':<8}{'分片':>8}{'耗时(s)':>10}{'触发':>8}{'胜出':>8}{'节省(s)':>10}{'p99(s)':>16}")
+    for r in results:
+        p99 = f"{r['p99_primary']} -> {r['p99_effective']}" if r["hedging"] else "-"
+        print(f"{'开' if r['hedging'] else '关':<8}{r['segments']:>8}{r['seconds']:>10}"
+              f"{r.get('hedges', 0):>8}{r.get('hedge_wins', 0):>8}{r.get('saved_seconds', 0):>10}{p99:>16}")
+    print("=" * 72)
+    return results
+
+
+def bench_estimate(args):
+    """在大小有波动的合成播放列表上对比 m3u8_info 抽样估算与逐个 HEAD 的结果"""
+    from m3u8_info import M3U8InfoGetter
+
+    with HLSStandIn(segments=args.segments, segment_size=args.size, size_jitter=args.jitter) as server, \
+            contextlib.redirect_stdout(io.StringIO()):
+        exact_getter = M3U8InfoGetter(mode="exact", max_workers=16)
+        start = time.perf_counter()
+        exact = exact_getter.get_m3u8_info(server.master_url)
+        exact_seconds = time.perf_counter() - start
+
+        trials = []
+        for seed in range(args.trials):
+            getter = M3U8InfoGetter(mode="estimate", samples=args.samples, seed=seed, max_workers=16)
+            start = time.perf_counter()
+            info = getter.get_m3u8_info(server.master_url)
+            trials.append((info, time.perf_counter() - start))
+
+    errors = [abs(info["size"] - exact["size"]) / exact["size"] for info, _ in trials]
+    covered = sum(info["size_low"] <= exact["size"] <= info["size_high"] for info, _ in trials)
+    bandwidth_error = abs(exact["bandwidth_size"] - exact["size"]) / exact["size"]
+    result = {
+        "segments": args.segments,
+        "exact_mb": round(exact["size"] / 1024 / 1024, 2),
+        "exact_requests": exact["requests"],
+        "exact_seconds": round(exact_seconds, 3),
+        "samples": args.samples,
+        "estimate_seconds": round(statistics.mean(t for _, t in trials), 3),
+        "mean_error_pct": round(statistics.mean(errors) * 100, 3),
+        "max_error_pct": round(max(errors) * 100, 3),
+        "ci_coverage_pct": round(covered / len(trials) * 100, 1),
+        "mean_ci_halfwidth_pct": round(statistics.mean(
+            (info["size_high"] - info["size_low"]) / 2 / exact["size"] for info, _ in trials) * 100, 3),
+        "bandwidth_error_pct": round(bandwidth_error * 100, 3),
+    }
+
+    print("\n" + "=" * 60)
+    print(f"分片数: {result['segments']}，精确大小 {result['exact_mb']} MB")
+    print(f"逐个 HEAD: {result['exact_requests']} 次请求，{result['exact_seconds']}s")
+    print(f"抽样估算: {result['samples']} 次请求，平均 {result['estimate_seconds']}s（{args.trials} 次试验）")
+    print(f"估算误差: 平均 {result['mean_error_pct']}%，最大 {result['max_error_pct']}%")
+    print(f"95% 置信区间: 平均半宽 {result['mean_ci_halfwidth_pct']}%，覆盖真实值 {result['ci_coverage_pct']}%")
+    print(f"按 AVERAGE-BANDWIDTH 估算误差: {result['bandwidth_error_pct']}%")
+    print("=" * 60)
+    return result
+
+
+def _synthetic_playlist(count, key_every=1000):
+    """生成带密钥轮换和不连续标记的媒体播放列表文本"""
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:10", "#EXT-X-MEDIA-SEQUENCE:1000"]
+    for i in range(count):
+        if i % key_every == 0:
+            if i:
+                lines.append("#EXT-X-DISCONTINUITY")
+            lines.append(f'#EXT-X-KEY:METHOD=AES-128,URI="https://key.example.com/k/{i // key_every}.key"')
+        lines.append(f"#EXTINF:{9 + (i % 7) / 7:.3f},")
+        lines.append(f"v1/seg-{i:06d}.ts?sign=8f1c0a9b3e5d7f21&t=1700000000")
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def _legacy_parse(content, url):
+    """旧版 parse_m3u8 的解析方式（基准对照）：正则取第一个密钥，逐个 #EXTINF 向后查看 5 行"""
+    segments = []
+    re.search(r'#EXT-X-KEY:METHOD=([^,]+),URI="([^"]+)"(?:,IV=(0x[0-9a-fA-F]+))?', content)
+    lines = content.splitlines()
+    for i, line in enumerate(lines):
+        if line.startswith("#EXTINF"):
+            for j in range(i + 1, min(i + 5, len(lines))):
+                seg_line = lines[j].strip()
+                if seg_line and not seg_line.startswith("#"):
+                    segments.append({"index": len(segments), "url": urljoin(url, seg_line)})
+                    break
+    return segments
+
+
+def bench_parser(args):
+    """在大播放列表上对比旧解析方式与 hls_parser 的耗时和内存"""
+    url = "https://cdn.example.com/course/lesson/index.m3u8"
+    text = _synthetic_playlist(args.segments)
+    results = []
+    for name, parse in (("legacy", _legacy_parse), ("hls_parser", parse_playlist)):
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            parse(text, url)
+            timings.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        parsed = parse(text, url)
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        count = len(parsed.segments) if name == "hls_parser" else len(parsed)
+        del parsed
+
+        results.append({
+            "parser": name,
+            "segments": count,
+            "best_ms": round(min(timings) * 1000, 1),
+            "median_ms": round(statistics.median(timings) * 1000, 1),
+            "retained_mb": round(retained / 1024 / 1024, 2),
+            "peak_mb": round(peak / 1024 / 1024, 2),
+        })
+
+    print("\n" + "=" * 72)
+    print(f"播放列表: {args.segments} 个分片，{len(text) / 1024 / 1024:.1f} MB 文本")
+    print(f"{'解析器':<12}{'分片':>8}{'最快(ms)':>12}{'中位数(ms)':>12}{'常驻(MB)':>12}{'峰值(MB)':>12}")
+    for r in results:
+        print(f"{r['parser']:<12}{r['segments']:>8}{r['best_ms']:>12}{r['median_ms']:>12}"
+              f"{r['retained_mb']:>12}{r['peak_mb']:>12}")
+    print("=" * 72)
+    print("注: hls_parser 的分片 URL 在访问时才拼接，legacy 在解析时对每个分片调用 urljoin")
+    return results
+
+
+def _run_range_case(name, split, coalesce, **standin):
+    """在替身服务器上下载一次，返回耗时、请求数和与原始分片逐字节一致的分片数"""
+    downloader_main.DOWNLOAD_ENGINE = "thread"
+    downloader_main.RANGE_SPLIT_SIZE = split
+    downloader_main.RANGE_COALESCE_SIZE = coalesce
+    with HLSStandIn(encrypt=HAS_CRYPTO, **standin) as server, tempfile.TemporaryDirectory() as tmp:
+        d = downloader_main.M3U8Downloader(server.playlist_url, f"bench_{name}", tmp)
+        d.temp_dir.mkdir(parents=True, exist_ok=True)
+        if not d.parse_m3u8():
+            raise RuntimeError("解析替身播放列表失败")
+        server.media(); server.media_requests = 0  # 预先生成数据，只统计下载阶段的请求
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            completed = d.download_all()
+        elapsed = time.perf_counter() - start
+        if d.journal is not None:
+            d.journal.close()
+
+        verified = sum((d.temp_dir / f"{i:05d}.ts").read_bytes() == server.plain_segment(i)
+                       for i in range(server.segments) if (d.temp_dir / f"{i:05d}.ts").exists())
+        total_bytes = sum(len(server.plain_segment(i)) for i in range(server.segments))
+    return {
+        "case": name,
+        "segments": completed,
+        "verified": verified,
+        "requests": server.media_requests,
+        "seconds": round(elapsed, 3),
+        "mb_per_sec": round(total_bytes / elapsed / 1024 / 1024, 2),
+    }
+
+
+def bench_range(args):
+    """大分片拆分 Range 下载、EXT-X-BYTERANGE 相邻范围合并、服务器不支持 Range 时的回退"""
+    split, part, coalesce = (downloader_main.RANGE_SPLIT_SIZE, downloader_main.RANGE_PART_SIZE,
+                             downloader_main.RANGE_COALESCE_SIZE)
+    large = dict(segments=args.large_segments, segment_size=args.large_size, stream_rate=args.rate)
+    single = dict(segments=args.segments, segment_size=args.size, latency=args.latency, single_file=True)
+    downloader_main.MAX_THREADS = args.threads
+    results = [
+        _run_range_case("large_single_get", 0, 0, **large),
+        _run_range_case("large_split", split, 0, **large),
+        _run_range_case("byterange_per_segment", 0, 0, **single),
+        _run_range_case("byterange_coalesced", 0, coalesce, **single),
+        _run_range_case("byterange_no_range_server", split, coalesce, accept_ranges=False, **single),
+    ]
+    downloader_main.RANGE_SPLIT_SIZE, downloader_main.RANGE_COALESCE_SIZE = split, coalesce
+
+    print("\n" + "=" * 80)
+    print(f"大分片: {args.large_segments} × {args.large_size // 1024 // 1024} MB，单连接限速 "
+          f"{args.rate / 1024 / 1024:.1f} MB/s，每部分 {part // 1024 // 1024} MB")
+    print(f"{'场景':<28}{'分片':>6}{'校验一致':>10}{'请求数':>8}{'耗时(s)':>10}{'MB/s':>10}")
+    for r in results:
+        print(f"{r['case']:<28}{r['segments']:>6}{r['verified']:>10}{r['requests']:>8}"
+              f"{r['seconds']:>10}{r['mb_per_sec']:>10}")
+    print("=" * 80)
+    return results
+
+
+def bench_store(args):
+    """对比每个分片一个文件与单文件容器存储：下载、续传加载、合并、清理的耗时和文件数"""
+    results = []
+    downloader_main.DOWNLOAD_ENGINE = "thread"
+    downloader_main.MERGE_BACKEND = "python"
+    with HLSStandIn(segments=args.segments, segment_size=args.size) as server:
+        for store in ("files", "container"):
+            downloader_main.SEGMENT_STORE = store
+            with tempfile.TemporaryDirectory() as tmp:
+                d = downloader_main.M3U8Downloader(server.playlist_url, f"bench_{store}", tmp)
+                d.temp_dir.mkdir(parents=True, exist_ok=True)
+                if not d.parse_m3u8():
+                    raise RuntimeError("解析替身播放列表失败")
+
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    completed = d.download_all()
+                download = time.perf_counter() - start
+                files = sum(1 for _ in d.temp_dir.iterdir())
+                d.journal.close()
+                if d.store:
+                    d.store.close()
+
+                # 续传：重新打开日志（和容器），检查全部分片是否已完成
+                start = time.perf_counter()
+                d.begin_download(args.threads, hedging=False)
+                done = sum(d.segment_done(i) for i in range(len(d.segments)))
+                resume = time.perf_counter() - start
+
+                start = time.perf_counter()
+                merged = d.merge_segments(Path(tmp) / f"{store}.mp4")
+                merge = time.perf_counter() - start
+                d.journal.close()
+                if d.store:
+                    d.store.close()
+
+                start = time.perf_counter()
+                shutil.rmtree(d.temp_dir)
+                cleanup = time.perf_counter() - start
+
+            results.append({
+                "store": store,
+                "segments": completed,
+                "resumed": done,
+                "files": files,
+                "merged": merged,
+                "download_s": round(download, 3),
+                "resume_ms": round(resume * 1000, 1),
+                "merge_s": round(merge, 3),
+                "cleanup_ms": round(cleanup * 1000, 1),
+            })
+
+    print("\n" + "=" * 80)
+    print(f"{'存储':<12}{'分片':>7}{'文件数':>8}{'下载(s)':>10}{'续传(ms)':>10}{'合并(s)':>10}{'清理(ms)':>10}")
+    for r in results:
+        print(f"{r['store']:<12}{r['segments']:>7}{r['files']:>8}{r['download_s']:>10}"
+              f"{r['resume_ms']:>10}{r['merge_s']:>10}{r['cleanup_ms']:>10}")
+    print("=" * 80)
+    return results
+
+
+def bench_pipeline(args):
+    """逐课运行 vs 流水线：多节课依次下载合并的总耗时，以及流水线各阶段的占用率"""
+    from pipeline import LessonPipeline
+    results = []
+    backend = args.merge_backend or ("ffmpeg" if shutil.which("ffmpeg") else "python")
+    downloader_main.MERGE_BACKEND = backend
+    downloader_main.SEGMENT_CACHE_SIZE = 0  # 各节课内容相同，关闭缓存才能测到真实下载
+    downloader_main.METRICS_SUMMARY = False
+    with HLSStandIn(segments=args.segments, segment_size=args.size, latency=args.latency,
+                    encrypt=HAS_CRYPTO, bandwidth=args.bandwidth) as server:
+        for mode in ("serial", "pipeline"):
+            with tempfile.TemporaryDirectory() as tmp:
+                downloaders = [downloader_main.M3U8Downloader(server.playlist_url, f"bench_{mode}_{i}", tmp)
+                               for i in range(args.lessons)]
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    if mode == "serial":
+                        ok = sum(bool(d.run()) for d in downloaders)
+                        stages = None
+                    else:
+                        runner = LessonPipeline(downloaders, merge_workers=args.merge_workers)
+                        ok = runner.run()["success"]
+                        stages = runner.pipeline.stats()
+                elapsed = time.perf_counter() - start
+            results.append({"mode": mode, "lessons": ok, "seconds": round(elapsed, 2), "stages": stages})
+
+    print("\n" + "=" * 80)
+    print(f"{args.lessons} 节课，每节 {args.segments} 个分片，合并后端 {backend}")
+    for r in results:
+        print(f"{r['mode']:<10} 成功 {r['lessons']} 节，耗时 {r['seconds']}s")
+    for s in results[-1]["stages"]:
+        print(f"  {s['stage']:<10} 占用率 {s['occupancy'] * 100:>5.1f}%，阻塞 {s['blocked_seconds']}s，"
+              f"队列峰值 {s['queue_peak']}，平均 {s['queue_average']}")
+    print(f"加速比: {results[0]['seconds'] / results[1]['seconds']:.2f}x")
+    print("=" * 80)
+    return results
+
+
+def bench_rendition(args):
+    """各码率策略下整门课的下载字节数、耗时和输出大小（三档码率 + 独立音频轨）"""
+    from rendition import RenditionPolicy, CourseAllowance, ThroughputMeter
+    backend = args.merge_backend or ("ffmpeg" if shutil.which("ffmpeg") else "python")
+    downloader_main.MERGE_BACKEND = backend
+    downloader_main.SEGMENT_CACHE_SIZE = 0
+    downloader_main.METRICS_SUMMARY = False
+    ladder = [(1920, 1080, 1.0), (1280, 720, 0.45), (640, 360, 0.15)]
+    results = []
+    with HLSStandIn(segments=args.segments, segment_size=args.size, latency=args.latency,
+                    ladder=ladder, audio_rendition=True) as server:
+        best_total = None
+        for name, make_policy in [
+            ("best", lambda: RenditionPolicy()),
+            ("resolution", lambda: RenditionPolicy("resolution", height=720)),
+            ("budget", lambda: RenditionPolicy("budget", allowance=CourseAllowance(
+                args.lessons, budget=int(best_total * args.budget_ratio), meter=ThroughputMeter()))),
+            ("audio", lambda: RenditionPolicy("audio")),
+        ]:
+            policy = make_policy()
+            with tempfile.TemporaryDirectory() as tmp:
+                downloaders = [downloader_main.M3U8Downloader(f"{server.master_url}?lesson={i}", f"bench_{name}_{i}", tmp,
+                                                              policy=policy) for i in range(args.lessons)]
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    ok = sum(bool(d.run()) for d in downloaders)
+                elapsed = time.perf_counter() - start
+                downloaded = sum(d.metrics.bytes for d in downloaders)
+                output = sum(d.final_mp4.stat().st_size for d in downloaders if d.final_mp4.exists())
+            if best_total is None:
+                best_total = downloaded
+            results.append({"policy": name, "lessons": ok, "seconds": round(elapsed, 2),
+                            "downloaded_bytes": downloaded, "output_bytes": output,
+                            "renditions": sorted({d.rendition.label for d in downloaders if d.rendition}),
+                            "saved_pct": round((1 - downloaded / best_total) * 100, 1)})
+
+    print("\n" + "=" * 80)
+    print(f"{args.lessons} 节课，每节 {args.segments} 个分片，budget 为最高码率总字节数的 {args.budget_ratio:.0%}")
+    for r in results:
+        print(f"{r['policy']:<11} 成功 {r['lessons']} 节，下载 {r['downloaded_bytes'] / 1024 / 1024:>7.1f} MB"
+              f"（节省 {r['saved_pct']:>5.1f}%），输出 {r['output_bytes'] / 1024 / 1024:>7.1f} MB，耗时 {r['seconds']}s")
+        for label in r["renditions"]:
+            print(f"{'':<11} {label}")
+    print("=" * 80)
+    return results
+
+
+def _queue_worker(db, output_dir, settings, worker, queue):
+    """任务队列 worker 进程：领取课程直到队列为空"""
+    for name, value in settings.items():
+        setattr(downloader_main, name, value)
+    downloader_main.JOB_QUEUE_DB = db
+    downloader_main.OUTPUT_DIR = Path(output_dir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = downloader_main.run_queue_worker(worker=worker)
+    queue.put({"worker": worker, **results})
+
+
+def bench_queue(args):
+    """
+    多个 worker 进程共享一个 SQLite 任务队列：1 个 worker vs 多个 worker 的总耗时；
+    --kill-after 时多 worker 一轮中第一个 worker 被强制杀死，其课程在租约过期后由其他 worker 接手
+    """
+    from job_queue import JobQueue, DONE
+    ctx = multiprocessing.get_context("spawn")
+    backend = args.merge_backend or ("ffmpeg" if shutil.which("ffmpeg") else "python")
+    settings = {"MERGE_BACKEND": backend, "SEGMENT_CACHE_SIZE": 0, "METRICS_SUMMARY": False,
+                "MAX_THREADS": args.threads, "JOB_LEASE_SECONDS": args.lease}
+    results = []
+    with HLSStandIn(segments=args.segments, segment_size=args.size, latency=args.latency,
+                    encrypt=HAS_CRYPTO) as server:
+        for workers in sorted({1, args.workers}):
+            kill = args.kill_after if workers > 1 else 0
+            with tempfile.TemporaryDirectory() as tmp:
+                db = os.path.join(tmp, "jobs.db")
+                queue = JobQueue(db, lease=args.lease)
+                queue.enqueue([{"title": f"bench_queue_{i}", "m3u8": f"{server.playlist_url}?lesson={i}"}
+                               for i in range(args.lessons)])
+                out = ctx.Queue()
+                start = time.perf_counter()
+                procs = [ctx.Process(target=_queue_worker, args=(db, tmp, settings, f"w{i}", out))
+                         for i in range(workers)]
+                for proc in procs:
+                    proc.start()
+                if kill:
+                    time.sleep(kill)
+                    procs[0].kill()  # 模拟 worker 崩溃：不释放租约
+                reports = [out.get() for _ in procs[1 if kill else 0:]]
+                for proc in procs:
+                    proc.join()
+                elapsed = time.perf_counter() - start
+                rows = queue.lessons()
+            results.append({
+                "workers": workers,
+                "killed": 1 if kill else 0,
+                "seconds": round(elapsed, 2),
+                "done": sum(row["status"] == DONE for row in rows),
+                "reclaimed": sum(row["attempts"] > 1 for row in rows),
+                "per_worker": {r["worker"]: r["success"] for r in reports},
+            })
+
+    print("\n" + "=" * 80)
+    print(f"{args.lessons} 节课，每节 {args.segments} 个分片，租约 {args.lease}s")
+    for r in results:
+        killed = f"，杀死 1 个 worker，重新领取 {r['reclaimed']} 节" if r["killed"] else ""
+        print(f"{r['workers']} 个 worker: 完成 {r['done']}/{args.lessons} 节，耗时 {r['seconds']}s{killed}，"
+              f"各 worker 完成 {r['per_worker']}")
+    print("=" * 80)
+    return results
+
+
+def bench_validate(args):
+    """校验器吞吐（NumPy vs 步长视图），以及替身服务器返回损坏分片时开启 / 关闭校验的结果"""
+    segment = make_av_segment(0, args.size)
+    throughput = {}
+    for name, use_numpy in (("numpy", True), ("stride", False)):
+        if use_numpy and not ts_validate.HAS_NUMPY:
+            continue
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            validator = ts_validate.TSValidator(use_numpy=use_numpy)
+            for pos in range(0, len(segment), downloader_main.CHUNK_SIZE):
+                validator.feed(segment[pos:pos + downloader_main.CHUNK_SIZE])
+            validator.finish()
+        elapsed = time.perf_counter() - start
+        throughput[name] = round(len(segment) * args.repeat / elapsed / 1024 / 1024, 1)
+
+    results = []
+    downloader_main.DOWNLOAD_ENGINE = "thread"
+    for validate in (False, True):
+        downloader_main.VALIDATE_SEGMENTS = validate
+        with HLSStandIn(segments=args.segments, segment_size=args.size, encrypt=HAS_CRYPTO,
+                        corrupt_rate=args.corrupt_rate) as server, tempfile.TemporaryDirectory() as tmp:
+            d = downloader_main.M3U8Downloader(server.playlist_url, f"bench_validate_{validate}", tmp)
+            d.temp_dir.mkdir(parents=True, exist_ok=True)
+            if not d.parse_m3u8():
+                raise RuntimeError("解析替身播放列表失败")
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                completed = d.download_all()
+            elapsed = time.perf_counter() - start
+            d.journal.close()
+            paths = [d.temp_dir / f"{i:05d}.ts" for i in range(server.segments)]
+            intact = sum(p.exists() and p.read_bytes() == server.plain_segment(i) for i, p in enumerate(paths))
+            results.append({
+                "validate": validate,
+                "segments": completed,
+                "intact": intact,
+                "corrupt_saved": sum(p.exists() for p in paths) - intact,
+                "served_corrupt": server.corrupted,
+                "seconds": round(elapsed, 3),
+                "report": d.integrity.summary(),
+            })
+
+    print("\n" + "=" * 72)
+    print("校验器吞吐: " + "，".join(f"{name} {mb} MB/s" for name, mb in throughput.items()))
+    print(f"{'校验':<8}{'成功':>8}{'完好':>8}{'损坏落盘':>10}{'服务端损坏':>12}{'耗时(s)':>10}")
+    for r in results:
+        print(f"{'开' if r['validate'] else '关':<8}{r['segments']:>8}{r['intact']:>8}"
+              f"{r['corrupt_saved']:>10}{r['served_corrupt']:>12}{r['seconds']:>10}")
+    print("=" * 72)
+    return {"throughput_mb_per_sec": throughput, "runs": results}
+
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def _e2e_worker(url, settings, queue):
+    """在独立进程中完整运行一节课（解析、下载、合并），CPU 和峰值 RSS 只统计下载器本身"""
+    import resource
+    from async_engine import AsyncSegmentEngine
+    for name, value in settings.items():
+        setattr(downloader_main, name, value)
+
+    latencies = []
+    original = AsyncSegmentEngine._download
+
+    async def timed_download(self, *args):
+        start = time.perf_counter()
+        try:
+            return await original(self, *args)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    AsyncSegmentEngine._download = timed_download
+
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        d = downloader_main.M3U8Downloader(url, "bench_e2e", tmp)
+        download_segment, download_all = d.download_segment, d.download_all
+        counts = {}
+
+        def timed_segment(segment):
+            t = time.perf_counter()
+            try:
+                return download_segment(segment)
+            finally:
+                latencies.append(time.perf_counter() - t)
+
+        d.download_segment = timed_segment
+        d.download_all = lambda: counts.setdefault("completed", download_all())
+        ok = d.run()
+        output_mb = d.final_mp4.stat().st_size / 1024 / 1024 if d.final_mp4.exists() else 0
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    queue.put({
+        "ok": ok,
+        "completed": counts.get("completed", 0),
+        "seconds": elapsed,
+        "cpu_seconds": (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime),
+        "peak_rss_mb": _max_rss_mb(resource.RUSAGE_SELF),
+        "latencies": latencies,
+        "output_mb": output_mb,
+        "integrity": d.integrity.summary(),
+        "token_refreshes": d.recovery.refreshes if d.recovery else 0,
+    })
+
+
+def _info_worker(url, mode, queue):
+    """在独立进程中运行 M3U8InfoGetter"""
+    from m3u8_info import M3U8InfoGetter
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        info = M3U8InfoGetter(mode=mode, max_workers=16, seed=0).get_m3u8_info(url)
+    queue.put({"mode": mode, "seconds": time.perf_counter() - start,
+               "size": info["size"] if info else None, "requests": info["requests"] if info else None})
+
+
+def _run_child(ctx, target, *args):
+    queue = ctx.Queue()
+    proc = ctx.Process(target=target, args=(*args, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def bench_e2e(args):
+    """
+    端到端基准：替身服务器提供主播放列表 + AES-128 分片，并注入延迟抖动、随机错误状态码和带宽上限，
+    分别用各下载引擎完整跑一节课，再用 M3U8InfoGetter 获取信息；结果带版本信息，便于跨版本对比
+    """
+    ctx = multiprocessing.get_context("spawn")
+    backend = args.merge_backend or ("ffmpeg" if shutil.which("ffmpeg") else "python")
+    standin = dict(segments=args.segments, segment_size=args.size, encrypt=HAS_CRYPTO, latency=args.latency,
+                   latency_jitter=args.jitter, error_rate=args.error_rate, bandwidth=args.bandwidth,
+                   size_jitter=0.2, token_ttl=args.token_ttl)
+    runs = []
+    info = []
+    with HLSStandIn(**standin) as server:
+        total_bytes = sum(len(server.segment(i)) for i in range(args.segments))
+        server.master_playlist()
+        for engine in args.engines:
+            settings = {"DOWNLOAD_ENGINE": engine, "MAX_THREADS": args.threads, "MERGE_BACKEND": backend}
+            errors_before = server.errors
+            r = _run_child(ctx, _e2e_worker, server.master_url, settings)
+            latencies = r.pop("latencies")
+            gb = total_bytes / 1e9
+            runs.append({
+                "engine": engine,
+                "ok": r["ok"],
+                "segments": r["completed"],
+                "seconds": round(r["seconds"], 3),
+                "mb_per_sec": round(total_bytes / r["seconds"] / 1024 / 1024, 2),
+                "segments_per_sec": round(r["completed"] / r["seconds"], 1),
+                "p50_ms": round(_percentile(latencies, 50) * 1000, 1) if latencies else None,
+                "p99_ms": round(_percentile(latencies, 99) * 1000, 1) if latencies else None,
+                "peak_rss_mb": round(r["peak_rss_mb"], 1),
+                "cpu_seconds": round(r["cpu_seconds"], 3),
+                "cpu_seconds_per_gb": round(r["cpu_seconds"] / gb, 2),
+                "injected_errors": server.errors - errors_before,
+                "output_mb": round(r["output_mb"], 1),
+                "integrity": r["integrity"],
+                "token_refreshes": r["token_refreshes"],
+            })
+        for mode in ("exact", "estimate"):
+            r = _run_child(ctx, _info_worker, server.master_url, mode)
+            r["error_pct"] = round(abs(r["size"] - total_bytes) / total_bytes * 100, 2) if r["size"] else None
+            r["seconds"] = round(r["seconds"], 3)
+            info.append(r)
+
+    result = {
+        "meta": {
+            "revision": _git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "config": {**standin, "threads": args.threads, "merge_backend": backend,
+                   "total_mb": round(total_bytes / 1024 / 1024, 2)},
+        "runs": runs,
+        "info": info,
+    }
+
+    print("\n" + "=" * 96)
+    print(f"{args.segments} 个分片，共 {result['config']['total_mb']} MB，错误率 {args.error_rate}，"
+          f"合并后端 {backend}，版本 {result['meta']['revision']}")
+    print(f"{'引擎':<8}{'成功':>6}{'耗时(s)':>10}{'MB/s':>8}{'分片/s':>8}{'p50(ms)':>10}{'p99(ms)':>10}"
+          f"{'RSS(MB)':>10}{'CPU s/GB':>10}{'注入错误':>10}")
+    for r in runs:
+        print(f"{r['engine']:<8}{r['segments']:>6}{r['seconds']:>10}{r['mb_per_sec']:>8}{r['segments_per_sec']:>8}"
+              f"{r['p50_ms']:>10}{r['p99_ms']:>10}{r['peak_rss_mb']:>10}{r['cpu_seconds_per_gb']:>10}"
+              f"{r['injected_errors']:>10}")
+    for r in info:
+        print(f"m3u8_info {r['mode']:<9} 耗时 {r['seconds']}s，请求 {r['requests']} 次，大小误差 {r['error_pct']}%")
+    print("=" * 96)
+    if args.baseline:
+        _compare_baseline(result, args.baseline)
+    return result
+
+
+def _compare_baseline(result, path):
+    """与之前保存的 JSON 结果对比，输出各引擎关键指标的变化"""
+    with open(path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    old_runs = {r["engine"]: r for r in baseline.get("runs", [])}
+    print(f"与基线 {path}（版本 {baseline.get('meta', {}).get('revision')}）对比:")
+    for r in result["runs"]:
+        old = old_runs.get(r["engine"])
+        if not old:
+            continue
+        changes = []
+        for key in ("mb_per_sec", "p99_ms", "peak_rss_mb", "cpu_seconds_per_gb"):
+            if old.get(key) and r.get(key) is not None:
+                changes.append(f"{key} {old[key]} -> {r[key]} ({(r[key] - old[key]) / old[key] * 100:+.1f}%)")
+        print(f"  {r['engine']}: " + "，".join(changes))
+
+
+def _remux_worker(backend, temp_dir, output_file, queue):
+    """在独立进程中合并，保证峰值 RSS 互不干扰"""
+    import resource
+    downloader_main.MERGE_BACKEND = backend
+    baseline = _max_rss_mb(resource.RUSAGE_SELF)
+    d = downloader_main.M3U8Downloader("http://127.0.0.1/index.m3u8", "bench", Path(temp_dir).parent)
+    d.temp_dir = Path(temp_dir)
+
+    start = time.perf_counter()
+    ok = d.merge_segments(Path(output_file))
+    elapsed = time.perf_counter() - start
+
+    if backend == "python":
+        peak = _max_rss_mb(resource.RUSAGE_SELF)
+    else:
+        peak = _max_rss_mb(resource.RUSAGE_CHILDREN)
+    queue.put({"ok": ok, "seconds": elapsed, "peak_rss_mb": peak, "baseline_rss_mb": baseline})
+
+
+def bench_remux(args):
+    """对比 ffmpeg 与纯 Python 合并后端的耗时和峰值内存"""
+    results = []
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        temp_dir = Path(tmp) / "temp_bench"
+        temp_dir.mkdir()
+        for i in range(args.segments):
+            (temp_dir / f"{i:05d}.ts").write_bytes(make_av_segment(i, args.size))
+        total_mb = sum(f.stat().st_size for f in temp_dir.glob("*.ts")) / 1024 / 1024
+
+        for backend in args.backends:
+            if backend == "ffmpeg" and not shutil.which("ffmpeg"):
+                print("⚠️ 未找到 ffmpeg，跳过 ffmpeg 后端")
+                continue
+            output_file = Path(tmp) / f"{backend}.mp4"
+            queue = ctx.Queue()
+            proc = ctx.Process(target=_remux_worker, args=(backend, str(temp_dir), str(output_file), queue))
+            proc.start()
+            r = queue.get()
+            proc.join()
+            results.append({
+                "backend": backend,
+                "ok": r["ok"],
+                "input_mb": round(total_mb, 1),
+                "seconds": round(r["seconds"], 3),
+                "mb_per_sec": round(total_mb / r["seconds"], 1),
+                "peak_rss_mb": round(r["peak_rss_mb"], 1),
+                "baseline_rss_mb": round(r["baseline_rss_mb"], 1),
+                "output_mb": round(output_file.stat().st_size / 1024 / 1024, 1) if output_file.exists() else 0,
+            })
+
+    print("\n" + "=" * 72)
+    print(f"{'后端':<10}{'输入MB':>10}{'耗时(s)':>10}{'MB/s':>10}{'峰值RSS(MB)':>14}{'输出MB':>10}")
+    for r in results:
+        print(f"{r['backend']:<10}{r['input_mb']:>10}{r['seconds']:>10}{r['mb_per_sec']:>10}"
+              f"{r['peak_rss_mb']:>14}{r['output_mb']:>10}")
+    print("=" * 72)
+    print("注: python 后端的峰值 RSS 包含解释器基线（见 JSON 中的 baseline_rss_mb）")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="xet_downloader 基准测试")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("engine", help="线程池引擎 vs async 引擎")
+    p.add_argument("--segments", type=int, default=400)
+    p.add_argument("--size", type=int, default=256 * 1024, help="分片字节数")
+    p.add_argument("--latency", type=float, default=0.05, help="每个分片的服务端延迟（秒）")
+    p.add_argument("--engines", nargs="+", default=["thread", "async"])
+    p.set_defaults(func=bench_engine)
+
+    p = sub.add_parser("remux", help="ffmpeg 合并 vs 纯 Python 转封装")
+    p.add_argument("--segments", type=int, default=200)
+    p.add_argument("--size", type=int, default=1024 * 1024, help="分片字节数")
+    p.add_argument("--backends", nargs="+", default=["ffmpeg", "python"])
+    p.set_defaults(func=bench_remux)
+
+    p = sub.add_parser("adaptive", help="固定线程数 vs 自适应并发（服务端限流）")
+    p.add_argument("--segments", type=int, default=400)
+    p.add_argument("--size", type=int, default=256 * 1024, help="分片字节数")
+    p.add_argument("--latency", type=float, default=0.1, help="每个分片的服务端延迟（秒）")
+    p.add_argument("--threads", type=int, default=32, help="固定模式的线程数 / 自适应模式的初始窗口")
+    p.add_argument("--max-concurrent", type=int, default=12, help="替身服务器的限流阈值")
+    p.set_defaults(func=bench_adaptive)
+
+    p = sub.add_parser("hedge", help="关闭 vs 开启慢分片对冲请求")
+    p.add_argument("--segments", type=int, default=400)
+    p.add_argument("--size", type=int, default=256 * 1024, help="分片字节数")
+    p.add_argument("--latency", type=float, default=0.05, help="每个分片的服务端延迟（秒）")
+    p.add_argument("--stall-rate", type=float, default=0.02, help="分片请求卡住的概率")
+    p.add_argument("--stall", type=float, default=8.0, help="卡住的时长（秒）")
+    p.set_defaults(func=bench_hedge)
+
+    p = sub.add_parser("estimate", help="m3u8_info 抽样估算 vs 逐个 HEAD")
+    p.add_argument("--segments", type=int, default=2700, help="分片数（默认约 3 小时）")
+    p.add_argument("--size", type=int, default=64 * 1024, help="分片平均字节数")
+    p.add_argument("--jitter", type=float, default=0.4, help="分片大小的相对波动幅度")
+    p.add_argument("--samples", type=int, default=30)
+    p.add_argument("--trials", type=int, default=20)
+    p.set_defaults(func=bench_estimate)
+
+    p = sub.add_parser("parser", help="播放列表解析耗时和内存")
+    p.add_argument("--segments", type=int, default=100000)
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_parser)
+
+    p = sub.add_parser("store", help="每个分片一个文件 vs 单文件容器存储")
+    p.add_argument("--segments", type=int, default=3000)
+    p.add_argument("--size", type=int, default=64 * 1024, help="分片字节数")
+    p.add_argument("--threads", type=int, default=16)
+    p.set_defaults(func=bench_store)
+
+    p = sub.add_parser("validate", help="分片完整性校验吞吐，损坏分片时开启 vs 关闭校验")
+    p.add_argument("--segments", type=int, default=300)
+    p.add_argument("--size", type=int, default=512 * 1024, help="分片字节数")
+    p.add_argument("--corrupt-rate", type=float, default=0.05, help="替身服务器返回损坏分片的概率")
+    p.add_argument("--repeat", type=int, default=50, help="吞吐测试的重复次数")
+    p.set_defaults(func=bench_validate)
+
+    p = sub.add_parser("pipeline", help="逐课运行 vs 解析/下载/合并/清理流水线")
+    p.add_argument("--lessons", type=int, default=4)
+    p.add_argument("--segments", type=int, default=100)
+    p.add_argument("--size", type=int, default=300 * 1024, help="分片字节数")
+    p.add_argument("--latency", type=float, default=0.05, help="每个分片的服务端延迟（秒）")
+    p.add_argument("--bandwidth", type=int, default=8 * 1024 * 1024, help="服务端总带宽上限（字节/秒）")
+    p.add_argument("--merge-workers", type=int, default=1)
+    p.add_argument("--merge-backend", choices=["ffmpeg", "python"], help="默认有 ffmpeg 时使用 ffmpeg")
+    p.set_defaults(func=bench_pipeline)
+
+    p = sub.add_parser("queue", help="SQLite 任务队列：1 个 vs 多个 worker 进程，可模拟 worker 崩溃")
+    p.add_argument("--lessons", type=int, default=8)
+    p.add_argument("--workers", type=int, default=3)
+    p.add_argument("--segments", type=int, default=60)
+    p.add_argument("--size", type=int, default=200 * 1024, help="分片字节数")
+    p.add_argument("--latency", type=float, default=0.05, help="每个分片的服务端延迟（秒）")
+    p.add_argument("--threads", type=int, default=4, help="每个 worker 的下载线程数")
+    p.add_argument("--lease", type=float, default=3, help="租约秒数")
+    p.add_argument("--kill-after", type=float, default=0, help="多 worker 时在该秒数后杀死第一个 worker，0 表示不杀")
+    p.add_argument("--merge-backend", choices=["ffmpeg", "python"], help="默认有 ffmpeg 时使用 ffmpeg")
+    p.set_defaults(func=bench_queue)
+
+    p = sub.add_parser("rendition", help="码率选择策略：最高码率 / 目标分辨率 / 磁盘预算 / 仅音频")
+    p.add_argument("--lessons", type=int, default=3)
+    p.add_argument("--segments", type=int, default=60)
+    p.add_argument("--size", type=int, default=512 * 1024, help="最高码率的分片字节数")
+    p.add_argument("--latency", type=float, default=0.02, help="每个分片的服务端延迟（秒）")
+    p.add_argument("--budget-ratio", type=float, default=0.5, help="磁盘预算占最高码率总字节数的比例")
+    p.add_argument("--merge-backend", choices=["ffmpeg", "python"], help="默认有 ffmpeg 时使用 ffmpeg")
+    p.set_defaults(func=bench_rendition)
+
+    p = sub.add_parser("e2e", help="端到端：主播放列表 + 加密 + 故障注入，完整下载合并并获取信息")
+    p.add_argument("--segments", type=int, default=300)
+    p.add_argument("--size", type=int, default=512 * 1024, help="分片平均字节数")
+    p.add_argument("--latency", type=float, default=0.02, help="每个分片的服务端延迟（秒）")
+    p.add_argument("--jitter", type=float, default=0.05, help="延迟的随机抖动上限（秒）")
+    p.add_argument("--error-rate", type=float, default=0.02, help="随机返回 403/429/5xx 的概率")
+    p.add_argument("--bandwidth", type=int, default=0, help="服务端总带宽上限（字节/秒），0 表示不限")
+    p.add_argument("--token-ttl", type=float, default=0, help="分片 URL 令牌的有效秒数（模拟下载中途令牌过期），0 表示不签名")
+    p.add_argument("--threads", type=int, default=16)
+    p.add_argument("--engines", nargs="+", default=["thread", "async"])
+    p.add_argument("--merge-backend", choices=["ffmpeg", "python"], help="默认有 ffmpeg 时使用 ffmpeg")
+    p.add_argument("--baseline", help="之前保存的 e2e JSON 结果，用于对比")
+    p.set_defaults(func=bench_e2e)
+
+    p = sub.add_parser("range", help="大分片拆分 Range 下载 / 相邻字节范围合并")
+    p.add_argument("--large-segments", type=int, default=2, help="大分片数量（少于线程数时单连接吞吐是瓶颈）")
+    p.add_argument("--large-size", type=int, default=24 * 1024 * 1024, help="大分片字节数")
+    p.add_argument("--rate", type=int, default=4 * 1024 * 1024, help="替身服务器单个响应的限速（字节/秒）")
+    p.add_argument("--segments", type=int, default=300, help="单文件字节范围播放列表的分片数")
+    p.add_argument("--size", type=int, default=128 * 1024, help="字节范围分片的字节数")
+    p.add_argument("--latency", type=float, default=0.05, help="每个请求的服务端延迟（秒）")
+    p.add_argument("--threads", type=int, default=4, help="下载线程数")
+    p.set_defaults(func=bench_range)
+
+    args = parser.parse_args()
+    results = args.func(args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+自适应并发控制（AIMD）
+
+固定的 MAX_THREADS 很难选：太高会招来 429 / 连接重置，再叠加重试和 sleep 造成长时间停顿；
+太低又用不满带宽，而且最佳值在一次运行中也会变化。
+AdaptiveLimiter 按采样周期统计吞吐、延迟和错误率，动态调整在途请求窗口：
+- 出现限流 / 连接类错误：立即把窗口乘以 DECREASE_FACTOR（乘性减），DECREASE_COOLDOWN 内只减一次
+- 延迟未明显膨胀且吞吐没有下降：窗口 +1（加性增）
+- 延迟膨胀且吞吐不再增长：窗口 -1
+每次调整都会写日志，便于事后调参。
+"""
+
+import logging
+import statistics
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = 2.0  # 采样周期（秒）
+MIN_SAMPLES = 4  # 周期内至少完成的请求数
+DECREASE_FACTOR = 0.7
+DECREASE_COOLDOWN = 1.0  # 两次乘性减之间的最短间隔（秒），同一波错误只减一次
+LATENCY_TOLERANCE = 2.0  # 延迟中位数超过基线的倍数视为膨胀
+THROUGHPUT_TOLERANCE = 0.95
+
+
+def classify_error(error):
+    """把异常归类为 throttle（限流 / 服务端过载）、network（连接 / 超时）或 other"""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) if response is not None else getattr(error, "status", None)
+    if status in (429, 503):
+        return "throttle"
+    if isinstance(status, int) and status >= 500:
+        return "throttle"
+    # aiohttp 的连接错误（ClientConnectorError 等）只在基类名里带 Connection
+    names = [cls.__name__ for cls in type(error).__mro__]
+    if any("Timeout" in name or "Connection" in name for name in names) \
+            or isinstance(error, (ConnectionError, TimeoutError)):
+        return "network"
+    return "other"
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial=8, minimum=2, maximum=64):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self.inflight = 0
+        self.cond = threading.Condition()
+        self.listeners = []  # release 后调用的回调（async 引擎借此唤醒等待名额的协程）
+
+        self.base_latency = None
+        self.last_throughput = 0.0
+        self.window_start = time.monotonic()
+        self.latencies = []
+        self.bytes = 0
+        self.errors = 0
+        self.last_decrease = 0.0
+        self.history = []  # (时间, 旧窗口, 新窗口, 原因)
+
+    def acquire(self):
+        with self.cond:
+            while self.inflight >= self.limit:
+                self.cond.wait()
+            self.inflight += 1
+
+    def try_acquire(self):
+        """不阻塞的 acquire，窗口已满时返回 False（async 引擎用，不能阻塞事件循环）"""
+        with self.cond:
+            if self.inflight >= self.limit:
+                return False
+            self.inflight += 1
+            return True
+
+    def release(self, latency, nbytes, error=None):
+        """结束一次请求；error 为异常对象或 None"""
+        with self.cond:
+            self.inflight -= 1
+            if error is None:
+                if nbytes:
+                    self.latencies.append(latency)
+                    self.bytes += nbytes
+            else:
+                kind = classify_error(error)
+                if kind in ("throttle", "network"):
+                    self.errors += 1
+                    self._backoff(kind)
+            self._maybe_adjust()
+            self.cond.notify_all()
+            listeners = list(self.listeners)
+        for callback in listeners:
+            callback()
+
+    def subscribe(self, callback):
+        """注册 release 回调；回调在释放名额的线程中执行，必须很快返回"""
+        with self.cond:
+            self.listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.cond:
+            self.listeners.remove(callback)
+
+    def _set_limit(self, new, reason, now, detail=""):
+        old = self.limit
+        if new != old:
+            self.history.append((now, old, new, reason))
+            logger.info(f"并发调整 {old} -> {new} ({reason}){detail}, 在途 {self.inflight}")
+        self.limit = new
+
+    def _backoff(self, kind):
+        """出错时立即乘性减，不等采样周期结束"""
+        now = time.monotonic()
+        if now - self.last_decrease < DECREASE_COOLDOWN:
+            return
+        self.last_decrease = now
+        self._set_limit(max(self.minimum, int(self.limit * DECREASE_FACTOR)),
+                        "限流" if kind == "throttle" else "网络错误", now)
+
+    def _maybe_adjust(self):
+        now = time.monotonic()
+        elapsed = now - self.window_start
+        if elapsed < SAMPLE_INTERVAL or (len(self.latencies) < MIN_SAMPLES and not self.errors):
+            return
+
+        throughput = self.bytes / elapsed
+        median = statistics.median(self.latencies) if self.latencies else None
+        if median is not None:
+            self.base_latency = median if self.base_latency is None else min(self.base_latency, median)
+        old = self.limit
+
+        if self.errors:
+            new = old  # 已在出错时降过窗口，本周期不再增长
+            reason = f"{self.errors} 个限流/网络错误"
+        elif median is not None and median > self.base_latency * LATENCY_TOLERANCE \
+                and throughput < self.last_throughput / THROUGHPUT_TOLERANCE:
+            new = max(self.minimum, old - 1)
+            reason = "延迟膨胀且吞吐未增长"
+        elif throughput >= self.last_throughput * THROUGHPUT_TOLERANCE:
+            new = min(self.maximum, old + 1)
+            reason = "吞吐稳定或上升"
+        else:
+            new = old
+            reason = "吞吐下降，保持"
+
+        self._set_limit(new, reason, now,
+                        f": 吞吐 {throughput / 1024 / 1024:.2f} MB/s, 延迟中位数 {median or 0:.2f}s "
+                        f"(基线 {self.base_latency or 0:.2f}s)")
+        self.last_throughput = throughput
+        self.window_start = now
+        self.latencies = []
+        self.bytes = 0
+        self.errors = 0
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_limiter(initial, minimum, maximum):
+    """进程内共享的限流器，学到的窗口可以延续到下一节课"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = AdaptiveLimiter(initial, minimum, maximum)
+        return _shared
+
+
+def reset():
+    """丢弃共享的限流器，下次 shared_limiter 从初始窗口重新开始（基准测试在各轮之间调用）"""
+    global _shared
+    with _shared_lock:
+        _shared = None
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+常驻下载服务
+
+以前的流程是：油猴脚本「导出本课」-> 保存 m3u8_list.json -> 启动 python main.py，
+每次运行都要重新导入模块、探测 ffmpeg、建立连接，还要把整个列表重新过一遍。
+常驻模式只启动一次，连接池、DNS 缓存、密钥缓存和流水线线程一直保持，课程通过本机 HTTP 接口提交后立即开始下载：
+
+    POST /lessons   提交 {"title": ..., "m3u8": ...} 或其列表，返回每节课是否受理
+    GET  /status    队列、进行中课程的进度、完成 / 失败数和吞吐
+    GET  /metrics   Prometheus 文本格式指标（同 METRICS_PORT）
+
+提交的课程按去掉签名参数的 URL + 标题去重：排队或下载中的课程只更新地址（令牌过期刷新时使用），
+已完成或输出文件已存在的课程直接忽略。只监听 127.0.0.1，且只接受 Content-Type: application/json，
+网页中的脚本不经过 CORS 预检无法提交（油猴脚本用 GM_xmlhttpRequest 不受此限制）。
+Host 请求头必须是 127.0.0.1:<端口> 或 localhost:<端口>，否则返回 403：DNS 重绑定的域名解析到 127.0.0.1 后，
+浏览器发来的 Host 仍是该域名，据此拒绝。
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics
+from identity import lesson_identity
+from pipeline import LessonPipeline
+
+logger = logging.getLogger(__name__)
+
+THROUGHPUT_WINDOW = 60  # 近期吞吐的统计窗口（秒）
+MAX_BODY = 1024 * 1024
+
+
+class LessonDaemon:
+    def __init__(self, make_downloader, host="127.0.0.1", port=18710, **pipeline_options):
+        """
+        make_downloader(url, title, refresh_url) -> M3U8Downloader
+        pipeline_options: 传给 LessonPipeline 的各阶段线程数和队列容量
+        """
+        self.make_downloader = make_downloader
+        self.host = host
+        self.port = port
+        self.lock = threading.Lock()
+        self.lessons = {}  # 标识 -> {"title", "url", "state", "downloader", "submitted", "finished"}
+        self.keys = {}  # 进行中的 M3U8Downloader -> 标识
+        self.intake = queue.Queue()  # 待解析的 M3U8Downloader，None 表示停止
+        self.pipeline = LessonPipeline(iter(self.intake.get, None), on_result=self._finished,
+                                       **pipeline_options)
+        self.started = time.time()
+        self.finished_bytes = 0  # 已结束课程的下载字节数
+        self.samples = deque([(self.started, 0)])  # (时间, 累计字节数)，每次查询状态时采样
+        self.server = None
+        self.runner = None
+
+    def _key(self, url, title):
+        return lesson_identity(url, title)
+
+    def submit(self, tasks):
+        """受理课程，返回每节课的处理结果"""
+        results = []
+        for task in tasks:
+            title = task.get('title') or task.get('name') or "untitled_video"
+            url = task.get('m3u8')
+            if not url:
+                results.append({"title": title, "result": "invalid"})
+                continue
+            key = self._key(url, title)
+            with self.lock:
+                lesson = self.lessons.get(key)
+                if lesson and lesson["state"] in ("queued", "running"):
+                    lesson["url"] = url  # 新导出的地址带有新令牌
+                    results.append({"title": title, "result": "in_flight", "id": key})
+                    continue
+                if lesson and lesson["state"] in ("done", "skipped"):
+                    results.append({"title": title, "result": "done", "id": key})
+                    continue
+                downloader = self.make_downloader(url, title, lambda _title, key=key: self._latest_url(key))
+                if downloader.completed_entry() if downloader.index else downloader.final_mp4.exists():
+                    results.append({"title": title, "result": "done", "id": key})
+                    continue
+                self.lessons[key] = {"title": downloader.title, "url": url, "state": "queued",
+                                     "downloader": downloader, "submitted": time.time(), "finished": None}
+                self.keys[downloader] = key
+            self.intake.put(downloader)
+            logger.info(f"受理课程: {downloader.title}")
+            print(f"\n📨 已受理: {downloader.title}")
+            results.append({"title": title, "result": "accepted", "id": key})
+        return results
+
+    def _latest_url(self, key):
+        with self.lock:
+            return self.lessons[key]["url"]
+
+    def _finished(self, downloader, result):
+        with self.lock:
+            lesson = self.lessons[self.keys.pop(downloader)]
+            lesson["state"] = "done" if result == "success" else result
+            lesson["finished"] = time.time()
+            lesson["downloader"] = None  # 释放分片表等
+            lesson["bytes"] = downloader.metrics.bytes
+            self.finished_bytes += downloader.metrics.bytes
+
+    def _downloaded_bytes(self):
+        with self.lock:
+            return self.finished_bytes + sum(d.metrics.bytes for d in self.keys)
+
+    def throughput(self):
+        """(启动以来的平均吞吐, 最近 THROUGHPUT_WINDOW 秒的吞吐)，字节/秒"""
+        now = time.time()
+        total = self._downloaded_bytes()
+        with self.lock:
+            self.samples.append((now, total))
+            while len(self.samples) > 1 and now - self.samples[0][0] > THROUGHPUT_WINDOW:
+                self.samples.popleft()
+            first_time, first_bytes = self.samples[0]
+        recent = (total - first_bytes) / (now - first_time) if now > first_time else 0.0
+        return total / max(now - self.started, 1e-6), recent
+
+    def status(self):
+        average, recent = self.throughput()
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0, "skipped": 0}
+        lessons = []
+        with self.lock:
+            for key, lesson in self.lessons.items():
+                downloader = lesson["downloader"]
+                parsed = downloader is not None and len(downloader.segments) > 0
+                state = "running" if lesson["state"] == "queued" and parsed else lesson["state"]
+                counts[state] += 1
+                entry = {"id": key, "title": lesson["title"], "state": state}
+                if parsed:
+                    entry.update(segments=len(downloader.segments), completed=downloader.progress,
+                                 bytes=downloader.metrics.bytes)
+                elif "bytes" in lesson:
+                    entry["bytes"] = lesson["bytes"]
+                lessons.append(entry)
+        return {
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "counts": counts,
+            "intake_depth": self.intake.qsize(),
+            "throughput": {"average_bytes_per_second": round(average),
+                           "recent_bytes_per_second": round(recent), "window_seconds": THROUGHPUT_WINDOW},
+            "stages": self.pipeline.pipeline.stats(),
+            "lessons": lessons,
+        }
+
+    def _handler(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, code, payload, content_type="application/json; charset=utf-8"):
+                body = payload if isinstance(payload, bytes) else \
+                    json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _host_allowed(self):
+                """拒绝 Host 不是本机地址的请求（DNS 重绑定），返回是否放行"""
+                allowed = {f"{name}:{daemon.port}" for name in ("127.0.0.1", "localhost", daemon.host)}
+                if self.headers.get("Host", "").lower() in allowed:
+                    return True
+                logger.warning(f"拒绝 Host 为 {self.headers.get('Host')!r} 的请求: {self.command} {self.path}")
+                self._reply(403, {"error": "Host 必须为本机地址"})
+                return False
+
+            def do_GET(self):
+                if not self._host_allowed():
+                    return
+                path = self.path.split("?", 1)[0]
+                if path == "/status":
+                    self._reply(200, daemon.status())
+                elif path == "/metrics":
+                    self._reply(200, metrics.registry.prometheus().encode(),
+                                "text/plain; version=0.0.4; charset=utf-8")
+                else:
+                    self._reply(404, {"error": "not found"})
+
+            def do_POST(self):
+                if not self._host_allowed():
+                    return
+                if self.path.split("?", 1)[0] != "/lessons":
+                    self._reply(404, {"error": "not found"})
+                    return
+                if self.headers.get("Content-Type", "").split(";")[0].strip() != "application/json":
+                    self._reply(415, {"error": "Content-Type 必须为 application/json"})
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > MAX_BODY:
+                    self._reply(413, {"error": "请求体过大"})
+                    return
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"null")
+                except ValueError:
+                    self._reply(400, {"error": "JSON 格式错误"})
+                    return
+                tasks = payload if isinstance(payload, list) else [payload]
+                if not all(isinstance(task, dict) for task in tasks):
+                    self._reply(400, {"error": "需要 {\"title\", \"m3u8\"} 对象或其列表"})
+                    return
+                results = daemon.submit(tasks)
+                accepted = any(r["result"] == "accepted" for r in results)
+                self._reply(202 if accepted else 200, {"results": results})
+
+        return Handler
+
+    def start(self):
+        """启动流水线和 HTTP 接口，返回实际监听的端口"""
+        self.runner = threading.Thread(target=self.pipeline.run, name="daemon-pipeline", daemon=True)
+        self.runner.start()
+        self.server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="daemon-http", daemon=True).start()
+        self.port = self.server.server_address[1]
+        logger.info(f"常驻服务: http://{self.host}:{self.port}")
+        return self.port
+
+    def stop(self, wait=True):
+        """停止接收新课程；wait 时等待已受理的课程全部完成"""
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        self.intake.put(None)
+        if wait and self.runner:
+            self.runner.join()
+
+
+if __name__ == "__main__":
+    import main as downloader_main
+    downloader_main.run_daemon()
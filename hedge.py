@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+慢分片对冲请求
+
+一节课的完成时间取决于最慢的几个分片：某个 CDN 节点卡住时，整个 as_completed 循环和随后的合并都要等它，
+而重试又要先等满 DOWNLOAD_TIMEOUT。
+HedgeController 记录分片耗时，请求超过耗时分位数阈值仍未完成时再发一个相同的请求，先完成的一方胜出：
+- 两个请求写入各自的临时文件，只有抢到 HedgeRace 的一方提交结果（改名 / 写入合并管道 / 记入续传日志）
+- 样本不足（尚未武装）或预算用完时，等待中的请求定期复查，之后仍可对冲：开头一批并发请求里的慢分片也能被对冲
+- 对冲请求数不超过已发请求数 × budget
+- 一方胜出时立即关闭落败方登记的响应（attach），落败方的读取出错退出；还在等响应头的落败方收到响应头后立即停止。
+  落败的主请求被提前取消时，节省的尾延迟按它的结束时间计算（下限）
+- close() 等待仍未退出的落败请求，之后才能清理临时目录
+- 只有胜出的一方记入完整性报告
+"""
+
+import logging
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed
+
+logger = logging.getLogger(__name__)
+
+MIN_SAMPLES = 20  # 采样足够后才开始对冲
+ARM_POLL = 0.05  # 样本不足或预算用完时，等待中的请求复查阈值和预算的间隔（秒）
+SAMPLE_WINDOW = 500  # 参与分位数计算的最近耗时样本数
+
+
+class HedgeAbandoned(Exception):
+    """对方已胜出，落败的请求提前结束"""
+
+
+class HedgeRace:
+    """同一分片的主请求与对冲请求之间的仲裁"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.winner = None
+        self.finished = {}  # 标签 -> 结束时间
+        self.responses = {}  # 标签 -> 进行中的响应，对方胜出时关闭
+
+    def abandoned(self, tag):
+        """对方已胜出：落败的请求不必再下载（写入时检查）"""
+        return self.winner not in (None, tag)
+
+    def attach(self, tag, response):
+        """登记进行中的响应，对方胜出时由 claim() 关闭；已经落败时直接抛出 HedgeAbandoned"""
+        with self.lock:
+            if not self.abandoned(tag):
+                self.responses[tag] = response
+                return
+        raise HedgeAbandoned(tag)
+
+    def claim(self, tag):
+        """下载完成后调用，只有第一个调用者返回 True，并关闭落败方的响应"""
+        with self.lock:
+            if self.winner is not None:
+                return False
+            self.winner = tag
+            losers = [response for other, response in self.responses.items() if other != tag]
+            self.responses.clear()
+        for response in losers:
+            try:
+                response.close()
+            except Exception as e:
+                logger.debug(f"关闭落败请求的响应失败: {e}")
+        return True
+
+
+class HedgeController:
+    def __init__(self, percentile=95, budget=0.05, min_delay=1.0, workers=16):
+        """
+        percentile: 超过该耗时分位数仍未完成的请求会被对冲
+        budget: 对冲请求数占已发请求数的上限比例
+        min_delay: 对冲阈值下限（秒），避免在很快的网络上频繁对冲
+        workers: 执行请求的线程数
+        """
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hedge")
+        self.lock = threading.Lock()
+
+        self.samples = deque(maxlen=SAMPLE_WINDOW)
+        self.requests = 0
+        self.fired = 0
+        self.wins = 0
+        self.races = []  # 触发了对冲的 HedgeRace
+        self.primary_latency = []  # 不对冲时每个分片的耗时（主请求）
+        self.effective_latency = []  # 实际耗时（胜出一方）
+
+    def threshold(self):
+        """当前对冲阈值（秒），样本不足时返回 None"""
+        with self.lock:
+            if len(self.samples) < MIN_SAMPLES:
+                return None
+            cut = statistics.quantiles(self.samples, n=100)[self.percentile - 1]
+        return max(cut, self.min_delay)
+
+    def _spend(self):
+        with self.lock:
+            if self.fired + 1 > self.requests * self.budget:
+                return False
+            self.fired += 1
+            return True
+
+    def _timed(self, fetch, race, tag):
+        try:
+            size = fetch(race, tag)
+        finally:
+            end = race.finished[tag] = time.perf_counter()
+        if tag == "primary" and size:
+            with self.lock:
+                self.samples.append(end - race.start)
+        return size
+
+    def _settled(self, race):
+        """一个分片的请求全部结束（或胜出）后记录耗时"""
+        with self.lock:
+            if race.winner is None:
+                return
+            primary_end = race.finished.get("primary")
+            if primary_end is not None:
+                self.primary_latency.append(primary_end - race.start)
+            self.effective_latency.append(race.finished[race.winner] - race.start)
+
+    def run(self, fetch):
+        """
+        fetch(race, tag) 执行一次下载，完成后须先 race.claim(tag) 再提交结果，返回写入的字节数；
+        拿到响应后用 race.attach(tag, response) 登记，写入过程中 race.abandoned(tag) 为真时应抛出 HedgeAbandoned
+        返回胜出一方的字节数，两方都失败时抛出第一个异常
+        """
+        race = HedgeRace()
+        with self.lock:
+            self.requests += 1
+        primary = self.pool.submit(self._timed, fetch, race, "primary")
+        while True:
+            # 阈值和预算都在等待过程中复查：请求开始时样本不足或预算用完，不代表之后不能对冲
+            limit = self.threshold()
+            elapsed = time.perf_counter() - race.start
+            if limit is not None and elapsed >= limit and self._spend():
+                break
+            try:
+                size = primary.result(timeout=ARM_POLL if limit is None or elapsed >= limit else limit - elapsed)
+                self._settled(race)
+                return size
+            except FutureTimeout:
+                continue
+
+        logger.debug(f"触发对冲请求（已等待 {time.perf_counter() - race.start:.1f}s）")
+        with self.lock:
+            self.races.append(race)
+        hedge = self.pool.submit(self._timed, fetch, race, "hedge")
+        primary.add_done_callback(lambda _: self._settled(race) if race.winner == "hedge" else None)
+
+        error = None
+        for future in as_completed((primary, hedge)):
+            try:
+                size = future.result()
+            except Exception as e:
+                error = error or e
+                continue
+            if size:
+                if race.winner == "hedge":
+                    with self.lock:
+                        self.wins += 1
+                else:
+                    self._settled(race)
+                return size
+        if error:
+            raise error
+        return 0
+
+    def stats(self):
+        """对冲统计；主请求仍未结束或被提前取消的，按当前时间 / 取消时间计算节省量（下限）"""
+        now = time.perf_counter()
+        with self.lock:
+            saved = 0.0
+            primary = list(self.primary_latency)
+            effective = list(self.effective_latency)
+            for race in self.races:
+                if race.winner != "hedge":
+                    continue
+                saved += race.finished.get("primary", now) - race.finished["hedge"]
+                if "primary" not in race.finished:
+                    primary.append(now - race.start)
+                    effective.append(race.finished["hedge"] - race.start)
+            primary.sort()
+            effective.sort()
+
+        def p99(values):
+            return values[min(len(values) - 1, int(len(values) * 0.99))] if values else 0.0
+
+        return {
+            "requests": self.requests,
+            "hedges": self.fired,
+            "hedge_wins": self.wins,
+            "saved_seconds": round(saved, 2),
+            "p99_primary": round(p99(primary), 2),
+            "p99_effective": round(p99(effective), 2),
+        }
+
+    def close(self):
+        """等待仍在进行的落败请求退出，之后不会再有请求写入临时目录"""
+        self.pool.shutdown(wait=True)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+单遍 HLS 播放列表解析器（main.py 和 m3u8_info.py 共用）
+
+逐行扫描一次，标签状态（时长、字节范围、当前密钥、不连续标记）随行推进，遇到 URI 行时落一条分片记录。
+分片不再是一个个 dict，而是存放在 SegmentTable 的并列数组里：
+    时长 / 媒体序列号 / URI 在拼接字符串中的偏移 / 字节范围 / 密钥编号 / 不连续序号
+10 万个分片只占几 MB，按下标访问时才生成带 __slots__ 的 Segment 视图并拼出完整 URL。
+
+支持: EXT-X-MEDIA-SEQUENCE、EXT-X-DISCONTINUITY(-SEQUENCE)、EXT-X-BYTERANGE（含省略偏移）、
+EXT-X-KEY 轮换（METHOD=NONE 取消加密）、EXT-X-MAP、EXT-X-STREAM-INF（含 AVERAGE-BANDWIDTH）、
+EXT-X-MEDIA（独立音频 / 字幕轨）
+"""
+
+import re
+from array import array
+from urllib.parse import urljoin
+
+_ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def parse_attributes(text):
+    """解析属性列表 KEY=VALUE,KEY="VALUE"，返回 dict（去掉引号）"""
+    return {k: v[1:-1] if v.startswith('"') else v for k, v in _ATTR_RE.findall(text)}
+
+
+class KeyInfo:
+    """一个 EXT-X-KEY 标签"""
+
+    __slots__ = ("method", "uri", "iv", "key_format")
+
+    def __init__(self, method, uri, iv, key_format):
+        self.method = method
+        self.uri = uri  # 已解析为绝对 URL
+        self.iv = iv  # bytes，未指定时为 None（使用媒体序列号）
+        self.key_format = key_format
+
+    def __repr__(self):
+        return f"KeyInfo({self.method}, {self.uri})"
+
+
+class Variant:
+    """主播放列表中的一个码率"""
+
+    __slots__ = ("url", "bandwidth", "average_bandwidth", "resolution", "codecs", "audio")
+
+    def __init__(self, url, bandwidth, average_bandwidth, resolution, codecs, audio=None):
+        self.url = url
+        self.bandwidth = bandwidth
+        self.average_bandwidth = average_bandwidth
+        self.resolution = resolution  # (宽, 高) 或 None
+        self.codecs = codecs
+        self.audio = audio  # 引用的 EXT-X-MEDIA 音频组 GROUP-ID
+
+    @property
+    def audio_only(self):
+        """CODECS 只含音频编码（例如 "mp4a.40.2"）"""
+        return bool(self.codecs) and all(c.strip().startswith(("mp4a", "ac-3", "ec-3", "opus", "flac"))
+                                         for c in self.codecs.split(","))
+
+    def __repr__(self):
+        return f"Variant({self.bandwidth}, {self.url})"
+
+
+class Rendition:
+    """主播放列表中的一个 EXT-X-MEDIA 标签（独立的音频 / 字幕轨）"""
+
+    __slots__ = ("type", "group", "name", "language", "default", "url")
+
+    def __init__(self, type, group, name, language, default, url):
+        self.type = type  # AUDIO / VIDEO / SUBTITLES / CLOSED-CAPTIONS
+        self.group = group
+        self.name = name
+        self.language = language
+        self.default = default
+        self.url = url  # 已解析为绝对 URL；没有 URI 时为 None（音频混在码率流中）
+
+    def __repr__(self):
+        return f"Rendition({self.type}, {self.group}, {self.name}, {self.url})"
+
+
+class Segment:
+    """SegmentTable 中一条记录的只读视图"""
+
+    __slots__ = ("index", "sequence", "url", "duration", "byterange", "key", "discontinuity")
+
+    def __init__(self, index, sequence, url, duration, byterange, key, discontinuity):
+        self.index = index  # 0 起的下标（临时文件名、合并顺序）
+        self.sequence = sequence  # 媒体序列号（默认 IV）
+        self.url = url
+        self.duration = duration
+        self.byterange = byterange  # (偏移, 长度) 或 None
+        self.key = key  # KeyInfo 或 None
+        self.discontinuity = discontinuity  # 不连续序号
+
+    @property
+    def range_header(self):
+        """字节范围对应的 Range 请求头，没有时为 None"""
+        if self.byterange is None:
+            return None
+        offset, length = self.byterange
+        return {"Range": f"bytes={offset}-{offset + length - 1}"}
+
+    def __repr__(self):
+        return f"Segment({self.index}, seq={self.sequence}, {self.url})"
+
+
+class SegmentTable:
+    """用并列数组保存的分片表"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.durations = array('d')
+        self.sequences = array('q')
+        self.uri_offsets = array('I', [0])  # 第 i 个 URI 为 uris[uri_offsets[i]:uri_offsets[i + 1]]
+        self.range_offsets = array('q')  # -1 表示没有字节范围
+        self.range_lengths = array('q')
+        self.key_ids = array('i')  # -1 表示不加密
+        self.discontinuities = array('I')
+        self.keys = []  # 密钥编号 -> KeyInfo
+        self.map_uri = None  # EXT-X-MAP 初始化分片
+        self.uris = ""
+        self._uri_parts = []
+        self._uri_length = 0
+
+    def _append(self, uri, duration, sequence, byterange, key_id, discontinuity):
+        self._uri_parts.append(uri)
+        self._uri_length += len(uri)
+        self.uri_offsets.append(self._uri_length)
+        self.durations.append(duration)
+        self.sequences.append(sequence)
+        if byterange:
+            self.range_offsets.append(byterange[0])
+            self.range_lengths.append(byterange[1])
+        else:
+            self.range_offsets.append(-1)
+            self.range_lengths.append(0)
+        self.key_ids.append(key_id)
+        self.discontinuities.append(discontinuity)
+
+    def _seal(self):
+        self.uris = "".join(self._uri_parts)
+        self._uri_parts = []
+
+    def __len__(self):
+        return len(self.durations)
+
+    def uri(self, i):
+        """第 i 个分片的绝对 URL"""
+        return urljoin(self.base_url, self.uris[self.uri_offsets[i]:self.uri_offsets[i + 1]])
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        offset = self.range_offsets[i]
+        key_id = self.key_ids[i]
+        return Segment(i, self.sequences[i], self.uri(i), self.durations[i],
+                       (offset, self.range_lengths[i]) if offset >= 0 else None,
+                       self.keys[key_id] if key_id >= 0 else None,
+                       self.discontinuities[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def total_duration(self):
+        return sum(self.durations)
+
+    def nbytes(self):
+        """数组和 URI 字符串占用的字节数（近似）"""
+        arrays = (self.durations, self.sequences, self.uri_offsets, self.range_offsets,
+                  self.range_lengths, self.key_ids, self.discontinuities)
+        return sum(a.itemsize * len(a) for a in arrays) + len(self.uris.encode("utf-8"))
+
+
+class Playlist:
+    __slots__ = ("url", "variants", "media", "segments", "target_duration", "media_sequence", "endlist", "version")
+
+    def __init__(self, url):
+        self.url = url
+        self.variants = []
+        self.media = []  # EXT-X-MEDIA
+        self.segments = SegmentTable(url)
+        self.target_duration = None
+        self.media_sequence = 0
+        self.endlist = False
+        self.version = None
+
+    @property
+    def is_master(self):
+        return bool(self.variants)
+
+    def best_variant(self):
+        """带宽最高的码率"""
+        return max(self.variants, key=lambda v: v.bandwidth) if self.variants else None
+
+
+def _parse_byterange(value, last_end):
+    """EXT-X-BYTERANGE:<长度>[@<偏移>]，省略偏移时紧接同一资源的上一个范围"""
+    length, _, offset = value.partition("@")
+    return (int(offset) if offset else last_end), int(length)
+
+
+def parse_playlist(lines, url):
+    """
+    单遍解析播放列表
+    lines: 文本或可迭代的行（例如 response.iter_lines(decode_unicode=True)）
+    url: 播放列表地址，用于解析相对 URI
+    """
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+
+    playlist = Playlist(url)
+    table = playlist.segments
+    sequence = 0
+    discontinuity = 0
+    duration = None
+    byterange = None
+    key_id = -1
+    stream_inf = None
+    last_range_end = {}  # URI -> 上一个字节范围的结束位置
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        if line[0] != "#":
+            if stream_inf is not None:
+                resolution = stream_inf.get("RESOLUTION", "")
+                width, _, height = resolution.partition("x")
+                average = stream_inf.get("AVERAGE-BANDWIDTH")
+                playlist.variants.append(Variant(
+                    urljoin(url, line),
+                    int(stream_inf.get("BANDWIDTH", 0) or 0),
+                    int(average) if average else None,
+                    (int(width), int(height)) if width.isdigit() and height.isdigit() else None,
+                    stream_inf.get("CODECS"),
+                    stream_inf.get("AUDIO")))
+                stream_inf = None
+            elif duration is not None:
+                if byterange is not None:
+                    byterange = _parse_byterange(byterange, last_range_end.get(line, 0))
+                    last_range_end[line] = byterange[0] + byterange[1]
+                table._append(line, duration, sequence, byterange, key_id, discontinuity)
+                sequence += 1
+                duration = byterange = None
+            continue
+
+        tag, _, value = line.partition(":")
+        if tag == "#EXTINF":
+            duration = float(value.split(",", 1)[0] or 0)
+        elif tag == "#EXT-X-BYTERANGE":
+            byterange = value
+        elif tag == "#EXT-X-KEY":
+            attrs = parse_attributes(value)
+            method = attrs.get("METHOD", "NONE").upper()
+            if method == "NONE":
+                key_id = -1
+            else:
+                iv = attrs.get("IV")
+                table.keys.append(KeyInfo(method, urljoin(url, attrs.get("URI", "")),
+                                          bytes.fromhex(iv[2:]) if iv and iv[:2].lower() == "0x" else None,
+                                          attrs.get("KEYFORMAT", "identity")))
+                key_id = len(table.keys) - 1
+        elif tag == "#EXT-X-DISCONTINUITY":
+            discontinuity += 1
+        elif tag == "#EXT-X-MEDIA-SEQUENCE":
+            sequence = playlist.media_sequence = int(value)
+        elif tag == "#EXT-X-DISCONTINUITY-SEQUENCE":
+            discontinuity = int(value)
+        elif tag == "#EXT-X-STREAM-INF":
+            stream_inf = parse_attributes(value)
+        elif tag == "#EXT-X-MEDIA":
+            attrs = parse_attributes(value)
+            uri = attrs.get("URI")
+            playlist.media.append(Rendition(attrs.get("TYPE", "").upper(), attrs.get("GROUP-ID"),
+                                            attrs.get("NAME"), attrs.get("LANGUAGE"),
+                                            attrs.get("DEFAULT", "NO").upper() == "YES",
+                                            urljoin(url, uri) if uri else None))
+        elif tag == "#EXT-X-MAP":
+            table.map_uri = urljoin(url, parse_attributes(value).get("URI", ""))
+        elif tag == "#EXT-X-TARGETDURATION":
+            playlist.target_duration = float(value)
+        elif tag == "#EXT-X-VERSION":
+            playlist.version = int(value)
+        elif tag == "#EXT-X-ENDLIST":
+            playlist.endlist = True
+
+    table._seal()
+    return playlist
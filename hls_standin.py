@@ -0,0 +1,574 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地 HLS 替身服务器（仅用于基准测试，不访问真实课程 CDN）
+
+提供:
+- /master.m3u8      主播放列表（单一码率，带 BANDWIDTH / AVERAGE-BANDWIDTH；指定 ladder 时为多码率 + 独立音频轨）
+- /rN/index.m3u8    多码率模式下第 N 档码率的媒体播放列表，分片为 /rN/seg/NNNNN.ts
+- /audio/index.m3u8 EXT-X-MEDIA 独立音频轨（纯 AAC 的 TS 分片 /audio/seg/NNNNN.ts）
+- /index.m3u8       媒体播放列表
+- /seg/NNNNN.ts     合成的 MPEG-TS 分片（H.264 + AAC 封装，负载为填充数据）
+- /media.ts         单文件模式下所有分片拼成的一个文件（播放列表用 EXT-X-BYTERANGE 寻址）
+- /key.bin          AES-128 密钥（启用加密时；启用密钥轮换时为 /key/N.bin）
+分片和 /media.ts 支持 Range 请求（206），可以关闭以模拟不支持 Range 的服务器
+可注入的故障: 固定延迟 + 随机抖动、限流 429、随机 403/429/5xx、慢节点、损坏分片、单连接限速和总带宽上限、
+防盗链令牌过期（分片和密钥 URL 带 t / sign 参数）
+"""
+
+import hashlib
+import math
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+# 引入加密库（仅在启用加密时需要）
+try:
+    from Crypto.Cipher import AES
+    from Crypto.Util.Padding import pad
+
+    HAS_CRYPTO = True
+except ImportError:
+    HAS_CRYPTO = False
+
+TS_PACKET_SIZE = 188
+SEGMENT_DURATION = 4.0
+
+# 合成音视频流参数（H.264 Baseline 640x360 + AAC-LC 44.1kHz 立体声）
+PMT_PID = 0x1000
+VIDEO_PID = 0x100
+AUDIO_PID = 0x101
+VIDEO_FPS = 25
+AUDIO_RATE = 44100
+AUDIO_FRAME_BYTES = 186  # 约 64 kbps
+SPS = bytes.fromhex("6742c01ed900a02ff97011000003000100000300320f162e48")
+PPS = bytes.fromhex("68cb83cb20")
+SILENT_AAC = bytes([0x21, 0x00, 0x49, 0x90, 0x02, 0x19, 0x00, 0x23, 0x80])  # AAC-LC 立体声静音帧
+START_PTS = 126000  # 与 ffmpeg 一致，从 1.4 秒开始
+
+
+def _crc32_mpeg(data):
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+            crc &= 0xFFFFFFFF
+    return crc
+
+
+def _psi_packet(pid, table_id, body):
+    """单个 TS 包承载的 PSI 表（PAT / PMT）"""
+    section = bytes([table_id, 0xB0 | ((len(body) + 9) >> 8), (len(body) + 9) & 0xFF,
+                     0x00, 0x01, 0xC1, 0x00, 0x00]) + body
+    section += _crc32_mpeg(section).to_bytes(4, 'big')
+    packet = bytes([0x47, 0x40 | (pid >> 8), pid & 0xFF, 0x10, 0x00]) + section
+    return packet + b'\xff' * (TS_PACKET_SIZE - len(packet))
+
+
+PAT = _psi_packet(0, 0x00, bytes([0x00, 0x01, 0xE0 | (PMT_PID >> 8), PMT_PID & 0xFF]))
+PMT = _psi_packet(PMT_PID, 0x02, bytes([
+    0xE0 | (VIDEO_PID >> 8), VIDEO_PID & 0xFF, 0xF0, 0x00,  # PCR PID，无节目描述
+    0x1B, 0xE0 | (VIDEO_PID >> 8), VIDEO_PID & 0xFF, 0xF0, 0x00,  # H.264
+    0x0F, 0xE0 | (AUDIO_PID >> 8), AUDIO_PID & 0xFF, 0xF0, 0x00,  # AAC (ADTS)
+]))
+AUDIO_PMT = _psi_packet(PMT_PID, 0x02, bytes([
+    0xE0 | (AUDIO_PID >> 8), AUDIO_PID & 0xFF, 0xF0, 0x00,  # 纯音频：PCR 在音频 PID 上
+    0x0F, 0xE0 | (AUDIO_PID >> 8), AUDIO_PID & 0xFF, 0xF0, 0x00,
+]))
+
+
+def _pes_timestamp(marker, ts):
+    return bytes([(marker << 4) | (((ts >> 30) & 0x07) << 1) | 1,
+                  (ts >> 22) & 0xFF, (((ts >> 15) & 0x7F) << 1) | 1,
+                  (ts >> 7) & 0xFF, ((ts & 0x7F) << 1) | 1])
+
+
+def _packetize(pid, stream_id, pts, payload, counters, pcr=False):
+    """把一个 PES 切分为 TS 包"""
+    header = _pes_timestamp(0x2, pts)
+    length = len(payload) + 3 + len(header)
+    pes = (b'\x00\x00\x01' + bytes([stream_id]) + (length if length <= 0xFFFF else 0).to_bytes(2, 'big')
+           + bytes([0x80, 0x80, len(header)]) + header + payload)
+
+    packets = []
+    pos = 0
+    while pos < len(pes):
+        first = pos == 0
+        adaptation = b''
+        if first and pcr:
+            base = pts - 9000
+            adaptation = bytes([0x10, (base >> 25) & 0xFF, (base >> 17) & 0xFF, (base >> 9) & 0xFF,
+                                (base >> 1) & 0xFF, ((base & 1) << 7) | 0x7E, 0x00])
+        room = TS_PACKET_SIZE - 4 - (len(adaptation) + 1 if adaptation else 0)
+        chunk = pes[pos:pos + room]
+        if len(chunk) < room:
+            # 最后一个包用自适应字段填充
+            stuffing = room - len(chunk)
+            if adaptation:
+                adaptation += b'\xff' * stuffing
+            elif stuffing == 1:
+                adaptation, chunk = b'', chunk  # 长度为 0 的自适应字段
+            else:
+                adaptation = b'\x00' + b'\xff' * (stuffing - 2)
+        pos += len(chunk)
+
+        cc = counters[pid]
+        counters[pid] = (cc + 1) & 0x0F
+        afc = 0x30 if adaptation or len(chunk) < TS_PACKET_SIZE - 4 else 0x10
+        header_bytes = bytes([0x47, (0x40 if first else 0x00) | (pid >> 8), pid & 0xFF, afc | cc])
+        if afc == 0x30:
+            field = bytes([len(adaptation)]) + adaptation
+            packets.append(header_bytes + field + chunk)
+        else:
+            packets.append(header_bytes + chunk)
+    return packets
+
+
+def _adts_frame():
+    adts_header = bytearray([0xFF, 0xF1, 0x50, 0x80, 0x00, 0x1F, 0xFC])  # LC, 44.1kHz, 2ch
+    frame_len = AUDIO_FRAME_BYTES + 7
+    adts_header[3] |= (frame_len >> 11) & 0x03
+    adts_header[4] = (frame_len >> 3) & 0xFF
+    adts_header[5] = ((frame_len & 0x07) << 5) | 0x1F
+    return bytes(adts_header) + SILENT_AAC.ljust(AUDIO_FRAME_BYTES, b'\x00')
+
+
+def make_audio_segment(index, duration=SEGMENT_DURATION):
+    """生成纯 AAC 的 MPEG-TS 分片（EXT-X-MEDIA 音频轨），时间戳与 make_av_segment 对齐"""
+    counters = {AUDIO_PID: 0}
+    start = START_PTS + int(index * duration * 90000)
+    audio_frames = int(duration * AUDIO_RATE / 1024)
+    adts_frame = _adts_frame()
+    packets = [PAT, AUDIO_PMT]
+    for i in range(0, audio_frames, 5):
+        n = min(5, audio_frames - i)
+        pts = start + i * 1024 * 90000 // AUDIO_RATE
+        packets += _packetize(AUDIO_PID, 0xC0, pts, adts_frame * n, counters, pcr=True)
+    return b''.join(packets)
+
+
+def make_av_segment(index, size, duration=SEGMENT_DURATION):
+    """
+    生成约 size 字节的合成 MPEG-TS 分片（真实的 TS/PES/H.264/ADTS 封装，负载为填充数据）
+    index 决定时间戳，相邻分片的时间戳连续
+    """
+    counters = {VIDEO_PID: 0, AUDIO_PID: 0}
+    start = START_PTS + int(index * duration * 90000)
+    frames = int(duration * VIDEO_FPS)
+    audio_frames = int(duration * AUDIO_RATE / 1024)
+    audio_bytes = audio_frames * (AUDIO_FRAME_BYTES + 7)
+    frame_bytes = max(64, int((size * 184 / TS_PACKET_SIZE - audio_bytes) / frames) - 32)
+
+    events = []
+    for i in range(frames):
+        pts = start + i * 90000 // VIDEO_FPS
+        au = b'\x00\x00\x00\x01\x09\xf0'
+        if i == 0:
+            au += b'\x00\x00\x00\x01' + SPS + b'\x00\x00\x00\x01' + PPS
+            au += b'\x00\x00\x01\x65' + b'\x88' * frame_bytes
+        else:
+            au += b'\x00\x00\x01\x41' + b'\x9a' * frame_bytes
+        events.append((pts, 0, au))
+
+    adts_frame = _adts_frame()
+    for i in range(0, audio_frames, 5):
+        n = min(5, audio_frames - i)
+        pts = start + i * 1024 * 90000 // AUDIO_RATE
+        events.append((pts, 1, adts_frame * n))
+
+    packets = [PAT, PMT]
+    for pts, kind, payload in sorted(events, key=lambda e: (e[0], e[1])):
+        if kind == 0:
+            packets += _packetize(VIDEO_PID, 0xE0, pts, payload, counters, pcr=True)
+        else:
+            packets += _packetize(AUDIO_PID, 0xC0, pts, payload, counters)
+    return b''.join(packets)
+
+
+@lru_cache(maxsize=32)
+def _cached_segment(index, size):
+    return make_av_segment(index, size)
+
+
+@lru_cache(maxsize=32)
+def _cached_audio_segment(index):
+    return make_audio_segment(index)
+
+
+class HLSStandIn:
+    def __init__(self, segments=100, segment_size=256 * 1024, latency=0.0, encrypt=False,
+                 host="127.0.0.1", port=0, max_concurrent=None, stall_rate=0.0, stall=0.0,
+                 size_jitter=0.0, key_period=0, media_sequence=0, single_file=False,
+                 accept_ranges=True, stream_rate=0, corrupt_rate=0.0, latency_jitter=0.0,
+                 error_rate=0.0, error_statuses=(403, 429, 500, 502, 503), bandwidth=0, token_ttl=0,
+                 ladder=None, audio_rendition=False):
+        """
+        segments: 分片数量
+        segment_size: 每个分片字节数
+        latency: 每个分片请求的附加延迟（秒）
+        encrypt: 是否使用 AES-128 加密分片
+        max_concurrent: 同时处理的分片请求超过该值时返回 429（模拟 CDN 限流）
+        stall_rate / stall: 以 stall_rate 的概率让分片请求额外卡住 stall 秒（模拟慢节点）
+        size_jitter: 分片大小的相对波动幅度（随内容缓慢变化 + 随机噪声），0 表示大小相同
+        key_period: 每隔多少个分片换一个密钥（0 表示不轮换）
+        media_sequence: 第一个分片的媒体序列号（未指定 IV 时即解密 IV）
+        single_file: 所有分片拼成一个 /media.ts，播放列表用 EXT-X-BYTERANGE 寻址
+        accept_ranges: 是否支持 Range 请求（False 时总是返回 200 和完整内容）
+        stream_rate: 每个响应的发送速率上限（字节/秒，模拟单条 TCP 连接的吞吐瓶颈），0 表示不限
+        corrupt_rate: 以该概率返回损坏的分片（200 状态的 HTML 错误页、截断或中间被破坏的数据）
+        latency_jitter: 分片请求在 latency 之外再随机延迟 0 ~ latency_jitter 秒
+        error_rate / error_statuses: 以 error_rate 的概率随机返回 error_statuses 中的一个错误状态码
+        bandwidth: 所有响应共享的总发送带宽上限（字节/秒），0 表示不限
+        token_ttl: 分片和密钥 URL 带上 t（过期时间）/ sign 签名参数，过期或签名不对时返回 403（模拟防盗链令牌过期），
+                   播放列表本身不签名，每次请求都生成新的令牌；0 表示不签名
+        ladder: 多码率阶梯 [(宽, 高, 相对 segment_size 的大小比例), ...]，主播放列表依次列出 /rN/index.m3u8
+        audio_rendition: 主播放列表带 EXT-X-MEDIA 独立音频轨（/audio/index.m3u8），各码率引用该音频组
+        """
+        self.segments = segments
+        self.segment_size = segment_size
+        self.latency = latency
+        self.encrypt = encrypt
+        self.key = bytes(range(16))
+        self.max_concurrent = max_concurrent
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.size_jitter = size_jitter
+        self.key_period = key_period
+        self.media_sequence = media_sequence
+        self.single_file = single_file
+        self.accept_ranges = accept_ranges
+        self.stream_rate = stream_rate
+        self.corrupt_rate = corrupt_rate
+        self.corrupted = 0
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.errors = 0
+        self.bandwidth = bandwidth
+        self.token_ttl = token_ttl
+        self.ladder = list(ladder or [])
+        self.audio_rendition = audio_rendition
+        self.rendition_requests = {}  # 码率路径前缀（"r0" / "audio"）-> 分片请求数
+        self.expired = 0  # 令牌过期被拒绝的请求数
+        self._next_send = 0.0  # 总带宽限速：下一块数据最早的发送时间
+        self._master = None
+        self._media = None
+        self.active = 0
+        self.throttled = 0
+        self.media_requests = 0  # 分片和 /media.ts 的请求数
+        self._lock = threading.Lock()
+
+        if encrypt and not HAS_CRYPTO:
+            raise RuntimeError("启用加密需要安装 pycryptodome")
+
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def playlist_url(self):
+        return f"{self.base_url}/index.m3u8"
+
+    @property
+    def master_url(self):
+        return f"{self.base_url}/master.m3u8"
+
+    def segment_size_of(self, index):
+        """第 index 个分片的字节数"""
+        if not self.size_jitter:
+            return self.segment_size
+        noise = random.Random(index).uniform(-1, 1)
+        scale = 1 + self.size_jitter * (0.7 * math.sin(index / 15) + 0.3 * noise)
+        return max(TS_PACKET_SIZE * 16, int(self.segment_size * scale))
+
+    def master_playlist(self):
+        if self._master is None:
+            self._master = self._build_master()
+        return self._master
+
+    def _build_master(self):
+        if not self.ladder:
+            total = sum(len(self.segment(i)) for i in range(self.segments))
+            average = int(total * 8 / (self.segments * SEGMENT_DURATION))
+            peak = int(max(len(self.segment(i)) for i in range(self.segments)) * 8 / SEGMENT_DURATION)
+            return (f"#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH={peak},AVERAGE-BANDWIDTH={average},"
+                    f"RESOLUTION=640x360\nindex.m3u8\n")
+        lines = ["#EXTM3U"]
+        group = ""
+        if self.audio_rendition:
+            lines.append('#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",NAME="main",LANGUAGE="zh",DEFAULT=YES,'
+                         'AUTOSELECT=YES,URI="audio/index.m3u8"')
+            group = ',AUDIO="aud"'
+        for rung, (width, height, _) in enumerate(self.ladder):
+            sizes = [len(self.segment(i, rung)) for i in range(self.segments)]
+            average = int(sum(sizes) * 8 / (self.segments * SEGMENT_DURATION))
+            peak = int(max(sizes) * 8 / SEGMENT_DURATION)
+            lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={peak},AVERAGE-BANDWIDTH={average},'
+                         f'RESOLUTION={width}x{height},CODECS="avc1.42c01e,mp4a.40.2"{group}')
+            lines.append(f"r{rung}/index.m3u8")
+        return "\n".join(lines) + "\n"
+
+    def sign(self, path):
+        """给路径加上签名参数（未启用令牌时原样返回）"""
+        if not self.token_ttl:
+            return path
+        expires = f"{int(time.time() + self.token_ttl):x}"
+        return f"{path}?t={expires}&sign={self._signature(path, expires)}"
+
+    def _signature(self, path, expires):
+        return hashlib.md5(f"{path}{expires}".encode() + self.key).hexdigest()
+
+    def token_valid(self, path, query):
+        """签名是否正确且未过期"""
+        params = dict(parse_qsl(query))
+        expires, sign = params.get("t", ""), params.get("sign", "")
+        try:
+            alive = int(expires, 16) >= time.time()
+        except ValueError:
+            return False
+        return alive and sign == self._signature(path, expires)
+
+    def playlist(self, prefix=""):
+        """媒体播放列表；prefix 为 "/rN" 或 "/audio" 时分片地址带该前缀"""
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3",
+                 f"#EXT-X-TARGETDURATION:{int(SEGMENT_DURATION)}", f"#EXT-X-MEDIA-SEQUENCE:{self.media_sequence}"]
+        if self.encrypt and not self.key_period:
+            lines.append(f'#EXT-X-KEY:METHOD=AES-128,URI="{self.sign("/key.bin")}"')
+        for i in range(self.segments):
+            if self.encrypt and self.key_period and i % self.key_period == 0:
+                lines.append(f'#EXT-X-KEY:METHOD=AES-128,URI="{self.sign(f"/key/{i // self.key_period}.bin")}"')
+            lines.append(f"#EXTINF:{SEGMENT_DURATION:.3f},")
+            if self.single_file:
+                offset, length = self.media_ranges()[i]
+                lines.append(f"#EXT-X-BYTERANGE:{length}@{offset}")
+                lines.append(self.sign("/media.ts"))
+            else:
+                lines.append(self.sign(f"{prefix}/seg/{i:05d}.ts"))
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    def media(self):
+        """单文件模式的 (完整内容, [(偏移, 长度), ...])"""
+        if self._media is None:
+            parts = [self.segment(i) for i in range(self.segments)]
+            ranges = []
+            offset = 0
+            for part in parts:
+                ranges.append((offset, len(part)))
+                offset += len(part)
+            self._media = (b"".join(parts), ranges)
+        return self._media
+
+    def media_ranges(self):
+        return self.media()[1]
+
+    def plain_segment(self, index, rendition=None):
+        """rendition: None 为默认码率，整数为 ladder 中的档位，"audio" 为独立音频轨"""
+        if rendition == "audio":
+            return _cached_audio_segment(index)
+        size = self.segment_size_of(index)
+        if rendition is not None:
+            size = max(TS_PACKET_SIZE * 16, int(size * self.ladder[rendition][2]))
+        return _cached_segment(index, size)
+
+    def segment(self, index, rendition=None):
+        payload = self.plain_segment(index, rendition)
+        if not self.encrypt:
+            return payload
+        iv = (self.media_sequence + index).to_bytes(16, byteorder='big')
+        return AES.new(self.key_of(index), AES.MODE_CBC, iv).encrypt(pad(payload, AES.block_size))
+
+    def corrupt(self, body):
+        """随机返回一种损坏的分片数据"""
+        with self._lock:
+            self.corrupted += 1
+        kind = random.choice(("html", "truncated", "garbled"))
+        if kind == "html":
+            return b"<!DOCTYPE html><html><head><title>403 Forbidden</title></head><body>Forbidden</body></html>"
+        if kind == "truncated":
+            return body[:len(body) // 2 + 100]
+        middle = len(body) // 2
+        return body[:middle] + b"\x00" * 4096 + body[middle + 4096:]
+
+    def injected_error(self):
+        """按 error_rate 随机选一个错误状态码，不注入时返回 None"""
+        if not self.error_rate or random.random() >= self.error_rate:
+            return None
+        with self._lock:
+            self.errors += 1
+        return random.choice(self.error_statuses)
+
+    def pace(self, nbytes):
+        """总带宽限速：按发送顺序排队，等到这块数据的发送时间"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_send)
+            self._next_send = start + nbytes / self.bandwidth
+        if start > now:
+            time.sleep(start - now)
+
+    def key_of(self, index):
+        """第 index 个分片使用的密钥"""
+        if not self.key_period:
+            return self.key
+        return (index // self.key_period).to_bytes(4, 'big') + self.key[4:]
+
+    def _make_handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # 支持 keep-alive
+
+            def log_message(self, format, *args):
+                pass
+
+            def handle(self):
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 客户端读够需要的部分后提前断开
+
+            def _send(self, body, content_type):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def _send_media(self, body):
+                """发送分片数据：支持 Range 时按请求返回 206，可限制发送速率"""
+                start, end = 0, len(body)
+                match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+                if standin.accept_ranges and match:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)) + 1 if match.group(2) else len(body), len(body))
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(body)}")
+                else:
+                    self.send_response(200)
+                if standin.accept_ranges:
+                    self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Type", "video/mp2t")
+                self.send_header("Content-Length", str(end - start))
+                self.end_headers()
+                if self.command == "HEAD":
+                    return
+                view = memoryview(body)[start:end]
+                rates = [rate for rate in (standin.stream_rate, standin.bandwidth) if rate]
+                chunk = max(1, min(rates) // 20) if rates else len(view) or 1
+                for pos in range(0, len(view), chunk):
+                    part = view[pos:pos + chunk]
+                    if standin.bandwidth:
+                        standin.pace(len(part))
+                    self.wfile.write(part)
+                    if standin.stream_rate:
+                        time.sleep(len(part) / standin.stream_rate)
+
+            def _reject_expired(self, path, query):
+                """令牌无效时返回 403"""
+                if not standin.token_ttl or path.endswith(".m3u8") or standin.token_valid(path, query):
+                    return False
+                with standin._lock:
+                    standin.expired += 1
+                self.send_response(403)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return True
+
+            def do_GET(self):
+                full_path, _, query = self.path.partition("?")
+                if self._reject_expired(full_path, query):
+                    return
+                # 多码率 / 音频轨的路径前缀
+                prefix, rendition, path = "", None, full_path
+                match = re.match(r"/(r(\d+)|audio)(/.*)", full_path)
+                if match and (standin.ladder or standin.audio_rendition):
+                    prefix, path = f"/{match.group(1)}", match.group(3)
+                    rendition = "audio" if match.group(1) == "audio" else int(match.group(2))
+                if path == "/master.m3u8":
+                    self._send(standin.master_playlist().encode(), "application/vnd.apple.mpegurl")
+                elif path == "/index.m3u8":
+                    self._send(standin.playlist(prefix).encode(), "application/vnd.apple.mpegurl")
+                elif path == "/key.bin":
+                    self._send(standin.key, "application/octet-stream")
+                elif path.startswith("/key/") and path.endswith(".bin"):
+                    self._send(standin.key_of(int(path[5:-4]) * max(standin.key_period, 1)),
+                               "application/octet-stream")
+                elif (path.startswith("/seg/") and path.endswith(".ts")) or path == "/media.ts":
+                    with standin._lock:
+                        standin.active += 1
+                        standin.media_requests += 1
+                        if prefix:
+                            key = prefix[1:]
+                            standin.rendition_requests[key] = standin.rendition_requests.get(key, 0) + 1
+                        throttled = standin.max_concurrent and standin.active > standin.max_concurrent
+                        standin.throttled += bool(throttled)
+                    try:
+                        if standin.latency or standin.latency_jitter:
+                            time.sleep(standin.latency + random.uniform(0, standin.latency_jitter))
+                        status = standin.injected_error()
+                        if standin.stall_rate and random.random() < standin.stall_rate:
+                            time.sleep(standin.stall)
+                        if throttled:
+                            self.send_response(429)
+                            self.send_header("Retry-After", "1")
+                            self.send_header("Content-Length", "0")
+                            self.end_headers()
+                        elif status:
+                            self.send_response(status)
+                            if status in (429, 503):
+                                self.send_header("Retry-After", "1")
+                            self.send_header("Content-Length", "0")
+                            self.end_headers()
+                        elif path == "/media.ts":
+                            self._send_media(standin.media()[0])
+                        else:
+                            body = standin.segment(int(path[5:-3]), rendition)
+                            if standin.corrupt_rate and random.random() < standin.corrupt_rate:
+                                body = standin.corrupt(body)
+                            self._send_media(body)
+                    finally:
+                        with standin._lock:
+                            standin.active -= 1
+                else:
+                    self.send_error(404)
+
+            do_HEAD = do_GET
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    with HLSStandIn(encrypt=HAS_CRYPTO) as server:
+        print(f"HLS 替身服务器: {server.playlist_url}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进程内共享的 HTTP 客户端
+
+以前每个 M3U8Downloader 和 M3U8InfoGetter 都新建 requests.Session，课程之间 TLS 握手和连接池全部作废，
+而它们访问的其实是同一批 CDN 主机。这里提供一个进程级的会话：
+- keep-alive 连接在所有课程和工具之间复用
+- getaddrinfo 结果按 TTL 缓存，避免每条新连接都查一次 DNS
+- 每个主机的连接数上限（连接用满时请求排队等待，而不是新建连接）
+- 可选 HTTP/2 后端（需安装 httpx[http2]），少量连接上多路复用大量分片请求
+stats() 返回请求数、新建连接数（即 TCP/TLS 握手次数）、复用率和 DNS 缓存命中情况；
+DNS 查询和建连（含 TLS 握手）的耗时记入 metrics
+"""
+
+import logging
+import socket
+import threading
+import time
+
+import requests
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import metrics
+
+# HTTP/2 后端（可选）
+try:
+    import httpx
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+
+    HAS_HTTPX = True
+except ImportError:
+    HAS_HTTPX = False
+
+logger = logging.getLogger(__name__)
+
+_sessions = {}  # 配置 -> 会话
+_session_lock = threading.Lock()
+
+
+# --- DNS 缓存 ---
+
+class _DNSCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}  # 参数 -> (过期时间, 结果)
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.original = socket.getaddrinfo
+
+    def getaddrinfo(self, host, port, *args, **kwargs):
+        key = (host, port, args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+        start = time.perf_counter()
+        result = self.original(host, port, *args, **kwargs)
+        metrics.observe_network("dns", time.perf_counter() - start)
+        with self.lock:
+            self.lookups += 1
+            self.entries[key] = (now + self.ttl, result)
+        return result
+
+
+_dns = None
+
+
+def install_dns_cache(ttl=300):
+    """替换 socket.getaddrinfo 为带 TTL 的缓存版本（进程内只安装一次，再次调用时更新 TTL）"""
+    global _dns
+    if _dns is None:
+        _dns = _DNSCache(ttl)
+        socket.getaddrinfo = _dns.getaddrinfo
+    elif _dns.ttl != ttl:
+        logger.info(f"DNS 缓存秒数: {_dns.ttl} -> {ttl}")
+        _dns.ttl = ttl
+    return _dns
+
+
+# --- requests 后端 ---
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        metrics.observe_network("connect", time.perf_counter() - start)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        metrics.observe_network("connect", time.perf_counter() - start)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class CountingAdapter(requests.adapters.HTTPAdapter):
+    """统计 urllib3 连接池新建连接和请求数的适配器，被淘汰的连接池计数也会保留"""
+
+    def __init__(self, *args, **kwargs):
+        self.retired_connections = 0
+        self.retired_requests = 0
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pools.dispose_func = self._retire
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPConnectionPool,
+                                                   "https": _TimedHTTPSConnectionPool}
+
+    def _retire(self, pool):
+        self.retired_connections += pool.num_connections
+        self.retired_requests += pool.num_requests
+        pool.close()
+
+    def counts(self):
+        """返回 (新建连接数, 请求数)"""
+        pools = self.poolmanager.pools
+        with pools.lock:
+            live = [pools._container[key] for key in pools._container]
+        connections = self.retired_connections + sum(p.num_connections for p in live)
+        requests_ = self.retired_requests + sum(p.num_requests for p in live)
+        return connections, requests_
+
+
+class PooledSession(requests.Session):
+    http_version = "HTTP/1.1"
+
+    def __init__(self, pool_size, per_host, retries):
+        super().__init__()
+        # pool_block: 某个主机的连接用满后等待空闲连接，而不是临时新建再丢弃
+        self.adapter = CountingAdapter(pool_connections=32, pool_maxsize=per_host or pool_size,
+                                       pool_block=bool(per_host), max_retries=retries)
+        self.mount('http://', self.adapter)
+        self.mount('https://', self.adapter)
+
+    def counts(self):
+        return self.adapter.counts()
+
+
+# --- HTTP/2 后端 ---
+
+class _RawStream:
+    """为 httpx 流式响应提供 requests 风格的 raw.readinto"""
+
+    def __init__(self, response):
+        self.chunks = response.iter_bytes()
+        self.pending = memoryview(b"")
+        self.decode_content = True  # httpx 总是解码，保留该属性仅为兼容
+
+    def readinto(self, buffer):
+        while not self.pending:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.pending = memoryview(chunk)
+        n = min(len(buffer), len(self.pending))
+        buffer[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+
+class _H2Response:
+    """httpx.Response 的 requests 兼容包装"""
+
+    def __init__(self, response, stream):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = str(response.url)
+        self.raw = _RawStream(response) if stream else None
+
+    @property
+    def content(self):
+        return self._response.read()
+
+    @property
+    def encoding(self):
+        return self._response.encoding
+
+    @encoding.setter
+    def encoding(self, value):
+        self._response.encoding = value
+
+    @property
+    def text(self):
+        return self._response.text
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            error = requests.HTTPError(f"{self.status_code} Error for url: {self.url}")
+            error.response = self
+            raise error
+
+    def close(self):
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Http2Session:
+    """基于 httpx 的会话，只实现本项目用到的 requests 接口（get / head / headers / verify）"""
+
+    http_version = "HTTP/2"
+
+    def __init__(self, pool_size, per_host, retries):
+        self.headers = requests.structures.CaseInsensitiveDict()
+        self.verify = False
+        self.connections = 0
+        self.requests = 0
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()  # 当前线程正在建立的连接的开始时间
+        limits = httpx.Limits(max_connections=per_host or pool_size,
+                              max_keepalive_connections=per_host or pool_size)
+        transport = httpx.HTTPTransport(http2=True, verify=False, retries=retries, limits=limits)
+        self.client = httpx.Client(transport=transport, follow_redirects=True)
+
+    def _trace(self, event, info):
+        # 建连耗时：从 TCP 连接开始，到 TLS 握手完成（https）或 TCP 连接完成（http）
+        if event == "connection.connect_tcp.started":
+            self.local.connect_start = time.perf_counter()
+        elif event == "connection.connect_tcp.complete":
+            with self.lock:
+                self.connections += 1
+            if not self.local.tls:
+                metrics.observe_network("connect", time.perf_counter() - self.local.connect_start)
+        elif event == "connection.start_tls.complete":
+            metrics.observe_network("connect", time.perf_counter() - self.local.connect_start)
+
+    def request(self, method, url, timeout=None, stream=False, headers=None):
+        self.local.tls = url.startswith("https:")
+        merged = dict(self.headers)
+        merged.update(headers or {})
+        req = self.client.build_request(method, url, headers=merged, timeout=timeout,
+                                        extensions={"trace": self._trace})
+        try:
+            response = self.client.send(req, stream=True)
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(str(e)) from e
+        with self.lock:
+            self.requests += 1
+            self.versions[response.http_version] = self.versions.get(response.http_version, 0) + 1
+        wrapped = _H2Response(response, stream)
+        if not stream:
+            try:
+                response.read()
+            finally:
+                response.close()
+        return wrapped
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def counts(self):
+        with self.lock:
+            return self.connections, self.requests
+
+    def close(self):
+        self.client.close()
+
+
+# --- 对外接口 ---
+
+def get_session(pool_size=16, per_host=None, http2=False, retries=3, headers=None, dns_ttl=300):
+    """
+    返回进程内共享的会话：参数相同的调用复用同一个会话，参数不同时另建一个（不会沿用先创建的配置）
+    pool_size: 连接池大小（未设置 per_host 时即每个主机的最大连接数）
+    per_host: 每个主机的连接数上限，用满时请求排队
+    http2: 使用 httpx HTTP/2 后端（未安装时回退到 requests）
+    retries: 连接级重试次数
+    headers: 默认请求头
+    dns_ttl: DNS 缓存秒数，0 表示不缓存
+    """
+    with _session_lock:
+        if dns_ttl or _dns is not None:
+            install_dns_cache(dns_ttl)
+        if http2 and not HAS_HTTPX:
+            logger.warning("未安装 httpx[http2]，回退到 HTTP/1.1")
+            http2 = False
+        key = (pool_size, per_host, http2, retries, tuple(sorted((headers or {}).items())))
+        session = _sessions.get(key)
+        if session is None:
+            if _sessions:
+                logger.info(f"按新的配置创建会话: pool_size={pool_size}, per_host={per_host}, "
+                            f"http2={http2}, retries={retries}")
+            cls = Http2Session if http2 else PooledSession
+            session = _sessions[key] = cls(pool_size, per_host, retries)
+            session.headers.update(headers or {})
+            session.verify = False
+        return session
+
+
+def reset():
+    """关闭并丢弃所有会话（基准测试在各轮之间调用，避免后一轮复用前一轮的连接）"""
+    with _session_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def stats():
+    """连接复用统计（所有会话合计），未创建会话时返回 None"""
+    with _session_lock:
+        sessions = list(_sessions.values())
+    if not sessions:
+        return None
+    connections = requests_ = 0
+    for session in sessions:
+        c, r = session.counts()
+        connections += c
+        requests_ += r
+    result = {
+        "backend": " + ".join(sorted({session.http_version for session in sessions})),
+        "requests": requests_,
+        "connections": connections,
+        "reuse_ratio": round(1 - connections / requests_, 3) if requests_ else 0.0,
+    }
+    versions = {}
+    for session in sessions:
+        if isinstance(session, Http2Session):
+            for version, n in session.versions.items():
+                versions[version] = versions.get(version, 0) + n
+    if versions:
+        result["http_versions"] = versions
+    if _dns is not None:
+        result["dns_lookups"] = _dns.lookups
+        result["dns_hits"] = _dns.hits
+    return result
+
+
+def format_stats():
+    """一行可读的连接复用统计"""
+    s = stats()
+    if not s or not s["requests"]:
+        return None
+    line = (f"连接复用 ({s['backend']}): 请求 {s['requests']} 次，新建连接 {s['connections']} 个，"
+            f"复用率 {s['reuse_ratio'] * 100:.1f}%")
+    if "dns_lookups" in s:
+        line += f"，DNS 查询 {s['dns_lookups']} 次 / 缓存命中 {s['dns_hits']} 次"
+    return line
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+课程的稳定标识
+
+临时目录、续传日志等都以此为键，同一节课多次运行（包括签名参数变化后）得到相同的标识
+分片缓存以 segment_key 为键：去掉会过期的签名参数，令牌刷新、重新导出后仍能命中
+已完成课程索引以 playlist_identity 为键：只看播放列表地址，不看标题
+"""
+
+import hashlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+
+# 防盗链签名参数（腾讯云 t/us/exper/rlimit/sign、阿里云 auth_key、OSS/S3 预签名等），每次导出都会变化
+SIGNATURE_PARAMS = frozenset({
+    "sign", "signature", "sig", "token", "expires", "expire", "t", "us", "exper", "rlimit", "auth_key",
+})
+SIGNATURE_PREFIXES = ("x-oss-", "x-amz-", "x-cos-", "q-sign-")
+
+
+def is_signature_param(name):
+    name = name.lower()
+    return name in SIGNATURE_PARAMS or name.startswith(SIGNATURE_PREFIXES)
+
+
+def has_signature(url):
+    """URL 是否带有签名参数"""
+    return any(is_signature_param(k) for k, _ in parse_qsl(urlsplit(url).query, keep_blank_values=True))
+
+
+def normalize_url(url, strip_signature=False):
+    """规范化 URL：协议和主机小写、去掉片段、查询参数排序；strip_signature 时去掉签名参数"""
+    parts = urlsplit(url.strip())
+    params = parse_qsl(parts.query, keep_blank_values=True)
+    if strip_signature:
+        params = [(k, v) for k, v in params if not is_signature_param(k)]
+    query = urlencode(sorted(params))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ""))
+
+
+def lesson_identity(url, title):
+    """由去掉签名参数的规范化 URL 和标题生成 12 位十六进制标识，重新导出 / 重新签名后仍对应同一个临时目录"""
+    key = f"{normalize_url(url, strip_signature=True)}\n{title}".encode("utf-8")
+    return hashlib.sha1(key).hexdigest()[:12]
+
+
+def playlist_identity(url):
+    """
+    播放列表的稳定标识（16 位十六进制）：去掉签名参数后的规范化 URL，与标题无关
+    已完成课程索引以此为键，改名后的课程仍能识别，同名的不同课程不会混淆
+    """
+    return hashlib.sha1(normalize_url(url, strip_signature=True).encode("utf-8")).hexdigest()[:16]
+
+
+def segment_key(url, byterange=None):
+    """
+    分片内容的稳定标识（40 位十六进制）：主机、路径、非签名查询参数和字节范围
+    不含协议，同一分片经 http / https 访问得到相同的键
+    """
+    parts = urlsplit(normalize_url(url, strip_signature=True))
+    key = f"{parts.netloc}{parts.path}?{parts.query}"
+    if byterange:
+        key += f"#{byterange[0]}+{byterange[1]}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
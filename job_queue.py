@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基于 SQLite 的课程任务队列
+
+main() 把课程列表读进内存、在一个进程里逐课处理，几百节课的积压没法分给多台机器或多个进程。
+这里把导出的课程列表导入一个 SQLite 数据库（可以放在共享文件系统上），多个 worker 进程从中领取课程：
+- 领取时加租约（lease），下载期间心跳线程定期续租并上报分片进度；续租失败（租约已被接管）时立即取消下载，
+  不再与接手的 worker 写同一个临时目录和输出文件
+- worker 崩溃或被杀后租约过期，其他 worker 会重新领取该课程（超过最大尝试次数则标记为失败）
+- 完成后记录输出文件路径，失败时记录原因
+课程按去掉签名参数的 URL + 标题去重，令牌过期后重新导入同一份列表只会更新未完成课程的地址。
+
+用法:
+    python job_queue.py enqueue m3u8_list.json [--db jobs.db]
+    python job_queue.py status [--db jobs.db] [--all]
+    python job_queue.py requeue [--db jobs.db] [--failed | --stale | --all | ID ...]
+    python job_queue.py work [--db jobs.db] [--worker-id NAME]
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from identity import lesson_identity
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB = "jobs.db"
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lessons (
+    id INTEGER PRIMARY KEY,
+    identity TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    url TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    segments_total INTEGER,
+    segments_done INTEGER,
+    output TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lessons_status ON lessons (status, id);
+"""
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Job:
+    """领取到的一节课"""
+
+    def __init__(self, row):
+        self.id = row["id"]
+        self.title = row["title"]
+        self.url = row["url"]
+        self.attempts = row["attempts"]
+
+    def __repr__(self):
+        return f"Job({self.id}, {self.title!r})"
+
+
+class JobQueue:
+    def __init__(self, path=DEFAULT_DB, lease=120, max_attempts=3):
+        """
+        path: 数据库文件（共享文件系统上的文件也可以，不使用 WAL）
+        lease: 租约秒数，worker 超过该时间未心跳视为已失联
+        max_attempts: 每节课最多领取的次数（包括失联后被重新领取）
+        """
+        self.path = str(path)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+
+    @contextmanager
+    def _transaction(self):
+        """每次操作单独连接，心跳线程和下载线程互不影响；BEGIN IMMEDIATE 保证领取不会冲突"""
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def enqueue(self, tasks):
+        """导入课程列表（[{"title": ..., "m3u8": ...}]），返回 (新增数, 更新地址数)"""
+        added = updated = 0
+        now = time.time()
+        with self._transaction() as db:
+            for task in tasks:
+                title = task.get('title') or task.get('name') or "untitled_video"
+                url = task.get('m3u8')
+                if not url:
+                    continue
+                identity = lesson_identity(url, title)
+                row = db.execute("SELECT status, url FROM lessons WHERE identity = ?", (identity,)).fetchone()
+                if row is None:
+                    db.execute("INSERT INTO lessons (identity, title, url, created, updated) VALUES (?, ?, ?, ?, ?)",
+                               (identity, title, url, now, now))
+                    added += 1
+                elif row["status"] != DONE and row["url"] != url:
+                    # 重新导出的地址带有新令牌，进行中的 worker 刷新播放列表时会读到
+                    db.execute("UPDATE lessons SET url = ?, updated = ? WHERE identity = ?", (url, now, identity))
+                    updated += 1
+        return added, updated
+
+    def claim(self, worker):
+        """领取一节排队中或租约已过期的课程，没有可领取的课程时返回 None"""
+        now = time.time()
+        with self._transaction() as db:
+            # 租约过期且已用完尝试次数的课程不再重试
+            db.execute("UPDATE lessons SET status = ?, error = ?, worker = NULL, lease_until = NULL, updated = ? "
+                       "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                       (FAILED, "worker 失联且超过最大尝试次数", now, RUNNING, now, self.max_attempts))
+            row = db.execute("SELECT * FROM lessons WHERE status = ? OR (status = ? AND lease_until < ?) "
+                             "ORDER BY id LIMIT 1", (QUEUED, RUNNING, now)).fetchone()
+            if row is None:
+                return None
+            if row["status"] == RUNNING:
+                logger.warning(f"课程 [{row['title']}] 的租约已过期（worker {row['worker']}），重新领取")
+            db.execute("UPDATE lessons SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1, "
+                       "error = NULL, updated = ? WHERE id = ?",
+                       (RUNNING, worker, now + self.lease, now, row["id"]))
+            return Job(db.execute("SELECT * FROM lessons WHERE id = ?", (row["id"],)).fetchone())
+
+    def heartbeat(self, job_id, worker, done=None, total=None):
+        """续租并记录分片进度，返回租约是否仍归该 worker 所有"""
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE lessons SET lease_until = ?, segments_done = COALESCE(?, segments_done), "
+                                "segments_total = COALESCE(?, segments_total), updated = ? "
+                                "WHERE id = ? AND worker = ? AND status = ?",
+                                (now + self.lease, done, total, now, job_id, worker, RUNNING))
+            return cursor.rowcount == 1
+
+    def complete(self, job_id, worker, output, segments=None):
+        """标记完成并记录输出文件和分片数，返回是否仍持有租约"""
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE lessons SET status = ?, output = ?, worker = NULL, lease_until = NULL, "
+                                "segments_total = COALESCE(?, segments_total), segments_done = COALESCE(?, segments_total), "
+                                "error = NULL, updated = ? WHERE id = ? AND worker = ? AND status = ?",
+                                (DONE, str(output), segments, segments, now, job_id, worker, RUNNING))
+            return cursor.rowcount == 1
+
+    def fail(self, job_id, worker, error):
+        """记录失败：未超过最大尝试次数时重新排队，否则标记为失败"""
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("UPDATE lessons SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?, "
+                       "worker = NULL, lease_until = NULL, updated = ? WHERE id = ? AND worker = ? AND status = ?",
+                       (self.max_attempts, FAILED, QUEUED, error, now, job_id, worker, RUNNING))
+
+    def url(self, job_id):
+        """课程当前的 m3u8 地址（重新导入后可能已更新），供令牌过期时刷新播放列表"""
+        with self._transaction() as db:
+            row = db.execute("SELECT url FROM lessons WHERE id = ?", (job_id,)).fetchone()
+            return row["url"] if row else None
+
+    def requeue(self, ids=None, failed=False, stale=False, everything=False):
+        """把课程重新排队并清零尝试次数，返回数量；ids 指定课程，否则按 failed / stale / everything 选择"""
+        now = time.time()
+        if ids:
+            where, params = f"id IN ({','.join('?' * len(ids))})", list(ids)
+        elif everything:
+            where, params = "status != ?", [DONE]
+        else:
+            clauses = []
+            params = []
+            if failed:
+                clauses.append("status = ?")
+                params.append(FAILED)
+            if stale:
+                clauses.append("(status = ? AND lease_until < ?)")
+                params += [RUNNING, now]
+            if not clauses:
+                return 0
+            where = " OR ".join(clauses)
+        with self._transaction() as db:
+            cursor = db.execute(f"UPDATE lessons SET status = ?, worker = NULL, lease_until = NULL, attempts = 0, "
+                                f"updated = ? WHERE {where}", [QUEUED, now] + params)
+            return cursor.rowcount
+
+    def counts(self):
+        """各状态的课程数；租约已过期的进行中课程单独计为 stale"""
+        now = time.time()
+        result = {QUEUED: 0, RUNNING: 0, "stale": 0, DONE: 0, FAILED: 0}
+        with self._transaction() as db:
+            for row in db.execute("SELECT status, lease_until < ? AS stale, COUNT(*) AS n FROM lessons "
+                                  "GROUP BY status, stale", (now,)):
+                result["stale" if row["status"] == RUNNING and row["stale"] else row["status"]] += row["n"]
+        return result
+
+    def lessons(self, statuses=None):
+        with self._transaction() as db:
+            if statuses:
+                return db.execute(f"SELECT * FROM lessons WHERE status IN ({','.join('?' * len(statuses))}) "
+                                  f"ORDER BY id", list(statuses)).fetchall()
+            return db.execute("SELECT * FROM lessons ORDER BY id").fetchall()
+
+    def pending(self):
+        """是否还有排队中或进行中的课程（worker 据此决定继续等待还是退出）"""
+        with self._transaction() as db:
+            return db.execute("SELECT 1 FROM lessons WHERE status IN (?, ?) LIMIT 1",
+                              (QUEUED, RUNNING)).fetchone() is not None
+
+
+class Heartbeat:
+    """下载期间定期续租，并上报 progress() 返回的 (已完成分片数, 分片总数)；租约被接管时调用 on_lost()"""
+
+    def __init__(self, queue, job, worker, progress=None, interval=None, on_lost=None):
+        self.queue = queue
+        self.job = job
+        self.worker = worker
+        self.progress = progress
+        self.on_lost = on_lost
+        self.interval = interval or max(1.0, queue.lease / 3)
+        self.lost = False  # 租约被其他 worker 接管（例如本进程长时间卡住）
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f"heartbeat-{job.id}", daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            done, total = self.progress() if self.progress else (None, None)
+            try:
+                owned = self.queue.heartbeat(self.job.id, self.worker, done, total)
+            except sqlite3.Error as e:
+                logger.warning(f"心跳失败 [{self.job.title}]: {e}")
+                continue
+            if not owned and not self.lost:
+                self.lost = True
+                logger.warning(f"课程 [{self.job.title}] 的租约已被其他 worker 接管，取消本 worker 的下载")
+                if self.on_lost:
+                    self.on_lost()
+
+
+def work(queue, make_downloader, worker=None, poll=5.0, wait=True):
+    """
+    循环领取并下载课程，返回本 worker 的 {"success", "failed"} 计数
+    make_downloader(job) -> M3U8Downloader
+    wait: 队列暂时为空但还有其他 worker 的课程在进行时继续等待（它们失联后可以接手），否则直接退出
+    """
+    worker = worker or default_worker_id()
+    results = {"success": 0, "failed": 0, "lost": 0}
+    while True:
+        job = queue.claim(worker)
+        if job is None:
+            if wait and queue.pending():
+                time.sleep(poll)
+                continue
+            break
+
+        print(f"\n📋 [{worker}] 领取课程 #{job.id}: {job.title}（第 {job.attempts} 次）")
+        downloader = make_downloader(job)
+        heartbeat = Heartbeat(queue, job, worker, progress=lambda: (downloader.progress, len(downloader.segments)),
+                              on_lost=downloader.cancel.set)
+        try:
+            with heartbeat:
+                ok = downloader.run()
+            error = None if ok else "解析、下载或合并失败"
+        except Exception as e:
+            logger.exception(f"课程 [{job.title}] 异常: {e}")
+            ok, error = False, f"{type(e).__name__}: {e}"
+
+        if heartbeat.lost:
+            results["lost"] += 1  # 课程归接手的 worker 所有，不再改动它的状态
+        elif ok:
+            segments = len(downloader.segments) or None  # 输出已存在而跳过时没有解析分片
+            if queue.complete(job.id, worker, downloader.final_mp4, segments):
+                results["success"] += 1
+            else:
+                logger.warning(f"课程 [{job.title}] 完成时租约已不属于本 worker")
+                results["lost"] += 1
+        else:
+            queue.fail(job.id, worker, error)
+            results["failed"] += 1
+    print(f"\n🏁 [{worker}] 队列已空: 成功 {results['success']}, 失败 {results['failed']}, "
+          f"租约被接管 {results['lost']}")
+    return results
+
+
+def print_status(queue, show_all=False):
+    counts = queue.counts()
+    print(f"排队 {counts[QUEUED]}  进行中 {counts[RUNNING]}  租约过期 {counts['stale']}  "
+          f"完成 {counts[DONE]}  失败 {counts[FAILED]}")
+    rows = queue.lessons() if show_all else queue.lessons([RUNNING, FAILED])
+    now = time.time()
+    for row in rows:
+        progress = f"{row['segments_done'] or 0}/{row['segments_total']}" if row["segments_total"] else "-"
+        if row["status"] == RUNNING:
+            remaining = row["lease_until"] - now
+            detail = f"{row['worker']} 租约{'剩余 %.0fs' % remaining if remaining > 0 else '已过期'}"
+        elif row["status"] == DONE:
+            detail = row["output"] or ""
+        else:
+            detail = row["error"] or ""
+        print(f"#{row['id']:<5}{row['status']:<9}{progress:>11}  尝试 {row['attempts']}  {row['title']}  {detail}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="课程任务队列（SQLite）")
+    parser.add_argument("--db", default=DEFAULT_DB, help="任务数据库文件")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("enqueue", help="导入导出的课程列表")
+    p.add_argument("file", help="课程列表 JSON（与 m3u8_list.json 格式相同）")
+
+    p = sub.add_parser("status", help="查看队列状态")
+    p.add_argument("--all", action="store_true", help="列出全部课程（默认只列出进行中和失败的课程）")
+
+    p = sub.add_parser("requeue", help="重新排队")
+    p.add_argument("ids", nargs="*", type=int, help="课程编号")
+    p.add_argument("--failed", action="store_true", help="所有失败的课程")
+    p.add_argument("--stale", action="store_true", help="所有租约已过期的课程")
+    p.add_argument("--all", action="store_true", help="所有未完成的课程")
+
+    p = sub.add_parser("work", help="作为 worker 领取并下载课程（配置取自 main.py）")
+    p.add_argument("--worker-id", help="默认为 主机名:进程号")
+    p.add_argument("--no-wait", action="store_true", help="没有可领取的课程时立即退出")
+
+    args = parser.parse_args()
+    if args.command == "work":
+        import main as downloader_main
+        downloader_main.JOB_QUEUE_DB = args.db
+        downloader_main.run_queue_worker(worker=args.worker_id, wait=not args.no_wait)
+        return
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    queue = JobQueue(args.db)
+    if args.command == "enqueue":
+        with open(args.file, 'r', encoding='utf-8') as f:
+            added, updated = queue.enqueue(json.load(f))
+        print(f"📥 新增 {added} 节课，更新地址 {updated} 节课")
+    elif args.command == "status":
+        print_status(queue, show_all=args.all)
+    elif args.command == "requeue":
+        count = queue.requeue(ids=args.ids, failed=args.failed, stale=args.stale, everything=args.all)
+        print(f"🔁 已重新排队 {count} 节课")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+断点续传日志
+
+每节课的临时目录下有一个只追加的 journal.log：
+    #lesson <标识> <标题> <URL> <播放列表标识>
+    <序号> <字节数> <crc32> [<偏移>]
+偏移仅在单文件分片存储（segment_store.py）下出现，表示分片在容器文件中的位置。
+播放列表标识即已完成课程索引（lesson_index.py）的键，清理孤立目录时据此判断课程是否已完成；
+旧版本的日志头没有这一列，按 URL 计算。
+启动时读一次日志即可知道哪些分片已完成，不需要逐个 stat 分片文件。
+进程崩溃时最后一行可能写了一半，解析失败的行直接忽略（对应分片重新下载）。
+
+下载期间课程对临时目录中的 .lock 文件持有独占锁（lock_dir），清理孤立目录时拿不到锁的目录正在使用，不会删除。
+"""
+
+import logging
+import shutil
+import threading
+import time
+import zlib
+
+from identity import playlist_identity
+
+# 目录锁：POSIX 用 fcntl.flock，Windows 用 msvcrt.locking
+try:
+    import fcntl
+
+    HAS_FCNTL = True
+except ImportError:
+    import msvcrt
+
+    HAS_FCNTL = False
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_NAME = "journal.log"
+LOCK_NAME = ".lock"
+
+
+def lock_dir(temp_dir):
+    """
+    对临时目录加独占锁，成功时返回打开的锁文件（close() 即释放），已被其他进程或同进程内的其他课程持有时返回 None
+    锁随文件描述符释放，进程崩溃后不会残留
+    """
+    return lock_file(temp_dir / LOCK_NAME)
+
+
+def lock_file(path):
+    """对任意锁文件加独占锁（不存在时创建），语义同 lock_dir"""
+    f = open(path, "a+b")
+    try:
+        if HAS_FCNTL:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+class ResumeJournal:
+    def __init__(self, temp_dir, identity, title, url, playlist_id=None):
+        self.path = temp_dir / JOURNAL_NAME
+        self.entries = {}  # 序号 -> (字节数, crc32, 偏移或 None)
+        self.lock = threading.Lock()
+
+        torn = False
+        if self.path.exists():
+            torn = self._load()
+        is_new = not self.path.exists()
+        self.file = open(self.path, "a", encoding="utf-8")
+        if is_new:
+            self.file.write(f"#lesson\t{identity}\t{title}\t{url}\t{playlist_id or playlist_identity(url)}\n")
+        elif torn:
+            self.file.write("\n")  # 结束上次写了一半的行，避免与新记录粘连
+        self.file.flush()
+
+    def _load(self):
+        """读取日志，返回最后一行是否写了一半"""
+        line = "\n"
+        with open(self.path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if line.startswith("#") or not line.endswith("\n"):
+                    continue
+                try:
+                    idx, size, crc, *offset = line.split()
+                    self.entries[int(idx)] = (int(size), int(crc, 16), int(offset[0]) if offset else None)
+                except ValueError:
+                    continue
+        return not line.endswith("\n")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def done(self, idx):
+        return idx in self.entries
+
+    def record(self, idx, size, crc, offset=None):
+        with self.lock:
+            self.entries[idx] = (size, crc, offset)
+            self.file.write(f"{idx} {size} {crc:08x}\n" if offset is None else f"{idx} {size} {crc:08x} {offset}\n")
+            self.file.flush()
+
+    def forget(self, idx):
+        """校验失败的分片从内存中移除，下次重新下载"""
+        with self.lock:
+            self.entries.pop(idx, None)
+
+    def verify(self, idx, path):
+        """按日志中的大小和 crc32 校验分片文件"""
+        size, crc, _ = self.entries[idx]
+        try:
+            if path.stat().st_size != size:
+                return False
+            with open(path, "rb") as f:
+                return zlib.crc32(f.read()) == crc
+        except OSError:
+            return False
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+def read_header(temp_dir):
+    """读取临时目录的日志头，返回 (标识, 标题, URL, 播放列表标识)，没有日志时返回 None"""
+    try:
+        with open(temp_dir / JOURNAL_NAME, "r", encoding="utf-8") as f:
+            fields = f.readline().rstrip("\n").split("\t")
+    except OSError:
+        return None
+    if len(fields) not in (4, 5) or fields[0] != "#lesson":
+        return None
+    return fields[1], fields[2], fields[3], fields[4] if len(fields) == 5 else playlist_identity(fields[3])
+
+
+def _completed(output_dir, header, index):
+    """日志头对应的课程是否已完成：有索引时按播放列表标识查索引，否则按标题查找输出文件"""
+    _, title, _, playlist_id = header
+    if index is not None:
+        return index.get(playlist_id) is not None
+    suffix = ".m4a" if playlist_id.endswith("-audio") else ".mp4"
+    return (output_dir / f"{title}{suffix}").exists()
+
+
+def reclaim_orphans(output_dir, ttl_days=7, index=None):
+    """
+    清理孤立的临时目录，返回释放的字节数：
+    - 对应课程已完成（清理失败遗留）；index 为已完成课程索引（lesson_index.LessonIndex），
+      同名的不同课程、改名的课程都按播放列表标识判断，不看输出文件名
+    - 旧版本使用随机后缀、没有续传日志的目录（超过 1 小时未更新，避免误删刚创建的目录）
+    - 超过 ttl_days 天未更新的目录
+    正在下载的课程持有目录锁（lock_dir），拿不到锁的目录一律跳过
+    """
+    freed = 0
+    now = time.time()
+    for temp_dir in output_dir.glob("temp_*"):
+        if not temp_dir.is_dir():
+            continue
+        header = read_header(temp_dir)
+        journal = temp_dir / JOURNAL_NAME
+        try:
+            mtime = journal.stat().st_mtime if header else temp_dir.stat().st_mtime
+        except OSError:
+            continue
+
+        if header is None:
+            if now - mtime < 3600:
+                continue
+            reason = "无续传日志"
+        elif _completed(output_dir, header, index):
+            reason = "视频已完成"
+        elif now - mtime > ttl_days * 86400:
+            reason = f"超过 {ttl_days} 天未更新"
+        else:
+            continue
+
+        lock = lock_dir(temp_dir)
+        if lock is None:
+            logger.info(f"临时目录正在使用，不清理: {temp_dir.name}")
+            continue
+        size = sum(f.stat().st_size for f in temp_dir.rglob("*") if f.is_file())
+        shutil.rmtree(temp_dir, ignore_errors=True)  # 持有锁期间删除，其他课程不会在此时开始使用
+        lock.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)  # Windows 下锁文件要关闭后才能删除
+        freed += size
+        logger.info(f"清理孤立临时目录 ({reason}): {temp_dir.name}, 释放 {size / 1024 / 1024:.1f} MB")
+    return freed
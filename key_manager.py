@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+解密密钥管理
+
+- KeyCache: 进程内共享的有界 LRU（密钥 URI -> 密钥），多节课引用同一个密钥时只下载一次；
+  多个线程同时请求同一个未缓存的密钥时只有一个线程真正去取，其余线程等待结果
+- KeyManager: 每节课一个，把分片区间映射到 EXT-X-KEY，按需取密钥并创建 AES-128-CBC 解密器
+  （未指定 IV 时使用媒体序列号）
+- decrypt_pool: 进程内共享的解密线程池，让 AES 运算不占用下载线程
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from Crypto.Cipher import AES
+
+    HAS_CRYPTO = True
+except ImportError:
+    HAS_CRYPTO = False
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_METHODS = ("AES-128",)
+
+
+class KeyCache:
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.pending = {}  # URI -> threading.Event（正在获取）
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.fetches = 0
+
+    def get(self, uri, fetch):
+        """返回密钥内容，未缓存时调用 fetch(uri) 获取；获取失败返回 None（不缓存失败结果）"""
+        while True:
+            with self.lock:
+                if uri in self.entries:
+                    self.entries.move_to_end(uri)
+                    self.hits += 1
+                    return self.entries[uri]
+                event = self.pending.get(uri)
+                if event is None:
+                    event = self.pending[uri] = threading.Event()
+                    break
+            event.wait()
+            with self.lock:
+                if uri not in self.entries:
+                    return None  # 其他线程获取失败
+
+        key = None
+        try:
+            key = fetch(uri)
+        finally:
+            with self.lock:
+                self.fetches += 1
+                del self.pending[uri]
+                if key:
+                    self.entries[uri] = key
+                    while len(self.entries) > self.capacity:
+                        self.entries.popitem(last=False)
+            event.set()
+        return key
+
+
+_cache = None
+_pool = None
+_shared_lock = threading.Lock()
+
+
+def shared_key_cache(capacity=64):
+    """进程内共享的密钥缓存（首次调用时决定容量）"""
+    global _cache
+    with _shared_lock:
+        if _cache is None:
+            _cache = KeyCache(capacity)
+        return _cache
+
+
+def reset():
+    """丢弃共享的密钥缓存（基准测试在各轮之间调用，避免后一轮直接命中前一轮的密钥）"""
+    global _cache
+    with _shared_lock:
+        _cache = None
+
+
+def decrypt_pool(workers=4):
+    """进程内共享的解密线程池，workers <= 0 时返回 None（在下载线程中直接解密）"""
+    global _pool
+    if workers <= 0:
+        return None
+    with _shared_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decrypt")
+        return _pool
+
+
+class KeyManager:
+    def __init__(self, segments, fetch, cache=None):
+        """
+        segments: hls_parser.SegmentTable
+        fetch: fetch(uri) -> bytes 或 None，用于下载密钥
+        cache: KeyCache，默认使用进程内共享的缓存
+        """
+        self.segments = segments
+        self.fetch = fetch
+        self.cache = cache or shared_key_cache()
+        self.ranges = self._build_ranges()
+
+    def _build_ranges(self):
+        """把分片的密钥编号压缩为区间列表 [(起始下标, 结束下标, KeyInfo)]"""
+        ranges = []
+        key_ids = self.segments.key_ids
+        start = 0
+        for i in range(1, len(key_ids) + 1):
+            if i == len(key_ids) or key_ids[i] != key_ids[start]:
+                if key_ids[start] >= 0:
+                    ranges.append((start, i - 1, self.segments.keys[key_ids[start]]))
+                start = i
+        return ranges
+
+    @property
+    def encrypted(self):
+        return bool(self.ranges)
+
+    def unsupported_methods(self):
+        return sorted({key.method for _, _, key in self.ranges if key.method not in SUPPORTED_METHODS})
+
+    def key_for(self, segment):
+        """分片使用的密钥内容；未加密或加密方法不支持时返回 None，密钥获取失败时抛出异常"""
+        key = segment.key
+        if key is None or key.method not in SUPPORTED_METHODS:
+            return None
+        content = self.cache.get(key.uri, self.fetch)
+        if not content:
+            raise RuntimeError(f"无法获取解密密钥: {key.uri}")
+        return content
+
+    def cipher(self, segment):
+        """分片的 AES-128-CBC 解密器；如果 M3U8 里没给 IV，标准是用媒体序列号(big-endian binary)"""
+        content = self.key_for(segment)
+        if content is None:
+            return None
+        iv = segment.key.iv or segment.sequence.to_bytes(16, byteorder='big')
+        return AES.new(content, AES.MODE_CBC, iv)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+已完成课程索引
+
+以前按标题判断是否已下载：每节课都要创建目录、stat 输出文件；课程改名后会重新下载，同名的不同课程却被误跳过。
+输出目录下的 .completed.jsonl 记录已完成的课程，每行一个 JSON：
+    {"id": 播放列表标识, "url": 去掉签名参数的地址, "title": 标题, "output": 相对输出目录的路径,
+     "size": 字节数, "duration": 时长（秒）, "sha256": 校验和, "time": 完成时间}
+以 identity.playlist_identity 为键，与标题无关。启动时读一次，之后判断是否已完成只查内存，不访问磁盘。
+同一标识后写的记录覆盖先写的；{"id": ..., "removed": true} 表示删除。
+
+    python lesson_index.py verify [--dir videos] [--quick]           并行校验索引中的文件（大小、校验和）
+    python lesson_index.py rebuild [--dir videos] [--adopt m3u8_list.json]
+        扫描输出目录：按校验和找回被移动或改名的文件，去掉已不存在的记录，压缩索引；
+        --adopt 按课程列表的标题认领索引建立之前下载的视频
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from identity import normalize_url, playlist_identity
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = ".completed.jsonl"
+CHUNK = 1024 * 1024
+
+
+def file_checksum(path):
+    """文件的 sha256（大块读取，hashlib 计算时释放 GIL，可多线程并行）"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LessonIndex:
+    def __init__(self, output_dir):
+        self.output_dir = Path(output_dir)
+        self.path = self.output_dir / INDEX_NAME
+        self.lock = threading.Lock()
+        self.entries = {}  # 播放列表标识 -> 记录
+        self.owners = {}  # 相对路径 -> 播放列表标识
+        self._load()
+
+    def _load(self):
+        try:
+            f = open(self.path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    identity = entry["id"]
+                except (ValueError, KeyError, TypeError):
+                    continue  # 写了一半的行
+                self._forget(identity)
+                if not entry.get("removed"):
+                    self.entries[identity] = entry
+                    self.owners[entry["output"]] = identity
+        if self.entries:
+            logger.info(f"已完成课程索引: {len(self.entries)} 节课")
+
+    def _forget(self, identity):
+        old = self.entries.pop(identity, None)
+        if old is not None and self.owners.get(old["output"]) == identity:
+            del self.owners[old["output"]]
+
+    def _append(self, entry):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _relative(self, path):
+        path = Path(path)
+        try:
+            return path.relative_to(self.output_dir).as_posix()
+        except ValueError:
+            return str(path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, identity):
+        with self.lock:
+            return self.entries.get(identity)
+
+    def owner(self, path):
+        """占用该输出文件的课程标识，没有时返回 None"""
+        with self.lock:
+            return self.owners.get(self._relative(path))
+
+    def resolve(self, entry):
+        return self.output_dir / entry["output"]
+
+    def record(self, identity, url, title, path, duration=None, checksum=None):
+        """记入一节已完成的课程；checksum 为 None 时留给 verify 补全"""
+        entry = {"id": identity, "url": normalize_url(url, strip_signature=True), "title": title,
+                 "output": self._relative(path), "size": Path(path).stat().st_size,
+                 "duration": round(duration, 3) if duration else None, "sha256": checksum,
+                 "time": round(time.time())}
+        with self.lock:
+            self._forget(identity)
+            self.entries[identity] = entry
+            self.owners[entry["output"]] = identity
+            self._append(entry)
+        return entry
+
+    def remove(self, identity):
+        with self.lock:
+            if identity in self.entries:
+                self._forget(identity)
+                self._append({"id": identity, "removed": True})
+
+    def verify(self, workers=8, quick=False):
+        """
+        并行校验所有记录，返回 {"ok", "missing", "size_mismatch", "checksum_mismatch", "filled"} 各自的标识列表
+        quick 时只比较大小；没有校验和的记录计算后补全
+        """
+        with self.lock:
+            entries = list(self.entries.values())
+
+        def check(entry):
+            path = self.resolve(entry)
+            try:
+                size = path.stat().st_size
+            except OSError:
+                return "missing", entry, None
+            if size != entry["size"]:
+                return "size_mismatch", entry, None
+            if quick:
+                return "ok", entry, None
+            checksum = file_checksum(path)
+            if entry.get("sha256") is None:
+                return "filled", entry, checksum
+            return ("ok" if checksum == entry["sha256"] else "checksum_mismatch"), entry, None
+
+        results = {"ok": [], "missing": [], "size_mismatch": [], "checksum_mismatch": [], "filled": []}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for status, entry, checksum in pool.map(check, entries):
+                results[status].append(entry["id"])
+                if checksum is not None:
+                    self.record(entry["id"], entry["url"], entry["title"], self.resolve(entry),
+                                entry.get("duration"), checksum)
+        return results
+
+    def scan(self):
+        """输出目录下的全部 MP4 / M4A（跳过临时目录和分片缓存）"""
+        files = []
+        for root, dirs, names in os.walk(self.output_dir):
+            dirs[:] = [d for d in dirs if not d.startswith(("temp_", "."))]
+            files.extend(Path(root) / name for name in names if name.lower().endswith((".mp4", ".m4a")))
+        return files
+
+    def rebuild(self, workers=8, adopt=None, clean=None):
+        """
+        按输出目录的实际内容重建索引，返回统计：
+        - 记录的文件仍在且大小一致：保留
+        - 文件不在原处：在未登记的同大小文件中按校验和查找，找到则更新路径（被移动或改名）
+        - 仍找不到：删除记录
+        - adopt 为课程列表时，未登记的课程按 clean(标题).mp4 认领已有文件
+        最后把索引压缩为每节课一行
+        """
+        files = {self._relative(path): path for path in self.scan()}
+        with self.lock:
+            entries = list(self.entries.values())
+        kept, lost = [], []
+        for entry in entries:
+            path = files.get(entry["output"])
+            if path is not None and path.stat().st_size == entry["size"]:
+                kept.append(entry)
+            else:
+                lost.append(entry)
+        claimed = {entry["output"] for entry in kept}
+        unclaimed = {rel: path for rel, path in files.items() if rel not in claimed}
+
+        # 按大小筛选候选文件，再并行计算校验和
+        sizes = {entry["size"] for entry in lost}
+        candidates = [path for path in unclaimed.values() if path.stat().st_size in sizes]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            checksums = dict(zip(candidates, pool.map(file_checksum, candidates)))
+        by_checksum = {checksum: path for path, checksum in checksums.items()}
+
+        stats = {"kept": len(kept), "moved": 0, "removed": 0, "adopted": 0, "unregistered": 0}
+        for entry in lost:
+            path = by_checksum.pop(entry.get("sha256"), None) if entry.get("sha256") else None
+            if path is None:
+                logger.warning(f"索引中的视频已不存在，删除记录: {entry['output']}")
+                self.remove(entry["id"])
+                stats["removed"] += 1
+                continue
+            logger.info(f"视频已移动: {entry['output']} -> {self._relative(path)}")
+            self.record(entry["id"], entry["url"], entry["title"], path, entry.get("duration"), entry["sha256"])
+            unclaimed.pop(self._relative(path), None)
+            stats["moved"] += 1
+
+        for task in adopt or []:
+            title = task.get('title') or task.get('name') or "untitled_video"
+            url = task.get('m3u8')
+            if not url or self.get(playlist_identity(url)):
+                continue
+            rel = self._relative(self.output_dir / f"{clean(title) if clean else title}.mp4")
+            path = unclaimed.pop(rel, None)
+            if path is not None:
+                self.record(playlist_identity(url), url, title, path)
+                stats["adopted"] += 1
+        stats["unregistered"] = len(unclaimed)
+        self.compact()
+        return stats
+
+    def compact(self):
+        """重写索引文件：每节课一行"""
+        with self.lock:
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def shared_index(output_dir):
+    """进程内每个输出目录共享一个索引（首次使用时读取）"""
+    key = os.path.abspath(output_dir)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = LessonIndex(output_dir)
+        return _indexes[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="已完成课程索引")
+    parser.add_argument("--dir", default="videos", help="输出目录")
+    parser.add_argument("--workers", type=int, default=8, help="并行计算校验和的线程数")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("verify", help="校验索引中的文件")
+    p.add_argument("--quick", action="store_true", help="只比较大小，不计算校验和")
+    p = sub.add_parser("rebuild", help="扫描输出目录重建索引")
+    p.add_argument("--adopt", help="课程列表 JSON，按标题认领索引建立之前下载的视频")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    index = LessonIndex(args.dir)
+    start = time.perf_counter()
+    if args.command == "verify":
+        results = index.verify(workers=args.workers, quick=args.quick)
+        print(f"✅ 正常 {len(results['ok'])}，补全校验和 {len(results['filled'])}，"
+              f"缺失 {len(results['missing'])}，大小不符 {len(results['size_mismatch'])}，"
+              f"校验和不符 {len(results['checksum_mismatch'])}（{time.perf_counter() - start:.1f}s）")
+        for status in ("missing", "size_mismatch", "checksum_mismatch"):
+            for identity in results[status]:
+                entry = index.get(identity)
+                print(f"  ❌ {status}: {entry['output']} ({entry['title']})")
+    else:
+        tasks = None
+        clean = None
+        if args.adopt:
+            from main import clean_filename as clean
+            with open(args.adopt, 'r', encoding='utf-8') as f:
+                tasks = json.load(f)
+        stats = index.rebuild(workers=args.workers, adopt=tasks, clean=clean)
+        print(f"📚 保留 {stats['kept']}，找回移动的文件 {stats['moved']}，删除 {stats['removed']}，"
+              f"认领 {stats['adopted']}，未登记的视频 {stats['unregistered']}（{time.perf_counter() - start:.1f}s）")
+
+
+if __name__ == "__main__":
+    main()
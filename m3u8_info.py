@@ -2,16 +2,27 @@
 # -*- coding: utf-8 -*-
 """
 获取m3u8视频信息（视频长度、文件大小）
+
+    python m3u8_info.py <m3u8_url>                    单节课
+    python m3u8_info.py --batch [m3u8_list.json]      整门课：并行获取每节课的信息，汇总时长、大小和预计下载时间
 """
 
+import argparse
+import csv
+import json
+import math
 import os
-import re
+import random
 import sys
 import time
+import unicodedata
 import requests
-from urllib.parse import urljoin, urlparse
-from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
+import http_pool
+from hls_parser import parse_playlist
+from rendition import RenditionPolicy
 
 # 配置日志
 logging.basicConfig(
@@ -34,19 +45,34 @@ SUCCESS_COUNT = 0
 FAILED_COUNT = 0
 TIMEOUT = 30
 MAX_WORKERS = 10
+SIZE_MODE = "estimate"  # 文件大小计算方式: "estimate" 抽样估算 / "exact" 逐个分片 HEAD
+SAMPLE_SIZE = 30  # 估算模式抽样的分片数
+CONFIDENCE_Z = 1.96  # 置信区间的 z 值（95%）
+SURVEY_WORKERS = 8  # 批量模式同时获取信息的课程数
+SURVEY_RATES = (5, 20, 50)  # 批量模式未指定 --throughput 时，按这几档吞吐（MB/s）估算下载时间
 
 
 class M3U8InfoGetter:
-    def __init__(self, timeout=TIMEOUT, max_workers=MAX_WORKERS):
-        """初始化M3U8信息获取器"""
+    def __init__(self, timeout=TIMEOUT, max_workers=MAX_WORKERS, mode=SIZE_MODE, samples=SAMPLE_SIZE, seed=None,
+                 policy=None, pool_size=None):
+        """
+        初始化M3U8信息获取器
+        policy: 码率选择策略（rendition.RenditionPolicy，默认最高码率）
+        pool_size: 连接池大小（默认与 max_workers 相同；批量模式多节课共享时按总并发设置）
+        """
         self.timeout = timeout
         self.max_workers = max_workers
-        self.session = requests.Session()
-        self.session.headers.update({
+        self.mode = mode
+        self.samples = samples
+        self.rng = random.Random(seed)
+        self.policy = policy or RenditionPolicy()
+        self.bandwidth = None  # 所选码率的 (BANDWIDTH, AVERAGE-BANDWIDTH)，单位 bps
+        self.rendition = None  # 所选码率（rendition.Choice）
+        # 进程内连接池：池大小和请求头相同的实例共用同一个会话
+        self.session = http_pool.get_session(pool_size=pool_size or max_workers, headers={
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
                           'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         })
-        self.session.verify = False  # 禁用SSL验证
 
     def get_m3u8_content(self, url):
         """获取m3u8文件内容"""
@@ -60,99 +86,145 @@ class M3U8InfoGetter:
             logger.error(f"获取m3u8文件失败: {e}")
             return None
 
-    def is_master_playlist(self, m3u8_content):
-        """判断是否为主播放列表（包含#EXT-X-STREAM-INF）"""
-        return '#EXT-X-STREAM-INF' in m3u8_content
-
-    def get_best_quality_stream(self, m3u8_content, base_url):
-        """获取最高质量的流地址"""
-        streams = []
-        lines = m3u8_content.strip().split('\n')
-
-        for i, line in enumerate(lines):
-            if line.startswith('#EXT-X-STREAM-INF'):
-                # 解析带宽信息
-                bandwidth_match = re.search(r'BANDWIDTH=(\d+)', line)
-                bandwidth = int(bandwidth_match.group(1)) if bandwidth_match else 0
-
-                # 获取下一行的URL
-                if i + 1 < len(lines) and not lines[i + 1].startswith('#'):
-                    stream_url = lines[i + 1].strip()
-                    # 构建完整URL
-                    if not stream_url.startswith(('http://', 'https://')):
-                        stream_url = urljoin(base_url, stream_url)
-                    streams.append((bandwidth, stream_url))
-
-        if streams:
-            # 按带宽排序，返回最高带宽的流
-            streams.sort(reverse=True, key=lambda x: x[0])
-            best_stream = streams[0]
-            logger.info(f"选择最高质量流: 带宽={best_stream[0]}bps, URL={best_stream[1]}")
-            return best_stream[1]
+    def get_best_quality_stream(self, playlist):
+        """按码率策略（默认最高质量）获取流地址"""
+        if playlist.variants:
+            choice = self.rendition = self.policy.select(playlist)
+            # 独立音频轨没有声明码率，只能抽样估算
+            self.bandwidth = (None, choice.bandwidth) if choice.bandwidth else None
+            logger.info(f"选择流 [{choice.policy}]: {choice.label}, URL={choice.url}")
+            return choice.url
 
         logger.warning("未找到流信息")
         return None
 
-    def get_segment_info(self, m3u8_content, base_url):
-        """获取所有片段信息"""
-        segments = []
-        lines = m3u8_content.strip().split('\n')
-
-        for i, line in enumerate(lines):
-            if line.startswith('#EXTINF'):
-                # 解析时长
-                duration_match = re.search(r'#EXTINF:(\d+\.?\d*)', line)
-                if duration_match:
-                    duration = float(duration_match.group(1))
-
-                    # 获取下一行的URL
-                    if i + 1 < len(lines) and not lines[i + 1].startswith('#'):
-                        segment_url = lines[i + 1].strip()
-                        # 构建完整URL
-                        if not segment_url.startswith(('http://', 'https://')):
-                            segment_url = urljoin(base_url, segment_url)
-                        segments.append((duration, segment_url))
-
+    def get_segment_info(self, playlist):
+        """获取所有片段信息（hls_parser.SegmentTable）"""
+        segments = playlist.segments
         logger.info(f"找到 {len(segments)} 个视频片段")
         return segments
 
     def get_file_size(self, url):
-        """获取文件大小（字节）"""
-        global SUCCESS_COUNT, FAILED_COUNT
+        """获取文件大小（字节），失败返回 None"""
         try:
             response = self.session.head(url, timeout=self.timeout)
             response.raise_for_status()
-
             if 'Content-Length' in response.headers:
-                size = int(response.headers['Content-Length'])
-                SUCCESS_COUNT += 1
-                return size
-            else:
-                logger.warning(f"未找到Content-Length头: {url}")
-                FAILED_COUNT += 1
-                return 0
+                return int(response.headers['Content-Length'])
+
+            # 部分 CDN 的 HEAD 不带长度，改用 1 字节的 Range 请求，从 Content-Range 中读总长度
+            with self.session.get(url, headers={'Range': 'bytes=0-0'}, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                content_range = response.headers.get('Content-Range', '')
+                if '/' in content_range and content_range.rsplit('/', 1)[1].isdigit():
+                    return int(content_range.rsplit('/', 1)[1])
+                if response.status_code == 200 and 'Content-Length' in response.headers:
+                    return int(response.headers['Content-Length'])
+            logger.warning(f"未找到Content-Length头: {url}")
+            return None
         except Exception as e:
             logger.error(f"获取文件大小失败 {url}: {e}")
-            FAILED_COUNT += 1
-            return 0
+            return None
 
     def process_segment(self, segment):
-        """处理单个片段"""
-        duration, url = segment
-        size = self.get_file_size(url)
-        return duration, size
+        """处理单个片段，返回 (时长, 大小或 None)；带 EXT-X-BYTERANGE 的片段大小已知，不发请求"""
+        if segment.byterange:
+            return segment.duration, segment.byterange[1]
+        return segment.duration, self.get_file_size(segment.url)
+
+    def fetch_sizes(self, segments):
+        """并发获取一组片段的大小；结果由主线程汇总，不在工作线程中修改共享计数"""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.process_segment, segments))
+
+    def exact_size(self, segments):
+        """逐个片段获取大小并求和"""
+        results = self.fetch_sizes(segments)
+        sizes = [size for _, size in results if size is not None]
+        return {
+            'size': sum(sizes),
+            'size_low': None,
+            'size_high': None,
+            'requests': len(segments),
+            'success_count': len(sizes),
+            'failed_count': len(results) - len(sizes),
+        }
 
-    def get_m3u8_info(self, m3u8_url):
-        """获取m3u8视频信息"""
+    def sample_segments(self, segments):
+        """分层抽样：按播放顺序把片段均分为 SAMPLE_SIZE 层，每层随机取一个（码率随内容缓慢变化，分层比简单随机更稳）"""
+        n = min(self.samples, len(segments))
+        picks = []
+        for k in range(n):
+            lo = k * len(segments) // n
+            hi = (k + 1) * len(segments) // n
+            picks.append(segments[self.rng.randrange(lo, hi)])
+        return picks
+
+    def bandwidth_size(self, total_duration):
+        """按播放列表声明的码率估算大小（优先 AVERAGE-BANDWIDTH，BANDWIDTH 是峰值，只能作为上限）"""
+        if not self.bandwidth:
+            return None
+        peak, average = self.bandwidth
+        rate = average or peak
+        return int(rate / 8 * total_duration) if rate else None
+
+    def estimate_size(self, segments):
+        """
+        抽样估算总大小（比率估计）：每秒字节数 r = Σ抽样大小 / Σ抽样时长，总大小 = r × 总时长
+        标准误按 e_i = 大小_i - r × 时长_i 的样本方差计算，返回 CONFIDENCE_Z 对应的置信区间
+        抽样全部失败时退回到播放列表声明的码率
+        """
+        total_duration = sum(segment.duration for segment in segments)
+        if len(segments) <= self.samples:
+            return self.exact_size(segments)
+
+        results = self.fetch_sizes(self.sample_segments(segments))
+        sampled = [(duration, size) for duration, size in results if size is not None]
+        info = {
+            'requests': len(results),
+            'success_count': len(sampled),
+            'failed_count': len(results) - len(sampled),
+        }
+        sample_duration = sum(duration for duration, _ in sampled)
+        if len(sampled) < 2 or sample_duration <= 0:
+            size = self.bandwidth_size(total_duration)
+            logger.warning("抽样失败，按播放列表声明的码率估算")
+            info.update(size=size or 0, size_low=None, size_high=None)
+            return info
+
+        n, N = len(sampled), len(segments)
+        rate = sum(size for _, size in sampled) / sample_duration
+        residual_var = sum((size - rate * duration) ** 2 for duration, size in sampled) / (n - 1)
+        mean_duration = sample_duration / n
+        se = total_duration / mean_duration * math.sqrt((1 - n / N) * residual_var / n)
+        size = rate * total_duration
+        info.update(size=int(size),
+                    size_low=int(max(0, size - CONFIDENCE_Z * se)),
+                    size_high=int(size + CONFIDENCE_Z * se))
+        return info
+
+    def get_m3u8_info(self, m3u8_url, mode=None):
+        """获取m3u8视频信息并打印，mode 为 "estimate" 或 "exact"（默认取初始化时的设置）"""
         global TOTAL_DURATION, TOTAL_SIZE, SUCCESS_COUNT, FAILED_COUNT
+        info = self.collect_info(m3u8_url, mode)
+        if info is None:
+            return None
+        # 兼容旧的全局变量（仅在主线程中一次性写入）
+        TOTAL_DURATION = info['duration']
+        TOTAL_SIZE = info['size']
+        SUCCESS_COUNT = info['success_count']
+        FAILED_COUNT = info['failed_count']
+
+        self.print_info(info)
+        return info
 
-        # 重置全局变量
-        TOTAL_DURATION = 0.0
-        TOTAL_SIZE = 0
-        SUCCESS_COUNT = 0
-        FAILED_COUNT = 0
+    def collect_info(self, m3u8_url, mode=None):
+        """获取m3u8视频信息，不打印、不修改全局变量（批量模式中每节课一个实例并行调用）"""
+        mode = mode or self.mode
 
         start_time = time.time()
+        self.bandwidth = None
+        self.rendition = None
 
         # 获取主m3u8文件
         main_content = self.get_m3u8_content(m3u8_url)
@@ -160,38 +232,36 @@ class M3U8InfoGetter:
             return None
 
         final_m3u8_url = m3u8_url
-        final_content = main_content
+        playlist = parse_playlist(main_content, m3u8_url)
 
         # 如果是主播放列表，获取子播放列表
-        if self.is_master_playlist(main_content):
-            sub_m3u8_url = self.get_best_quality_stream(main_content, m3u8_url)
+        if playlist.is_master:
+            sub_m3u8_url = self.get_best_quality_stream(playlist)
             if sub_m3u8_url:
                 final_m3u8_url = sub_m3u8_url
                 final_content = self.get_m3u8_content(sub_m3u8_url)
                 if not final_content:
                     return None
+                playlist = parse_playlist(final_content, final_m3u8_url)
 
         # 获取片段信息
-        segments = self.get_segment_info(final_content, final_m3u8_url)
+        segments = self.get_segment_info(playlist)
         if not segments:
             logger.error("未找到视频片段信息")
             return None
 
         # 计算总时长
-        total_duration = sum(duration for duration, _ in segments)
-        TOTAL_DURATION = total_duration
+        total_duration = segments.total_duration
 
         logger.info(f"总时长: {total_duration:.2f}秒")
 
         # 使用线程池获取文件大小
-        logger.info(f"开始获取文件大小信息（使用{self.max_workers}个线程）...")
-
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            results = list(executor.map(self.process_segment, segments))
-
-        # 计算总大小
-        total_size = sum(size for _, size in results)
-        TOTAL_SIZE = total_size
+        if mode == "exact":
+            logger.info(f"开始获取文件大小信息（使用{self.max_workers}个线程）...")
+            size_info = self.exact_size(segments)
+        else:
+            logger.info(f"开始抽样估算文件大小（抽样 {min(self.samples, len(segments))} 个片段）...")
+            size_info = self.estimate_size(segments)
 
         # 计算统计信息
         elapsed_time = time.time() - start_time
@@ -199,17 +269,27 @@ class M3U8InfoGetter:
         info = {
             'url': m3u8_url,
             'final_url': final_m3u8_url,
+            'mode': mode,
             'duration': total_duration,
-            'size': total_size,
             'segment_count': len(segments),
-            'success_count': SUCCESS_COUNT,
-            'failed_count': FAILED_COUNT,
-            'elapsed_time': elapsed_time
+            'encryption': self.encryption(segments),
+            'bandwidth_size': self.bandwidth_size(total_duration),
+            'rendition': self.rendition.label if self.rendition else None,
+            'best_size': self.rendition.best_bytes(total_duration) if self.rendition else None,
+            'elapsed_time': elapsed_time,
+            **size_info
         }
-
-        self.print_info(info)
         return info
 
+    @staticmethod
+    def encryption(segments):
+        """分片使用的加密方法，例如 AES-128；部分分片不加密时加上“（部分）”，不加密时返回“无”"""
+        key_ids = set(segments.key_ids)
+        methods = sorted({segments.keys[k].method for k in key_ids if k >= 0})
+        if not methods:
+            return "无"
+        return "/".join(methods) + ("（部分）" if -1 in key_ids else "")
+
     def print_info(self, info):
         """打印信息"""
         print("\n" + "=" * 60)
@@ -218,14 +298,30 @@ class M3U8InfoGetter:
         print(f"原始URL: {info['url']}")
         print(f"最终URL: {info['final_url']}")
         print(f"视频时长: {self.format_duration(info['duration'])}")
-        print(f"文件大小: {self.format_size(info['size'])}")
+        if info['size_low'] is not None:
+            print(f"文件大小: 约 {self.format_size(info['size'])} "
+                  f"(95% 置信区间 {self.format_size(info['size_low'])} ~ {self.format_size(info['size_high'])})")
+        else:
+            print(f"文件大小: {self.format_size(info['size'])}")
+        if info['rendition']:
+            print(f"所选码率: {info['rendition']}")
+        if info['bandwidth_size']:
+            print(f"按声明码率估算: {self.format_size(info['bandwidth_size'])}")
+        if info['best_size'] and info['best_size'] != info['bandwidth_size']:
+            print(f"最高码率估算: {self.format_size(info['best_size'])}")
         print(f"片段数量: {info['segment_count']}")
+        print(f"加密方式: {info['encryption']}")
+        print(f"大小请求: {info['requests']} 次 ({'抽样估算' if info['mode'] != 'exact' else '逐个获取'})")
         print(f"成功获取大小: {info['success_count']} 个")
         print(f"获取失败: {info['failed_count']} 个")
         print(f"处理时间: {info['elapsed_time']:.2f} 秒")
+        connections = http_pool.format_stats()
+        if connections:
+            print(connections)
         print("=" * 60)
 
-    def format_duration(self, seconds):
+    @staticmethod
+    def format_duration(seconds):
         """格式化时长"""
         hours = int(seconds // 3600)
         minutes = int((seconds % 3600) // 60)
@@ -238,7 +334,8 @@ class M3U8InfoGetter:
         else:
             return f"{secs}秒"
 
-    def format_size(self, bytes_size):
+    @staticmethod
+    def format_size(bytes_size):
         """格式化文件大小"""
         if bytes_size < 0:
             return "未知"
@@ -254,18 +351,200 @@ class M3U8InfoGetter:
         return f"{size:.2f} {units[unit_index]}"
 
 
+def survey_course(tasks, workers=SURVEY_WORKERS, mode=SIZE_MODE, samples=SAMPLE_SIZE, policy=None,
+                  progress=None):
+    """
+    批量获取课程列表（油猴脚本导出的 [{"title", "m3u8"}]）中每节课的信息，返回与 tasks 同序的行列表
+    最多 workers 节课并行获取播放列表和抽样；每节课的抽样线程数按并行课程数分摊，总并发约为 max(workers, MAX_WORKERS)
+    获取失败的课程 error 不为空；progress(完成数, 总数) 在每节课完成后调用
+    """
+    segment_workers = max(1, MAX_WORKERS // workers)
+    pool_size = max(workers, MAX_WORKERS)  # 各节课共用一个按总并发设置的连接池
+
+    def survey(task):
+        title = task.get('title') or task.get('name') or "untitled_video"
+        url = task.get('m3u8')
+        row = {'title': title, 'url': url}
+        if not url:
+            row['error'] = "缺少 m3u8 地址"
+            return row
+        getter = M3U8InfoGetter(max_workers=segment_workers, mode=mode, samples=samples, policy=policy,
+                                pool_size=pool_size)
+        try:
+            info = getter.collect_info(url)
+        except Exception as e:
+            logger.error(f"获取课程信息失败 [{title}]: {e}")
+            info = None
+        if info is None:
+            row['error'] = "获取播放列表失败"
+            return row
+        row.update({key: info[key] for key in ('duration', 'segment_count', 'size', 'size_low', 'size_high',
+                                                'encryption', 'rendition', 'failed_count')})
+        return row
+
+    rows = [None] * len(tasks)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(survey, task): i for i, task in enumerate(tasks)}
+        for done, future in enumerate(as_completed(futures), 1):
+            rows[futures[future]] = future.result()
+            if progress:
+                progress(done, len(tasks))
+    return rows
+
+
+def survey_total(rows):
+    """
+    汇总：总时长、分片数、大小；各节课的估算误差相互独立，总大小的置信区间半宽取各节课半宽的平方和开方
+    """
+    ok = [row for row in rows if not row.get('error')]
+    size = sum(row['size'] for row in ok)
+    half_widths = [(row['size_high'] - row['size_low']) / 2 for row in ok if row['size_low'] is not None]
+    margin = math.sqrt(sum(w * w for w in half_widths)) if half_widths else None
+    return {
+        'lessons': len(rows),
+        'failed': len(rows) - len(ok),
+        'encrypted': sum(1 for row in ok if row['encryption'] != "无"),
+        'duration': sum(row['duration'] for row in ok),
+        'segment_count': sum(row['segment_count'] for row in ok),
+        'size': size,
+        'size_low': int(max(0, size - margin)) if margin is not None else None,
+        'size_high': int(size + margin) if margin is not None else None,
+    }
+
+
+def download_seconds(size, throughput):
+    """按吞吐（MB/s）估算下载秒数"""
+    return size / (throughput * 1024 * 1024)
+
+
+def _display_width(text):
+    return sum(2 if unicodedata.east_asian_width(ch) in "WF" else 1 for ch in text)
+
+
+def _fit(text, width):
+    """按显示宽度截断并补齐（中文占两列）"""
+    text = str(text)
+    while _display_width(text) > width:
+        text = text[:-2] + "…"
+    return text + " " * (width - _display_width(text))
+
+
+def print_survey(rows, total, throughput=None):
+    """打印每节课和汇总的表格，以及按吞吐估算的下载时间"""
+    fmt = M3U8InfoGetter.format_size
+    duration = M3U8InfoGetter.format_duration
+    print("\n" + "=" * 100)
+    header = f"{_fit('#', 4)}{_fit('课程', 36)}{_fit('时长', 16)}{_fit('分片', 8)}{_fit('大小', 14)}{_fit('加密', 12)}"
+    print(header + ("预计下载" if throughput else ""))
+    print("-" * 100)
+    for i, row in enumerate(rows, 1):
+        line = f"{_fit(i, 4)}{_fit(row['title'], 36)}"
+        if row.get('error'):
+            print(line + f"❌ {row['error']}")
+            continue
+        line += f"{_fit(duration(row['duration']), 16)}{_fit(row['segment_count'], 8)}" \
+                f"{_fit(('约 ' if row['size_low'] is not None else '') + fmt(row['size']), 14)}" \
+                f"{_fit(row['encryption'], 12)}"
+        if throughput:
+            line += duration(download_seconds(row['size'], throughput))
+        print(line)
+    print("-" * 100)
+    print(f"课程数: {total['lessons']}（获取失败 {total['failed']}，加密 {total['encrypted']}）")
+    print(f"总时长: {duration(total['duration'])}，分片 {total['segment_count']} 个")
+    if total['size_low'] is not None:
+        print(f"总大小: 约 {fmt(total['size'])}（95% 置信区间 {fmt(total['size_low'])} ~ "
+              f"{fmt(total['size_high'])}）")
+    else:
+        print(f"总大小: {fmt(total['size'])}")
+    for rate in ([throughput] if throughput else SURVEY_RATES):
+        line = f"预计下载时间 @ {rate:g} MB/s: {duration(download_seconds(total['size'], rate))}"
+        if total['size_high'] is not None:
+            line += f"（最长 {duration(download_seconds(total['size_high'], rate))}）"
+        print(line)
+    connections = http_pool.format_stats()
+    if connections:
+        print(connections)
+    print("=" * 100)
+
+
+def export_survey(rows, total, path, throughput=None):
+    """按扩展名导出为 CSV（每节课一行）或 JSON（每节课 + 汇总）"""
+    if throughput:
+        for row in rows:
+            if not row.get('error'):
+                row['download_seconds'] = round(download_seconds(row['size'], throughput), 1)
+        total = dict(total, throughput_mb_s=throughput,
+                     download_seconds=round(download_seconds(total['size'], throughput), 1))
+    if str(path).lower().endswith(".csv"):
+        fields = ['title', 'url', 'duration', 'segment_count', 'size', 'size_low', 'size_high', 'encryption',
+                  'rendition', 'failed_count', 'download_seconds', 'error']
+        # utf-8-sig: Excel 打开时中文不乱码
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'lessons': rows, 'total': total}, f, ensure_ascii=False, indent=2)
+
+
 def main():
     """主函数"""
-    if len(sys.argv) > 1:
-        m3u8_url = sys.argv[1]
+    parser = argparse.ArgumentParser(description="获取 m3u8 视频信息（时长、大小）")
+    parser.add_argument("url", nargs="?", help="m3u8 文件 URL")
+    parser.add_argument("--exact", action="store_true", help="逐个片段获取大小（默认抽样估算）")
+    parser.add_argument("--samples", type=int, default=SAMPLE_SIZE, help="估算模式抽样的片段数")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--resolution", type=int, metavar="HEIGHT", help="选择高度不超过该值的最高码率（例如 720）")
+    group.add_argument("--max-bitrate", type=int, metavar="BPS", help="选择平均带宽不超过该值的最高码率")
+    group.add_argument("--audio-only", action="store_true", help="选择独立音频轨")
+    parser.add_argument("--batch", nargs="?", const="m3u8_list.json", metavar="FILE",
+                        help="批量模式：获取课程列表中每节课的信息（默认 m3u8_list.json）")
+    parser.add_argument("--workers", type=int, default=SURVEY_WORKERS, help="批量模式同时获取信息的课程数")
+    parser.add_argument("--throughput", type=float, metavar="MB/S", help="批量模式按该吞吐估算下载时间")
+    parser.add_argument("--output", metavar="FILE", help="批量模式导出结果（.csv 或 .json）")
+    args = parser.parse_args()
+
+    if args.audio_only:
+        policy = RenditionPolicy("audio")
+    elif args.resolution:
+        policy = RenditionPolicy("resolution", height=args.resolution)
+    elif args.max_bitrate:
+        policy = RenditionPolicy("bitrate", max_bitrate=args.max_bitrate)
     else:
-        m3u8_url = input("请输入m3u8文件URL: ").strip()
-
+        policy = RenditionPolicy()
+    mode = "exact" if args.exact else SIZE_MODE
+
+    if args.batch:
+        with open(args.batch, 'r', encoding='utf-8') as f:
+            tasks = json.load(f)
+        print(f"🚀 加载了 {len(tasks)} 节课，{args.workers} 节课并行获取信息...")
+        # 每个请求一行的日志只写入文件，控制台显示进度
+        for handler in logging.getLogger().handlers:
+            if type(handler) is logging.StreamHandler:
+                handler.setLevel(logging.WARNING)
+
+        def report(done, total):
+            sys.stdout.write(f"\r进度: {done}/{total}")
+            sys.stdout.flush()
+
+        start = time.time()
+        rows = survey_course(tasks, workers=args.workers, mode=mode, samples=args.samples, policy=policy,
+                             progress=report)
+        print(f"\n⏱️ 耗时 {time.time() - start:.1f} 秒")
+        total = survey_total(rows)
+        print_survey(rows, total, args.throughput)
+        if args.output:
+            export_survey(rows, total, args.output, args.throughput)
+            print(f"📄 已导出: {args.output}")
+        return
+
+    m3u8_url = args.url or input("请输入m3u8文件URL: ").strip()
     if not m3u8_url:
         print("错误: URL不能为空")
         sys.exit(1)
 
-    getter = M3U8InfoGetter()
+    getter = M3U8InfoGetter(mode=mode, samples=args.samples, policy=policy)
     getter.get_m3u8_info(m3u8_url)
 
 
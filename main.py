@@ -5,22 +5,28 @@ import sys
 import time
 import requests
 from pathlib import Path
-from urllib.parse import urljoin
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from identity import lesson_identity, playlist_identity, segment_key, has_signature
+from hls_parser import parse_playlist
+from key_manager import KeyManager, HAS_CRYPTO, shared_key_cache, decrypt_pool
+from journal import ResumeJournal, reclaim_orphans, lock_dir, lock_file
+from segment_store import SegmentStore
+from segment_cache import shared_cache
+from lesson_index import shared_index, file_checksum
+from ts_validate import TSValidator, IntegrityReport, SegmentInvalid, is_packed_audio
+from concurrency import shared_limiter
+from hedge import HedgeController, HedgeAbandoned
+from range_fetch import coalesce_ranges, shared_fetcher, stats as range_stats
+from token_refresh import TokenRecovery, auth_status, remap_segments
+from rendition import RenditionPolicy, CourseAllowance, ThroughputMeter
+import http_pool
+import metrics
 import logging
 import os
 import shutil
 import string
-import random
-
-# 引入解密库
-try:
-    from Crypto.Cipher import AES
-    from Crypto.Util.Padding import unpad
-
-    HAS_CRYPTO = True
-except ImportError:
-    HAS_CRYPTO = False
+import threading
+import zlib
 
 # --- 配置区域 ---
 LOG_FILE = "m3u8_download.log"
@@ -28,8 +34,61 @@ INPUT_FILE = "m3u8_list.json"
 OUTPUT_DIR = Path("videos")
 MAX_THREADS = 16  # 适当增加线程数
 DOWNLOAD_TIMEOUT = 30
-CHUNK_SIZE = 1024 * 1024
+CHUNK_SIZE = 1024 * 1024  # 流式下载每次读取的字节数
+SEGMENT_STREAMING = True  # 分片流式下载 + 增量解密（False 时整段读入内存后再解密）
+RESUME_VERIFY = False  # 续传时按日志中的大小和 crc32 重新校验已完成的分片
+ORPHAN_TTL_DAYS = 7  # 超过该天数未更新的临时目录视为孤立目录并清理
+COMPLETED_INDEX = True  # 按播放列表地址（与标题无关）记录已完成的课程（输出目录下的 .completed.jsonl），跳过时不访问磁盘
+SEGMENT_CACHE_SIZE = 0  # 分片缓存上限（字节），例如 2 * 1024 ** 3，按去掉签名参数的 URL 缓存，令牌过期重新导出后不必重新下载；0 表示不缓存（stream / container 模式下开启缓存会把每个分片多写一次盘）
+SEGMENT_CACHE_DIR = None  # 分片缓存目录，None 表示输出目录下的 .segment_cache
+TOKEN_REFRESH = True  # 分片 URL 令牌中途过期时暂停下载、刷新播放列表后继续（已下载的分片保留）
+TOKEN_EXPIRY_THRESHOLD = 3  # 30 秒内鉴权失败（401/403/410）达到该次数时判定为令牌过期
+TOKEN_REFRESH_FILE = None  # 重新导出的课程列表文件（按标题查找新的 m3u8 地址），None 表示使用 INPUT_FILE
+TOKEN_REFRESH_WAIT = 120  # 各个来源都拿不到新地址时，等待重新导出课程列表的最长秒数，0 表示不等待
 FFMPEG_TIMEOUT = 600  # 合并超时时间
+DOWNLOAD_ENGINE = "thread"  # 分片下载引擎: "thread" 线程池 / "async" asyncio（需安装 aiohttp）
+ASYNC_MAX_INFLIGHT = 16  # async 引擎同时在途的最大请求数，默认与 MAX_THREADS 相同（过大会压垮源站，启用自适应并发时再受其窗口约束）
+RUN_MODE = "serial"  # 任务调度: "serial" 逐课下载 / "pipeline" 解析/下载/合并/清理流水线（同名课程会写到同一个输出文件，启用前确保标题不重复） / "scheduler" 多课共享并发预算 / "queue" SQLite 任务队列（多进程、多机器共享） / "daemon" 常驻服务（油猴脚本直接提交课程）
+MAX_ACTIVE_LESSONS = 3  # scheduler 模式下同时下载的课程数
+PIPELINE_PARSE_WORKERS = 2  # pipeline 模式: 预取、解析播放列表的线程数
+PIPELINE_DOWNLOAD_WORKERS = 1  # pipeline 模式: 同时下载的课程数（每节课内部按 MAX_THREADS 并发）
+PIPELINE_MERGE_WORKERS = 1  # pipeline 模式: 同时合并的课程数
+PIPELINE_CLEANUP_WORKERS = 1  # pipeline 模式: 校验输出、清理临时目录的线程数
+PIPELINE_QUEUE_SIZE = 2  # pipeline 模式: 阶段之间的队列容量（课程数），满时上游阶段等待
+JOB_QUEUE_DB = "jobs.db"  # queue 模式的任务数据库，可放在共享文件系统上供多台机器的 worker 使用
+JOB_LEASE_SECONDS = 120  # queue 模式: 领取课程的租约秒数，worker 失联超过该时间后课程由其他 worker 接手
+JOB_MAX_ATTEMPTS = 3  # queue 模式: 每节课最多领取的次数
+DAEMON_HOST = "127.0.0.1"  # daemon 模式: 课程提交接口的监听地址（仅本机）
+DAEMON_PORT = 18710  # daemon 模式: 监听端口，与油猴脚本中的 DAEMON_URL 一致
+RENDITION_POLICY = "best"  # 码率选择: "best" 最高码率 / "resolution" 不超过 RENDITION_HEIGHT / "bitrate" 不超过 RENDITION_MAX_BITRATE / "budget" 整门课不超过 COURSE_DISK_BUDGET / "deadline" 在 COURSE_DEADLINE 内下完 / "audio" 只下载音频
+RENDITION_HEIGHT = 720  # resolution 策略的目标高度（像素）
+RENDITION_MAX_BITRATE = 1_500_000  # bitrate 策略的码率上限（bps）
+COURSE_DISK_BUDGET = None  # budget 策略: 整门课的磁盘预算（字节），例如 5 * 1024 ** 3，按各节课时长分摊
+COURSE_DEADLINE = None  # deadline 策略: 整门课的下载时限（秒），按实测吞吐换算成码率上限
+MERGE_MODE = "files"  # 合并方式: "files" 下载完再合并 / "stream" 边下载边写入 ffmpeg
+STREAM_WINDOW = 64  # stream 模式的重排窗口（分片数）
+MERGE_BACKEND = "ffmpeg"  # 合并后端: "ffmpeg" / "python"（纯 Python 转封装，无需 ffmpeg）
+SEGMENT_STORE = "files"  # files 模式的分片存储: "files" 每个分片一个 .ts 文件 / "container" 每节课一个预分配的容器文件
+ADAPTIVE_CONCURRENCY = False  # 按吞吐、延迟和错误率自动调整并发（AIMD），MAX_THREADS 仅作初始值
+ADAPTIVE_MIN_THREADS = 2  # 自适应并发的下限
+ADAPTIVE_MAX_THREADS = 64  # 自适应并发的上限（线程池按此大小创建）
+HEDGE_REQUESTS = False  # 慢分片对冲：超过耗时分位数仍未完成时再发一个相同请求，先到先用
+HEDGE_PERCENTILE = 95  # 对冲阈值：分片耗时分位数
+HEDGE_BUDGET = 0.05  # 对冲请求数占分片请求数的上限比例
+HEDGE_MIN_DELAY = 1.0  # 对冲阈值下限（秒）
+HOST_MAX_CONNECTIONS = None  # 每个主机的连接数上限（None 表示与线程数相同）
+HTTP2 = False  # 使用 HTTP/2 多路复用（需安装 httpx[http2]，CDN 需支持 HTTP/2）
+DNS_CACHE_TTL = 300  # DNS 缓存秒数，0 表示不缓存
+KEY_CACHE_SIZE = 64  # 解密密钥 LRU 缓存容量（跨课程共享）
+DECRYPT_WORKERS = 2  # 解密线程数：下载线程读取下一块的同时解密上一块，0 表示在下载线程中解密
+RANGE_SPLIT_SIZE = 8 * 1024 * 1024  # 超过该大小的分片拆成多个 Range 请求并发下载，0 表示不拆分
+RANGE_PART_SIZE = 4 * 1024 * 1024  # 拆分后每个 Range 请求的字节数
+RANGE_COALESCE_SIZE = 8 * 1024 * 1024  # EXT-X-BYTERANGE 相邻分片合并为一个请求的字节上限，0 表示不合并
+RANGE_WORKERS = 8  # 并发下载各部分的线程数（所有课程共享）
+METRICS_SUMMARY = True  # 每节课结束时输出分阶段耗时表（DNS / 建连 / 首字节 / 传输 / 解密 / 写出 / 合并）
+METRICS_EVENTS_FILE = None  # 分片事件的 JSON Lines 输出文件，例如 "metrics.jsonl"，None 表示不输出
+METRICS_PORT = None  # Prometheus 文本格式指标端点端口（http://127.0.0.1:端口/metrics），None 表示不开启
+VALIDATE_SEGMENTS = True  # 边下载边校验 TS 分片（同步字节、截断、HTML 错误页、解密失败），损坏时立即重新下载
 
 # --- 日志配置 ---
 logging.basicConfig(
@@ -45,6 +104,8 @@ logger = logging.getLogger(__name__)
 # 禁用SSL警告
 requests.packages.urllib3.disable_warnings()
 
+RESERVED_DIR = ".reserved"  # 输出目录下存放输出文件名占用锁的子目录
+
 # 全局请求头
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36",
@@ -52,6 +113,74 @@ HEADERS = {
 }
 
 
+def align_ts(content):
+    """
+    校正 TS 数据的起始同步字节
+    TS流通常以 0x47 开头，有时候数据头有点垃圾数据，尝试找一下同步字节
+    packed audio（ID3 + ADTS）不是 TS，原样返回
+    """
+    if content and content[0] != 0x47 and not is_packed_audio(content):
+        offset = content.find(b'\x47')
+        if 0 < offset < 188:
+            return content[offset:]
+    return content
+
+
+class RangeReader:
+    """在完整响应上模拟字节范围：跳过前 offset 字节，最多读出 length 字节"""
+
+    def __init__(self, raw, offset, length):
+        self.raw = raw
+        self.skip = offset
+        self.remaining = length
+
+    def readinto(self, buffer):
+        while self.skip:
+            n = self.raw.readinto(buffer[:min(len(buffer), self.skip)])
+            if not n:
+                return 0
+            self.skip -= n
+        if not self.remaining:
+            return 0
+        n = self.raw.readinto(buffer[:min(len(buffer), self.remaining)])
+        self.remaining -= n
+        return n
+
+
+def timed_decrypt(cipher, src, dst):
+    """解密 src 到 dst，返回耗时（在解密线程中执行时由下载线程汇总）"""
+    start = time.perf_counter()
+    cipher.decrypt(src, output=dst)
+    return time.perf_counter() - start
+
+
+def pkcs7_padding_len(block):
+    """返回末尾 PKCS#7 填充的长度，无有效填充时返回 0"""
+    n = block[-1] if len(block) else 0
+    if 1 <= n <= 16 and len(block) >= n and bytes(block[-n:]) == bytes([n]) * n:
+        return n
+    return 0
+
+
+def retry_delay(error):
+    """重试前的等待时间：分片校验失败立即重试，429/503 优先遵循 Retry-After（最多 30 秒），其余 1 秒"""
+    if isinstance(error, SegmentInvalid):
+        return 0
+    response = getattr(error, "response", None)
+    # requests 的响应头在 error.response 上，aiohttp 的 ClientResponseError 直接带 headers
+    headers = response.headers if response is not None else getattr(error, "headers", None)
+    retry_after = headers.get("Retry-After", "") if headers else ""
+    if retry_after.isdigit():
+        return min(int(retry_after), 30)
+    return 1
+
+
+def contiguous(unit):
+    """同一个 URL 上首尾相接的字节范围分片"""
+    return all(b.url == a.url and b.byterange and a.byterange and b.byterange[0] == a.byterange[0] + a.byterange[1]
+               for a, b in zip(unit, unit[1:]))
+
+
 def clean_filename(name):
     """
     生成安全且支持中文的文件名
@@ -71,168 +200,797 @@ def clean_filename(name):
 
 
 class M3U8Downloader:
-    def __init__(self, url, title, output_dir):
+    def __init__(self, url, title, output_dir, refresh_url=None, policy=None):
+        """
+        refresh_url: 令牌过期时调用 refresh_url(title) 获取新的 m3u8 地址（可选，返回 None 表示没有）
+        policy: 码率选择策略（rendition.RenditionPolicy），None 时按 RENDITION_* 配置创建（不分摊课程额度）
+        """
         self.url = url
+        self.source_url = url  # 解析多码率列表后 self.url 会变成子播放列表
+        self.refresh_url = refresh_url
         # 在初始化时就完成文件名清洗
         self.title = clean_filename(title)
         self.output_dir = Path(output_dir)
-        # 增加随机位防止任务重名冲突
-        self.temp_dir = self.output_dir / f"temp_{self.title}_{random.getrandbits(16)}"
-
-        self.session = requests.Session()
-
-        # --- 根据线程数调整连接池大小 ---
-        # pool_connections: 针对不同主机的连接池数量
-        # pool_maxsize: 每个连接池允许的最大连接数
-        adapter = requests.adapters.HTTPAdapter(
-            pool_connections=MAX_THREADS,
-            pool_maxsize=MAX_THREADS + 2,  # 稍微多给一点余量
-            max_retries=3
+        # 用 URL + 标题的稳定标识区分任务，重新运行时能找到上次的临时目录
+        self.identity = lesson_identity(url, self.title)
+        self.policy = policy or rendition_policy()
+        # 只下载音频时保存为 .m4a，临时目录和索引记录都与同一节课的视频分开
+        audio = self.policy.mode == "audio"
+        self.suffix = ".m4a" if audio else ".mp4"
+        self.temp_dir = self.output_dir / f"temp_{self.title}_{self.identity}{'_audio' if audio else ''}"
+        self.dir_lock = None  # 下载期间持有的临时目录锁，孤立目录清理据此跳过正在使用的目录
+        self.output_lock = None  # 下载到登记完成期间占用输出文件名的锁，同名的其他课程据此改用带标识的文件名
+        self.final_mp4 = self.output_dir / f"{self.title}{self.suffix}"
+        # 已完成课程索引：按去掉签名参数的播放列表地址识别，改名的课程也能跳过
+        self.playlist_id = playlist_identity(url) + ("-audio" if audio else "")
+        self.index = shared_index(self.output_dir) if COMPLETED_INDEX else None
+
+        self.workers = ADAPTIVE_MAX_THREADS if ADAPTIVE_CONCURRENCY else MAX_THREADS
+        # 自适应模式下所有分片请求都要经过限流器，学到的窗口在多节课之间共享
+        self.limiter = shared_limiter(MAX_THREADS, ADAPTIVE_MIN_THREADS,
+                                      ADAPTIVE_MAX_THREADS) if ADAPTIVE_CONCURRENCY else None
+
+        # --- 配置相同的课程共用一个会话，keep-alive 连接和 DNS 缓存跨课程复用 ---
+        # 连接池按线程数设置，再加上 Range 并发下载线程，稍微多给一点余量（对冲请求、并行的播放列表解析）
+        # 自适应模式下由 download_segment 负责重试，连接池不再静默重试，限流器才能看到连接错误
+        self.session = http_pool.get_session(
+            pool_size=self.workers + RANGE_WORKERS + 2,
+            per_host=HOST_MAX_CONNECTIONS,
+            http2=HTTP2,
+            retries=0 if self.limiter else 3,
+            headers=HEADERS,
+            dns_ttl=DNS_CACHE_TTL
         )
-        self.session.mount('http://', adapter)
-        self.session.mount('https://', adapter)
 
-        self.session.headers.update(HEADERS)
-        self.session.verify = False
+        # 大分片拆分 / 相邻字节范围合并
+        self.ranges = shared_fetcher(self.session, DOWNLOAD_TIMEOUT, RANGE_PART_SIZE, RANGE_WORKERS) \
+            if RANGE_SPLIT_SIZE or RANGE_COALESCE_SIZE else None
 
-        self.key_iv = None
-        self.key_content = None
-        self.segments = []
+        self.key_manager = None  # 解析后为 KeyManager
+        self.segments = []  # 解析后为 hls_parser.SegmentTable
+        self.merger = None  # stream 模式下的 StreamMerger
+        self.hedger = None  # 启用对冲时的 HedgeController
+        self.journal = None  # files 模式下的续传日志
+        self.store = None  # SEGMENT_STORE = "container" 时的 SegmentStore
+        self.bandwidth = None  # 所选码率的平均带宽（bps），用于预估分片总大小
+        self.rendition = None  # 主播放列表中选中的码率（rendition.Choice），媒体播放列表时为 None
+        self.integrity = IntegrityReport()  # 分片完整性报告
+        # 跨课程、跨运行共享的分片缓存
+        self.cache = shared_cache(Path(SEGMENT_CACHE_DIR or self.output_dir / ".segment_cache"),
+                                  SEGMENT_CACHE_SIZE) if SEGMENT_CACHE_SIZE else None
+        self.cache_hits = 0  # 本节课命中缓存的分片数
+        self.cache_hit_bytes = 0
+        self.cache_lock = threading.Lock()
+        # 令牌过期恢复：刷新后的分片表按媒体序列号对齐到原来的下标
+        self.recovery = TokenRecovery(self.refresh_playlist, TOKEN_EXPIRY_THRESHOLD) if TOKEN_REFRESH else None
+        self.remap = None  # (新 SegmentTable, {旧下标: 新下标})
+        # 分阶段耗时：按临时目录名（标题 + 稳定标识）登记，课程结束后归档，重新提交的同名课程不会累加到旧记录
+        self.metrics = metrics.lesson(self.title, key=self.temp_dir.name)
+        self.progress = 0  # 已成功的分片数（queue 模式心跳上报）
+        self.cancel = threading.Event()  # 置位后不再发起分片请求、不合并（queue 模式租约被接管时）
+        self._local = threading.local()  # 每个下载线程复用的读写缓冲区
 
-    def get_content(self, url, is_binary=False):
-        """通用的网络请求方法"""
+    def get_content(self, url, is_binary=False, byterange=None, quiet=True):
+        """通用的网络请求方法，byterange 为 (偏移, 长度) 时只取该范围；quiet=False 时请求失败抛出异常"""
         try:
-            resp = self.session.get(url, timeout=DOWNLOAD_TIMEOUT)
-            resp.raise_for_status()
-            if is_binary:
-                return resp.content
-            resp.encoding = 'utf-8'
-            return resp.text
+            headers = {"Range": f"bytes={byterange[0]}-{byterange[0] + byterange[1] - 1}"} if byterange else None
+            start = time.perf_counter()
+            with self.session.get(url, timeout=DOWNLOAD_TIMEOUT, headers=headers, stream=True) as resp:
+                self.metrics.observe("ttfb", time.perf_counter() - start)
+                resp.raise_for_status()
+                with self.metrics.timer("transfer"):
+                    content = resp.content
+                if is_binary:
+                    if byterange and resp.status_code == 200:
+                        # 服务器忽略了 Range，返回了整个资源
+                        return content[byterange[0]:byterange[0] + byterange[1]]
+                    return content
+                resp.encoding = 'utf-8'
+                return resp.text
         except Exception as e:
+            if not quiet:
+                raise
             logger.error(f"请求失败 [{url}]: {e}")
             return None
 
-    def parse_m3u8(self):
-        """解析M3U8，处理嵌套和加密"""
-        content = self.get_content(self.url)
+    def load_playlist(self, url, previous=None):
+        """
+        下载并解析播放列表，返回 (媒体播放列表, 地址, rendition.Choice)，失败时返回 (None, None, None)
+        主播放列表按码率策略选择；指定 previous 时选择同一音频轨或带宽最接近的码率（刷新时保持同一清晰度）
+        """
+        content = self.get_content(url)
         if not content:
+            return None, None, None
+        playlist = parse_playlist(content, url)
+        if not playlist.is_master:
+            return playlist, url, None
+
+        media = None
+        if previous is not None:
+            choice = self.policy.follow(playlist, previous)
+        else:
+            duration = None
+            if self.policy.needs_duration:
+                # 按时长分摊课程额度：先读最高码率的媒体播放列表取时长（选中最高码率时直接复用）
+                best = playlist.best_variant()
+                content = self.get_content(best.url)
+                if not content:
+                    return None, None, None
+                media = parse_playlist(content, best.url)
+                duration = media.segments.total_duration
+                if self.policy.mode == "deadline" and len(media.segments):
+                    first = media.segments[0]
+                    self.policy.allowance.meter.probe(
+                        lambda: self.get_content(first.url, is_binary=True, byterange=first.byterange))
+            choice = self.policy.select(playlist, duration)
+            logger.info(f"检测到多码率列表，码率策略 {choice.policy}: {choice.label}")
+        logger.info(f"跳转至子播放列表: {choice.url}")
+        if media is None or media.url != choice.url:
+            content = self.get_content(choice.url)
+            if not content:
+                return None, None, None
+            media = parse_playlist(content, choice.url)
+        return media, choice.url, choice
+
+    def parse_m3u8(self):
+        """解析M3U8，处理嵌套和加密（单遍解析，支持密钥轮换、字节范围、媒体序列号）"""
+        # 1. 如果是主播放列表（Master Playlist）则按码率策略选择
+        playlist, url, choice = self.load_playlist(self.url)
+        if playlist is None:
             return False
+        self.url, self.rendition = url, choice
+        self.bandwidth = choice.bandwidth if choice else None
 
-        # 1. 检查是否是主播放列表（Master Playlist），如果是则选择最高码率
-        if "#EXT-X-STREAM-INF" in content:
-            logger.info("检测到多码率列表，选择最高清晰度...")
-            lines = content.splitlines()
-            best_bandwidth = -1
-            best_url = None
-
-            for i, line in enumerate(lines):
-                if "#EXT-X-STREAM-INF" in line:
-                    bw_match = re.search(r'BANDWIDTH=(\d+)', line)
-                    bw = int(bw_match.group(1)) if bw_match else 0
-                    if bw > best_bandwidth and i + 1 < len(lines):
-                        sub_url = lines[i + 1].strip()
-                        if not sub_url.startswith("#"):
-                            best_bandwidth = bw
-                            best_url = urljoin(self.url, sub_url)
-
-            if best_url:
-                logger.info(f"跳转至子播放列表: {best_url}")
-                self.url = best_url
-                content = self.get_content(best_url)
-                if not content: return False
-
-        # 2. 解析加密 Key (AES-128)
+        # 2. 解密 Key (AES-128)：按分片区间映射到 EXT-X-KEY，密钥在下载时按需获取（跨课程 LRU 缓存）
         # 格式示例: #EXT-X-KEY:METHOD=AES-128,URI="key.key",IV=0x...
-        key_match = re.search(r'#EXT-X-KEY:METHOD=([^,]+),URI="([^"]+)"(?:,IV=(0x[0-9a-fA-F]+))?', content)
-        if key_match:
-            method, key_uri, iv_hex = key_match.groups()
-            if method.upper() == 'AES-128':
-                if not HAS_CRYPTO:
-                    logger.error("检测到加密视频，但未安装 pycryptodome 库，无法解密！")
-                    return False
+        self.segments = playlist.segments
+        self.key_manager = KeyManager(self.segments, self.fetch_key, shared_key_cache(KEY_CACHE_SIZE))
+        for method in self.key_manager.unsupported_methods():
+            logger.warning(f"不支持的加密方法: {method}，可能会导致合并失败")
+        if self.key_manager.encrypted:
+            if not HAS_CRYPTO:
+                logger.error("检测到加密视频，但未安装 pycryptodome 库，无法解密！")
+                return False
+            # 先取第一个密钥，密钥地址失效时尽早失败
+            try:
+                self.key_manager.key_for(self.segments[self.key_manager.ranges[0][0]])
+            except (RuntimeError, requests.RequestException) as e:
+                logger.error(f"无法获取解密密钥: {e}")
+                return False
+            logger.info(f"共 {len(self.key_manager.ranges)} 个密钥区间")
 
-                full_key_url = urljoin(self.url, key_uri)
-                logger.info(f"正在获取解密密钥: {full_key_url}")
-                self.key_content = self.get_content(full_key_url, is_binary=True)
+        # 3. 分片表
+        logger.info(f"解析完成，共 {len(self.segments)} 个分片")
+        return len(self.segments) > 0
 
-                if not self.key_content:
-                    logger.error("无法获取解密密钥")
-                    return False
+    def fetch_key(self, uri):
+        """下载密钥（由 KeyCache 调用，同一个 URI 只会取一次）"""
+        logger.info(f"正在获取解密密钥: {uri}")
+        # 请求失败时抛出异常：密钥地址的令牌过期（403）也要能触发播放列表刷新
+        return self.get_content(uri, is_binary=True, quiet=False)
 
-                # 处理 IV
-                if iv_hex:
-                    self.key_iv = bytes.fromhex(iv_hex.replace("0x", ""))
-                # 如果没有IV，通常使用序列号（在下载时处理）
-            else:
-                logger.warning(f"不支持的加密方法: {method}，可能会导致合并失败")
-
-        # 3. 提取分片链接
-        lines = content.splitlines()
-        for i, line in enumerate(lines):
-            if line.startswith("#EXTINF"):
-                # 尝试获取下一行作为URL
-                for j in range(i + 1, min(i + 5, len(lines))):
-                    seg_line = lines[j].strip()
-                    if seg_line and not seg_line.startswith("#"):
-                        self.segments.append({
-                            "index": len(self.segments),
-                            "url": urljoin(self.url, seg_line)
-                        })
-                        break
+    # --- 令牌过期恢复 ---
 
-        logger.info(f"解析完成，共 {len(self.segments)} 个分片")
-        return len(self.segments) > 0
+    def refresh_candidates(self):
+        """刷新播放列表的候选地址：回调、重新导出的课程列表文件、原始 m3u8 地址（去重）"""
+        urls = []
+        if self.refresh_url:
+            try:
+                urls.append(self.refresh_url(self.title))
+            except Exception as e:
+                logger.warning(f"获取新的 m3u8 地址失败: {e}")
+        try:
+            with open(TOKEN_REFRESH_FILE or INPUT_FILE, 'r', encoding='utf-8') as f:
+                tasks = json.load(f)
+            urls += [task.get('m3u8') for task in tasks
+                     if clean_filename(task.get('title') or task.get('name')) == self.title]
+        except (OSError, ValueError, AttributeError):
+            pass
+        urls.append(self.source_url)
+        return list(dict.fromkeys(url for url in urls if url))
 
-    def decrypt_segment(self, content, sequence_number):
+    def refresh_playlist(self):
+        """令牌过期后重新获取播放列表，并按媒体序列号对齐到原来的分片下标（由 TokenRecovery 调用）"""
+        if not has_signature(self.current_segment(self.segments[0]).url):
+            # 分片地址不带签名参数时，鉴权失败多半不是令牌过期（例如 CDN 限流返回 403）
+            logger.warning(f"[{self.title}] 分片地址没有签名参数，不刷新播放列表")
+            return False
+        print(f"\n🔑 [{self.title}] 分片地址令牌已过期，暂停下载并刷新播放列表...")
+        tried = set()
+        hinted = False
+        deadline = time.monotonic() + TOKEN_REFRESH_WAIT
+        while True:
+            for url in self.refresh_candidates():
+                if url not in tried:
+                    tried.add(url)
+                    if self.apply_refresh(url):
+                        return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print(f"❌ [{self.title}] 未能获取新的播放列表地址")
+                return False
+            if not hinted:
+                # 之后每 5 秒检查一次回调和课程列表文件里有没有新地址
+                print(f"⏳ 请重新导出课程列表到 {TOKEN_REFRESH_FILE or INPUT_FILE}（最多等待 {int(remaining)} 秒）")
+                hinted = True
+            time.sleep(min(5, remaining))
+
+    def apply_refresh(self, url):
+        """从 url 获取新的播放列表并替换未完成分片的地址，地址没有变化时返回 False"""
+        playlist, media_url, _ = self.load_playlist(url, self.rendition)
+        if playlist is None or not len(playlist.segments):
+            return False
+        mapping = remap_segments(self.segments, playlist.segments)
+        if not mapping:
+            logger.warning(f"新的播放列表与原来的分片对不上，放弃: {url}")
+            return False
+        if all(self.current_segment(self.segments[i]).url == playlist.segments.uri(j)
+               for i, j in mapping.items()):
+            logger.info(f"播放列表中的分片地址没有变化: {url}")
+            return False
+        self.remap = (playlist.segments, mapping)
+        if len(mapping) < len(self.segments):
+            logger.warning(f"新的播放列表缺少 {len(self.segments) - len(mapping)} 个分片，这些分片仍使用旧地址")
+        print(f"🔑 [{self.title}] 播放列表已刷新，{len(mapping)} 个分片换用新地址，继续下载")
+        logger.info(f"[{self.title}] 令牌刷新: {media_url}")
+        return True
+
+    def current_segment(self, segment):
+        """分片的当前地址：刷新过播放列表时返回新分片表中对应的分片（下标不变）"""
+        remap = self.remap
+        if remap is None:
+            return segment
+        table, mapping = remap
+        j = mapping.get(segment.index)
+        if j is None:
+            return segment
+        fresh = table[j]
+        fresh.index = segment.index
+        return fresh
+
+    def pause_for_refresh(self):
+        """正在刷新播放列表时等待，返回当前的刷新代数"""
+        if self.recovery is None:
+            return 0
+        self.recovery.wait()
+        return self.recovery.generation
+
+    def token_expired(self, error, generation):
+        """鉴权失败是否来自过期的令牌且已刷新（此时应立即重试，不计入重试次数）"""
+        return self.recovery is not None and auth_status(error) is not None and \
+            self.recovery.auth_failure(generation)
+
+    def segment_cipher(self, segment):
+        """分片的 AES-128 解密器，未加密（或加密方法不支持）时返回 None"""
+        if self.key_manager is None:
+            return None
+        return self.key_manager.cipher(segment)
+
+    def decrypt_segment(self, content, segment):
         """解密分片数据"""
-        if not self.key_content:
+        cryptor = self.segment_cipher(segment)
+        if cryptor is None:
             return content
 
-        # 如果 M3U8 里没给 IV，标准是用序列号(big-endian binary)
-        iv = self.key_iv or sequence_number.to_bytes(16, byteorder='big')
-        cryptor = AES.new(self.key_content, AES.MODE_CBC, iv)
-        
         try:
             # M3U8 的 AES-128 通常是满块对齐的，但也可能有 padding
-            return cryptor.decrypt(content)
+            with self.metrics.timer("decrypt"):
+                plain = cryptor.decrypt(content)
+            return plain[:len(plain) - pkcs7_padding_len(plain)]
         except Exception as e:
-            logger.warning(f"解密分片 {sequence_number} 失败: {e}")
+            logger.warning(f"解密分片 {segment.index} 失败: {e}")
             return content  # 尝试返回原始内容
 
+    def save_segment(self, segment, content, race=None, tag=""):
+        """解密、校正并写入单个分片（线程引擎和 async 引擎共用），对冲落败时返回 False"""
+        content = self.decrypt_segment(content, segment)
+
+        # 简单校验：TS流通常以 0x47 开头
+        # 注意：如果是解密后的数据，也应该符合这个规则。
+        # 如果不校验，很容易合并进 404 HTML 导致 FFmpeg 崩溃
+        content = align_ts(content)
+        check = self.validator(segment)
+        if check:
+            check.feed(content)
+        if not self.check_segment(segment, check, race, tag):
+            return False
+        self.write_segment(segment, content)
+        return True
+
+    def write_segment(self, segment, content, cache=True):
+        """把解密、校验后的分片明文交给合并器、容器存储或分片文件，并存入分片缓存"""
+        idx = segment.index
+        with self.metrics.timer("write"):
+            if self.merger:
+                self.merger.put(idx, content)
+            elif self.store:
+                self.store.put(idx, content)
+            else:
+                # 写入新文件再改名，不原地截断：分片缓存可能硬链接了上一次写入的文件
+                save_path = self.temp_dir / f"{idx:05d}.ts"
+                part_path = save_path.with_name(f"{idx:05d}.part")
+                with open(part_path, 'wb') as f:
+                    f.write(content)
+                part_path.replace(save_path)
+                self.segment_saved(idx, len(content), zlib.crc32(content))
+        if cache and self.cache:
+            self.cache.put(self.cache_key(segment), content)
+
+    def cache_key(self, segment):
+        return segment_key(segment.url, segment.byterange)
+
+    def cached(self, segment):
+        """分片是否在缓存中（不读取数据）"""
+        return self.cache is not None and self.cache_key(segment) in self.cache
+
+    def load_cached(self, segment):
+        """从分片缓存取出分片并写入，未命中时返回 False"""
+        if self.cache is None:
+            return False
+        data = self.cache.get(self.cache_key(segment))
+        if data is None:
+            return False
+        self.write_segment(segment, data, cache=False)
+        with self.cache_lock:
+            self.cache_hits += 1
+            self.cache_hit_bytes += len(data)
+        return True
+
+    def _buffers(self):
+        """当前线程的 ([读缓冲 A, 读缓冲 B], 解密输出缓冲)，多留 32 字节存放跨块的密文尾部"""
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            buffers = self._local.buffers = ([bytearray(CHUNK_SIZE + 32), bytearray(CHUNK_SIZE + 32)],
+                                             bytearray(CHUNK_SIZE + 32))
+        return buffers
+
+    def _stream_into(self, segment, write, race=None, tag=""):
+        """
+        按 CHUNK_SIZE 读取分片并增量解密，把明文交给 write，返回写入的字节数
+        race 为对冲仲裁：响应登记到 race，对方胜出时被关闭，读取出错后按 HedgeAbandoned 结束
+        CBC 解密器会把上一块的最后一个密文块作为下一块的 IV；每次保留最后一个完整密文块，
+        直到读完才解密，以便去掉 PKCS#7 填充
+        有解密线程池时使用两个读缓冲交替：第 N 块在解密线程中解密，下载线程同时读取第 N+1 块
+        """
+        src_bufs, dst_buf = self._buffers()
+        views = [memoryview(buf) for buf in src_bufs]
+        dst = memoryview(dst_buf)
+        cipher = self.segment_cipher(segment)
+        pool = decrypt_pool(DECRYPT_WORKERS) if cipher else None
+        written = 0
+        first = True
+        timing = {"transfer": 0.0, "decrypt": 0.0, "write": 0.0}  # 逐块累计，结束时各记一次
+
+        def emit(out):
+            nonlocal first, written
+            if first and len(out):
+                # TS流通常以 0x47 开头，有时候数据头有点垃圾数据；packed audio 不是 TS，原样写出
+                first = False
+                if out[0] != 0x47 and not is_packed_audio(out):
+                    offset = bytes(out[:188]).find(b'\x47')
+                    if offset > 0:
+                        out = out[offset:]
+            if len(out):
+                start = time.perf_counter()
+                write(out)
+                timing["write"] += time.perf_counter() - start
+                written += len(out)
+
+        def finish(job):
+            """等待一块解密完成并写出（最后一块去掉填充）"""
+            future, ready, eof = job
+            if future is not None:
+                timing["decrypt"] += future.result()
+            out = dst[:ready]
+            if eof:
+                out = out[:ready - pkcs7_padding_len(out)]
+            emit(out)
+
+        if self.ranges and RANGE_SPLIT_SIZE and segment.byterange and segment.byterange[1] > RANGE_SPLIT_SIZE:
+            # 很大的字节范围：直接拆成多个 Range 请求并发下载
+            with self.metrics.timer("transfer"):
+                data = self.ranges.fetch(segment.url, *segment.byterange)
+            with self.metrics.timer("decrypt"):
+                data = self._decrypt_whole(data, cipher)
+            emit(data)
+            self.metrics.observe("write", timing["write"])
+            return written
+
+        cur = filled = 0
+        job = None  # 正在解密的块 (future, 长度, 是否最后一块)
+        try:
+            start = time.perf_counter()
+            with self.session.get(segment.url, timeout=DOWNLOAD_TIMEOUT, stream=True,
+                                  headers=segment.range_header) as resp:
+                self.metrics.observe("ttfb", time.perf_counter() - start)
+                if race:
+                    race.attach(tag, resp)
+                resp.raise_for_status()
+                resp.raw.decode_content = True
+                raw = resp.raw
+                if segment.byterange and resp.status_code == 200:
+                    # 服务器忽略了 Range，返回了整个资源：跳过范围之前的数据，只读范围内的部分
+                    raw = RangeReader(resp.raw, *segment.byterange)
+                elif self.ranges and self.ranges.splittable(resp, RANGE_SPLIT_SIZE):
+                    # 大分片：这个响应只读第一部分，其余部分改为并发 Range 请求，读入同一个缓冲区
+                    total = int(resp.headers["Content-Length"])
+                    start = time.perf_counter()
+                    data = self.ranges.fetch_rest(segment.url, raw, total)
+                    timing["transfer"] += time.perf_counter() - start
+                    start = time.perf_counter()
+                    data = self._decrypt_whole(data, cipher)
+                    timing["decrypt"] += time.perf_counter() - start
+                    emit(data)
+                    return written
+                while True:
+                    src = views[cur]
+                    start = time.perf_counter()
+                    n = raw.readinto(src[filled:])
+                    timing["transfer"] += time.perf_counter() - start
+                    eof = n == 0
+                    filled += n
+
+                    if not cipher:
+                        emit(src[:filled])
+                        filled = 0
+                    else:
+                        ready = filled - filled % 16 - (0 if eof else 16)
+                        if ready > 0:
+                            # 上一块解密完成后才能继续：CBC 按顺序解密，且共用输出缓冲
+                            if job:
+                                finish(job)
+                                job = None
+                            carry = filled - ready
+                            other = 1 - cur
+                            src_bufs[other][:carry] = src_bufs[cur][ready:filled]
+                            if pool:
+                                job = (pool.submit(timed_decrypt, cipher, src[:ready], dst[:ready]), ready, eof)
+                            else:
+                                timing["decrypt"] += timed_decrypt(cipher, src[:ready], dst[:ready])
+                                job = (None, ready, eof)
+                            cur, filled = other, carry
+                    if eof:
+                        break
+            if job:
+                finish(job)
+                job = None
+        except Exception:
+            if race and race.abandoned(tag):
+                raise HedgeAbandoned(segment.index) from None  # 对方胜出后关闭了这个响应
+            raise
+        finally:
+            if job and job[0] is not None:
+                job[0].exception()  # 出错时也要等解密线程用完缓冲区
+            for stage, seconds in timing.items():
+                if seconds:
+                    self.metrics.observe(stage, seconds)
+        return written
+
+    @staticmethod
+    def _decrypt_whole(data, cipher):
+        """原地解密整个分片并去掉 PKCS#7 填充，返回明文的 memoryview"""
+        view = memoryview(data)
+        if cipher is None:
+            return view
+        view = view[:len(view) - len(view) % 16]
+        cipher.decrypt(view, output=view)
+        return view[:len(view) - pkcs7_padding_len(view)]
+
+    def stream_segment(self, segment, race=None, tag=""):
+        """
+        流式下载单个分片，直接写入磁盘或合并管道，返回写入的字节数（0 表示失败）
+        race 为对冲仲裁：下载完成后抢到的一方才提交结果，tag 区分各自的临时文件
+        """
+        idx = segment.index
+        check = self.validator(segment)
+        if self.merger or self.store:
+            # 流式合并和容器存储都需要完整的分片数据（后者写入时才分配偏移）
+            data = bytearray()
+
+            def collect(chunk):
+                if race and race.abandoned(tag):
+                    raise HedgeAbandoned(idx)
+                data.extend(chunk)
+
+            if not self._stream_into(segment, collect, race, tag):
+                return 0
+            if check:
+                check.feed(data)
+            if not self.check_segment(segment, check, race, tag):
+                return 0
+            self.write_segment(segment, data)
+            return len(data)
+
+        save_path = self.temp_dir / f"{idx:05d}.ts"
+        part_path = save_path.with_name(f"{idx:05d}.{tag}.part" if tag else f"{idx:05d}.part")
+        crc = 0
+        try:
+            with open(part_path, 'wb') as f:
+                def write(chunk):
+                    nonlocal crc
+                    if race and race.abandoned(tag):
+                        raise HedgeAbandoned(idx)
+                    crc = zlib.crc32(chunk, crc)
+                    if check:
+                        check.feed(chunk)
+                    f.write(chunk)
+
+                written = self._stream_into(segment, write, race, tag)
+            claimed = written and self.check_segment(segment, check, race, tag)
+        except Exception:
+            part_path.unlink(missing_ok=True)
+            raise
+        if not claimed:
+            part_path.unlink(missing_ok=True)
+            return 0
+        # 写完再改名，中断时不会留下被当作已完成的半截分片
+        part_path.replace(save_path)
+        self.segment_saved(idx, written, crc)
+        if self.cache:
+            self.cache.put_file(self.cache_key(segment), save_path, written, crc)
+        return written
+
+    def validator(self, segment):
+        """分片的增量校验器，未启用校验时返回 None"""
+        if not VALIDATE_SEGMENTS:
+            return None
+        return TSValidator(encrypted=segment.key is not None)
+
+    def check_segment(self, segment, validator, race=None, tag=""):
+        """
+        结束校验（validator 为 None 时跳过），对冲时再抢占仲裁，返回是否由本次请求提交结果；
+        只有提交结果的一方记入完整性报告。不通过时抛出 SegmentInvalid（download_segment 会立即重新下载），
+        对冲中的失败不在这里记录：另一方可能胜出，两方都失败时由 download_segment 记录一次
+        """
+        result = validator.finish() if validator else None
+        if result and not result.ok:
+            if race is None:
+                self.integrity.record(segment.index, result)
+            raise SegmentInvalid(f"分片 {segment.index} 校验失败: {result.reason}", result)
+        if race and not race.claim(tag):
+            return False
+        if result:
+            self.integrity.record(segment.index, result)
+        return True
+
+    def segment_done(self, idx):
+        """分片是否已在之前的运行中完成（查续传日志，不逐个 stat 文件）"""
+        if self.merger or self.journal is None or not self.journal.done(idx):
+            return False
+        if (self.journal.entries[idx][2] is None) == (self.store is not None):
+            return False  # 上次运行使用的是另一种分片存储方式
+        if RESUME_VERIFY and not (self.store.verify(idx) if self.store else
+                                  self.journal.verify(idx, self.temp_dir / f"{idx:05d}.ts")):
+            logger.warning(f"分片 {idx} 校验失败，重新下载")
+            self.journal.forget(idx)
+            return False
+        return True
+
+    def segment_saved(self, idx, size, crc):
+        """分片写盘完成，记入续传日志"""
+        if self.journal is not None:
+            self.journal.record(idx, size, crc)
+
+    def segment_failed(self, idx):
+        """分片重试后仍失败，记入完整性报告；stream 模式下通知合并器跳过"""
+        self.integrity.mark_missing(idx)
+        if self.merger:
+            self.merger.skip(idx)
+        return False
+
+    def fetch_segment(self, segment, race=None, tag=""):
+        """单次下载尝试，返回写入的字节数（0 表示空响应或对冲落败）"""
+        if SEGMENT_STREAMING:
+            return self.stream_segment(segment, race, tag)
+        if self.ranges and RANGE_SPLIT_SIZE and segment.byterange and segment.byterange[1] > RANGE_SPLIT_SIZE:
+            content = self.ranges.fetch(segment.url, *segment.byterange)
+        else:
+            content = self.get_content(segment.url, is_binary=True, byterange=segment.byterange, quiet=False)
+        if not content or not self.save_segment(segment, content, race, tag):
+            return 0
+        return len(content)
+
     def download_segment(self, segment):
         """下载并尝试解密单个分片任务"""
-        idx, url = segment['index'], segment['url']
-        save_path = self.temp_dir / f"{idx:05d}.ts"
-        if save_path.exists() and save_path.stat().st_size > 0: return True
+        idx = segment.index
+        if self.segment_done(idx): return True
+        if self.load_cached(segment): return True
+
+        with self.metrics.segment(idx) as span:
+            attempt = 0
+            while attempt < 3:
+                if self.cancel.is_set():
+                    return False
+                span.attempts += 1
+                generation = self.pause_for_refresh()
+                segment = self.current_segment(segment)
+                if self.limiter:
+                    self.limiter.acquire()
+                start = time.perf_counter()
+                size, error = 0, None
+                try:
+                    if self.hedger:
+                        size = self.hedger.run(lambda race, tag: self.fetch_segment(segment, race, tag))
+                    else:
+                        size = self.fetch_segment(segment)
+                except Exception as e:
+                    error = e
+                finally:
+                    if self.limiter:
+                        self.limiter.release(time.perf_counter() - start, size, error)
+
+                if size:
+                    span.ok, span.nbytes = True, size
+                    return True
+                if error is not None and self.token_expired(error, generation):
+                    continue  # 播放列表已刷新，换用新地址立即重试
+                if self.hedger and isinstance(error, SegmentInvalid):
+                    self.integrity.record(idx, error.check)  # 对冲的各方都校验失败，只记一次
+                attempt += 1
+                if error is None:
+                    continue
+                if attempt == 3:
+                    logger.warning(f"分片 {idx} 下载失败: {error}")
+                time.sleep(retry_delay(error))
+        return self.segment_failed(idx)
 
-        for attempt in range(3):
+    def download_units(self):
+        """任务单元列表：EXT-X-BYTERANGE 中相邻的未完成分片合成一组（一个 Range 请求），其余每个分片一组"""
+        if not self.ranges or not RANGE_COALESCE_SIZE:
+            return [[segment] for segment in self.segments]
+        return coalesce_ranges(self.segments, RANGE_COALESCE_SIZE,
+                               skip=lambda segment: self.segment_done(segment.index) or self.cached(segment))
+
+    def download_unit(self, unit):
+        """下载一个任务单元，返回成功的分片数；合并请求失败时逐个分片重试"""
+        if len(unit) == 1:
+            return int(self.download_segment(unit[0]))
+
+        attempt = 0
+        while attempt < 3:
+            if self.cancel.is_set():
+                return 0
+            generation = self.pause_for_refresh()
+            unit = [self.current_segment(segment) for segment in unit]
+            if not contiguous(unit):
+                break  # 刷新后的地址不再首尾相接，逐个分片下载
+            start = unit[0].byterange[0]
+            length = unit[-1].byterange[0] + unit[-1].byterange[1] - start
+            if self.limiter:
+                self.limiter.acquire()
+            begin = time.perf_counter()
+            size, error = 0, None
             try:
-                content = self.get_content(url, is_binary=True)
-                if not content: continue
-                if self.key_content:
-                    content = self.decrypt_segment(content, idx)
-
-                # 简单校验：TS流通常以 0x47 开头
-                # 注意：如果是解密后的数据，也应该符合这个规则。
-                # 如果不校验，很容易合并进 404 HTML 导致 FFmpeg 崩溃
-                if content and content[0] != 0x47:
-                    # 尝试找一下同步字节，有时候数据头有点垃圾数据
-                    offset = content.find(b'\x47')
-                    if 0 < offset < 188: content = content[offset:]
-                with open(save_path, 'wb') as f:
-                    f.write(content)
-                return True
+                with self.metrics.timer("transfer"):
+                    data = self.ranges.fetch(unit[0].url, start, length)
+                for segment in unit:
+                    offset = segment.byterange[0] - start
+                    self.save_segment(segment, data[offset:offset + segment.byterange[1]])
+                size = len(data)
             except Exception as e:
-                if attempt == 2:
-                    logger.warning(f"分片 {idx} 下载失败: {e}")
-                time.sleep(1)
-        return False
+                error = e
+            finally:
+                if self.limiter:
+                    self.limiter.release(time.perf_counter() - begin, size, error)
+
+            if size:
+                # 一个请求下载的整组分片按字节数分摊耗时
+                elapsed = time.perf_counter() - begin
+                for segment in unit:
+                    self.metrics.record_segment(segment.index, elapsed * segment.byterange[1] / size,
+                                                segment.byterange[1], True, attempts=attempt + 1)
+                return len(unit)
+            if self.token_expired(error, generation):
+                continue
+            attempt += 1
+            if attempt == 3:
+                logger.warning(f"合并范围 {unit[0].index}-{unit[-1].index} 下载失败，逐个分片重试: {error}")
+            else:
+                time.sleep(retry_delay(error))
+        return sum(self.download_segment(segment) for segment in unit)
+
+    def begin_download(self, concurrency, hedging=None):
+        """下载前的准备：启用对冲，files 模式打开续传日志，stream 模式启动流式合并"""
+        if HEDGE_REQUESTS if hedging is None else hedging:
+            # 主请求和对冲请求都在独立线程中执行，下载线程只负责等待先完成的一方
+            self.hedger = HedgeController(HEDGE_PERCENTILE, HEDGE_BUDGET, HEDGE_MIN_DELAY,
+                                          workers=concurrency * 2)
+        if MERGE_MODE != "stream":
+            self.journal = ResumeJournal(self.temp_dir, self.identity, self.title, self.source_url, self.playlist_id)
+            if len(self.journal):
+                print(f"♻️ 续传: 已完成 {len(self.journal)}/{len(self.segments)} 个分片")
+            if SEGMENT_STORE == "container":
+                self.store = SegmentStore(self.temp_dir, self.journal, self.expected_size())
+            return
+
+        from stream_merge import StreamMerger
+        # 窗口必须大于同时在途的分片数，否则乱序到达的分片会互相等待
+        window = max(STREAM_WINDOW, concurrency + 1)
+        self.merger = StreamMerger(self.final_mp4, window=window, timeout=FFMPEG_TIMEOUT,
+                                   backend=MERGE_BACKEND, drop_video=self.suffix == ".m4a",
+                                   input_format=self.pipe_format()).start()
+
+    def pipe_format(self):
+        """ffmpeg 读取管道的格式：独立音频轨的 .aac 分片是 packed audio（ID3 + 裸 ADTS），其余为 TS"""
+        if self.suffix == ".m4a" and len(self.segments) and self.segments.uri(0).split("?")[0].lower().endswith(".aac"):
+            return "aac"
+        return "mpegts"
+
+    def expected_size(self):
+        """分片总字节数：字节范围播放列表按实际长度，否则按码率 × 时长估算（多留 10%），无法估算时返回 0"""
+        segments = self.segments
+        if len(segments) and min(segments.range_offsets) >= 0:
+            return sum(segments.range_lengths)
+        if self.bandwidth:
+            return int(self.bandwidth / 8 * segments.total_duration * 1.1)
+        return 0
+
+    def download_all(self):
+        """按 DOWNLOAD_ENGINE 下载全部分片，返回成功数量"""
+        start = time.perf_counter()
+        completed = self._download_all()
+        # deadline 策略按完成课程的实测吞吐估算后面的课程还能下载多少字节
+        self.policy.observe(self.metrics.bytes, time.perf_counter() - start)
+        return completed
+
+    def _download_all(self):
+        total = len(self.segments)
+        completed = 0
+
+        def report(done, ok):
+            self.progress = ok
+            # 简单的进度条
+            window = f" 并发 {self.limiter.limit}" if self.limiter else ""
+            sys.stdout.write(f"\r进度: {done / total * 100:.1f}% [{ok}/{total}]{window}")
+            sys.stdout.flush()
+
+        if DOWNLOAD_ENGINE == "async":
+            from async_engine import AsyncSegmentEngine, HAS_AIOHTTP
+            if HAS_AIOHTTP:
+                self.begin_download(ASYNC_MAX_INFLIGHT, hedging=False)  # async 引擎不支持对冲
+                print(f"📥 开始下载 {total} 个分片 (async, 在途上限: {ASYNC_MAX_INFLIGHT})...")
+                engine = AsyncSegmentEngine(self, max_inflight=ASYNC_MAX_INFLIGHT, timeout=DOWNLOAD_TIMEOUT,
+                                            retry_delay=retry_delay, split_size=RANGE_SPLIT_SIZE)
+                completed = engine.run(self.segments, progress=report)
+                print("")  # 换行
+                return completed
+            logger.warning("未安装 aiohttp，回退到线程池下载")
+
+        self.begin_download(self.workers)
+        if self.limiter:
+            print(f"📥 开始下载 {total} 个分片 (自适应并发: {self.limiter.limit}, "
+                  f"范围 {ADAPTIVE_MIN_THREADS}-{ADAPTIVE_MAX_THREADS})...")
+        else:
+            print(f"📥 开始下载 {total} 个分片 (线程: {MAX_THREADS})...")
+
+        units = self.download_units()
+        if len(units) < total:
+            print(f"🧩 相邻字节范围合并: {total} 个分片 -> {len(units)} 个请求")
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.download_unit, unit): len(unit) for unit in units}
+
+            done = 0
+            for future in as_completed(futures):
+                completed += future.result()
+                done += futures[future]
+                report(done, completed)
+
+        print("")  # 换行
+        return completed
 
     def merge_segments(self, output_file):
         """使用 FFmpeg Concat 协议合并"""
+        if self.store:
+            return self.merge_store(output_file)
         ts_files = sorted(list(self.temp_dir.glob("*.ts")))
         if not ts_files: return False
 
+        if MERGE_BACKEND == "python":
+            from ts_remux import remux_files
+            logger.info(f"开始转封装 {len(ts_files)} 个分片 -> {output_file.name}")
+            return remux_files(ts_files, output_file, chunk_size=CHUNK_SIZE, drop_video=self.suffix == ".m4a")
+
         # 生成 concat 列表文件 (使用绝对路径，且统一用正斜杠防止转义问题)
         list_path = self.temp_dir / "filelist.txt"
         with open(list_path, "w", encoding="utf-8") as f:
@@ -253,6 +1011,8 @@ class M3U8Downloader:
             "-bsf:a", "aac_adtstoasc",  # 修复音频流格式，防止 MP4 没声音
             str(output_file.absolute())
         ]
+        if self.suffix == ".m4a":
+            cmd.insert(-1, "-vn")  # 没有独立音频轨、退回最低码率时去掉视频
 
         try:
             # Windows 下隐藏控制台窗口
@@ -274,55 +1034,330 @@ class M3U8Downloader:
             logger.error(f"合并过程异常: {e}")
             return False
 
-    def run(self):
-        """执行下载流程"""
-        print(f"\n🎬 开始任务: {self.title}")
+    def merge_store(self, output_file):
+        """按序号从容器文件（mmap）读出分片，写入 ffmpeg 管道或纯 Python 转封装，不扫描目录"""
+        from stream_merge import StreamMerger
+        logger.info(f"开始合并 {len(self.journal)} 个分片 -> {output_file.name}")
+        try:
+            merger = StreamMerger(output_file, timeout=FFMPEG_TIMEOUT, backend=MERGE_BACKEND,
+                                  drop_video=self.suffix == ".m4a", input_format=self.pipe_format()).start()
+        except Exception as e:
+            logger.error(f"合并过程异常: {e}")
+            return False
+        for idx, data in self.store.iter_segments(len(self.segments)):
+            if data is None:
+                merger.skip(idx)
+            else:
+                merger.put(idx, data)
+        if merger.close():
+            return True
+        merger.abort()
+        return False
+
+    def finalize(self, completed, cleanup=True):
+        """合并分片，成功且 cleanup 时清理临时文件（流水线模式由校验清理阶段负责）"""
+        total = len(self.segments)
+        if self.journal is not None:
+            self.journal.close()
+        if self.hedger:
+            self.hedger.close()
+            stats = self.hedger.stats()
+            print(f"\n🪁 对冲请求: 触发 {stats['hedges']} 次，胜出 {stats['hedge_wins']} 次，"
+                  f"节省尾延迟 {stats['saved_seconds']}s，p99 {stats['p99_primary']}s -> {stats['p99_effective']}s")
+            logger.info(f"[{self.title}] 对冲统计: {stats}")
+        if self.cache_hits:
+            print(f"\n💾 分片缓存: 命中 {self.cache_hits}/{total} 个分片，省去 {self.cache_hit_bytes / 1024 / 1024:.1f} MB 下载")
+            logger.info(f"[{self.title}] 分片缓存命中 {self.cache_hits} 个，{self.cache_hit_bytes} 字节")
+        if self.recovery and self.recovery.refreshes:
+            stats = self.recovery.stats()
+            print(f"\n🔑 令牌过期恢复: 刷新播放列表 {stats['refreshes']} 次（失败 {stats['failed_refreshes']} 次），"
+                  f"暂停 {stats['paused_seconds']}s")
+            logger.info(f"[{self.title}] 令牌过期恢复: {stats}")
+        saved = self.rendition_saving()
+        if saved is not None:
+            print(f"\n🎚️ 码率选择 [{self.rendition.policy}]: {self.rendition.label}，"
+                  f"下载 {(self.metrics.bytes + self.cache_hit_bytes) / 1024 / 1024:.1f} MB，"
+                  f"比最高码率节省约 {saved / 1024 / 1024:.1f} MB")
+            logger.info(f"[{self.title}] 码率选择 {self.rendition}: 节省约 {saved} 字节")
+        if self.cancel.is_set():
+            print(f"\n⛔ 已取消，不合并: {self.title}")
+            if self.merger:
+                self.merger.abort()
+            if self.store:
+                self.store.close()
+            self.unlock()
+            metrics.finish(self.metrics)
+            return False
+        if VALIDATE_SEGMENTS:
+            # 缺失的分片逐个列出，不会被 95% 的完成率阈值掩盖
+            print(f"\n🧪 完整性: {self.integrity.format()}")
+            logger.info(f"[{self.title}] 完整性报告: {self.integrity.summary()}")
+        print(f"\n🔄 正在合并: {self.title}")
+        with self.metrics.timer("merge"):
+            if completed < total * 0.95:
+                merged = False
+            elif self.merger:
+                merged = self.merger.close()
+            else:
+                merged = self.merge_segments(self.final_mp4)
+        if self.merger and not merged:
+            self.merger.abort()
+        if self.store:
+            self.store.close()
+        self.report_metrics(completed, merged)
+        metrics.finish(self.metrics)
+
+        if merged:
+            print(f"✅ 下载完成: {self.final_mp4}")
+            if cleanup:
+                self.register_output()
+                self.cleanup()
+            return True
+        else:
+            print("❌ 合并失败，保留临时文件以便检查")
+            self.unlock()
+            return False
+
+    def rendition_saving(self):
+        """与按最高码率下载相比节省的字节数（估算），选的就是最高码率时返回 None"""
+        choice = self.rendition
+        if choice is None or choice.bandwidth == choice.best_bandwidth:
+            return None
+        actual = self.metrics.bytes + self.cache_hit_bytes
+        return max(0, choice.best_bytes(self.segments.total_duration) - actual)
+
+    def verify_output(self):
+        """检查合并结果：文件非空且以 MP4 的 ftyp 盒开头"""
+        try:
+            with open(self.final_mp4, 'rb') as f:
+                return f.read(8)[4:] == b'ftyp'
+        except OSError:
+            return False
+
+    def cleanup(self):
+        """成功后清理临时文件"""
+        self.unlock()  # Windows 下锁文件要先关闭才能删除
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def unlock(self):
+        """释放临时目录锁和输出文件名占用（可重复调用）"""
+        if self.dir_lock is not None:
+            self.dir_lock.close()
+            self.dir_lock = None
+        if self.output_lock is not None:
+            self.output_lock.close()
+            self.output_lock = None
+
+    def reserve_output(self, path):
+        """
+        占用输出文件名：对输出目录下 .reserved/<文件名>.lock 加独占锁，已被其他任务占用时返回 False
+        锁文件不删除（删除后另一个任务可能锁住已经脱离目录的旧文件），进程崩溃时锁随之释放
+        """
+        reserved = self.output_dir / RESERVED_DIR
+        reserved.mkdir(exist_ok=True)
+        lock = lock_file(reserved / f"{path.name}.lock")
+        if lock is None:
+            return False
+        if self.output_lock is not None:
+            self.output_lock.close()
+        self.output_lock = lock
+        return True
+
+    def report_metrics(self, completed, merged):
+        """输出本节课的分阶段耗时表，并写入一条课程事件"""
+        summary = self.metrics.summary()
+        metrics.registry.event("lesson", lesson=self.title, segments=len(self.segments), completed=completed,
+                               merged=bool(merged), bytes=self.metrics.bytes,
+                               rendition=self.rendition.policy if self.rendition else None,
+                               bytes_saved=self.rendition_saving(),
+                               stages={stage: {k: round(v, 6) for k, v in row.items()}
+                                       for stage, row in summary.items()})
+        if METRICS_SUMMARY and summary:
+            print(f"\n📊 分阶段耗时:\n{self.metrics.format_table()}")
+            logger.info(f"[{self.title}] 分阶段耗时: {summary}")
+
+    def completed_entry(self):
+        """已完成课程索引中本节课的记录，没有时返回 None"""
+        return self.index.get(self.playlist_id) if self.index else None
+
+    def prepare(self):
+        """创建目录并解析播放列表，返回 "skip"（已下载）/ True / False"""
+        status = self._prepare()
+        if status is not True:
+            metrics.finish(self.metrics)  # 不会开始下载，统计随之归档
+        return status
 
-        # 1. 创建目录
+    def _prepare(self):
+        entry = self.completed_entry()
+        if entry:
+            self.final_mp4 = self.index.resolve(entry)  # 课程改名时指向已有的视频
+            return "skip"
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        # 先占用文件名再检查是否存在：流水线模式下同名的两节课可能同时准备，检查和改名之间不能被对方插入
+        reserved = self.reserve_output(self.final_mp4)
+        if reserved and self.final_mp4.exists():
+            if self.index is None:
+                self.unlock()
+                return "skip"
+            if self.index.owner(self.final_mp4) is None:
+                # 索引建立之前下载的视频，认领后跳过（校验和留给 lesson_index.py verify 补全）
+                self.index.record(self.playlist_id, self.source_url, self.title, self.final_mp4)
+                self.unlock()
+                return "skip"
+        if not reserved or self.final_mp4.exists():
+            # 同名的另一节课已下载或正在下载
+            self.final_mp4 = self.output_dir / f"{self.title}_{self.playlist_id[:8]}{self.suffix}"
+            logger.info(f"[{self.title}] 与同名课程不是同一节课，保存为 {self.final_mp4.name}")
+            if not self.reserve_output(self.final_mp4):
+                print(f"⚠️ 输出文件名正被其他任务使用: {self.final_mp4.name}")
+                logger.warning(f"[{self.title}] 输出文件名正被其他任务使用，跳过本次下载")
+                return False
         self.temp_dir.mkdir(parents=True, exist_ok=True)
+        self.dir_lock = lock_dir(self.temp_dir)
+        if self.dir_lock is None:
+            print(f"⚠️ 临时目录正被其他任务使用: {self.temp_dir.name}")
+            logger.warning(f"[{self.title}] 临时目录正被其他任务使用，跳过本次下载")
+            self.unlock()
+            return False
+        if not self.parse_m3u8():
+            self.unlock()
+            return False
+        return True
+
+    def register_output(self):
+        """合并成功后记入已完成课程索引"""
+        if self.index is not None:
+            self.index.record(self.playlist_id, self.source_url, self.title, self.final_mp4,
+                              duration=self.segments.total_duration, checksum=file_checksum(self.final_mp4))
 
-        final_mp4 = self.output_dir / f"{self.title}.mp4"
-        if final_mp4.exists():
+    def run(self):
+        """执行下载流程"""
+        print(f"\n🎬 开始任务: {self.title}")
+
+        # 1. 创建目录并解析
+        status = self.prepare()
+        if status == "skip":
             print(f"✅ 文件已存在，跳过")
             return True
-
-        # 2. 解析
-        if not self.parse_m3u8():
+        if not status:
             print("❌ 解析M3U8失败")
             return False
 
         # 3. 下载
-        total = len(self.segments)
-        completed = 0
-        print(f"📥 开始下载 {total} 个分片 (线程: {MAX_THREADS})...")
+        completed = self.download_all()
 
-        with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-            futures = [executor.submit(self.download_segment, seg) for seg in self.segments]
+        # 4. 合并
+        return self.finalize(completed)
 
-            for i, future in enumerate(as_completed(futures)):
-                if future.result():
-                    completed += 1
 
-                # 简单的进度条
-                sys.stdout.write(f"\r进度: {(i + 1) / total * 100:.1f}% [{completed}/{total}]")
-                sys.stdout.flush()
+def report_connections():
+    """输出连接复用统计"""
+    line = http_pool.format_stats()
+    if line:
+        print(f"🔌 {line}")
+        logger.info(line)
+    stats = range_stats()
+    if stats and (stats["split"] or stats["fallbacks"]):
+        print(f"🧩 Range 请求 {stats['requests']} 次，拆分下载 {stats['split']} 个资源，"
+              f"回退完整下载 {stats['fallbacks']} 次")
 
-        print("")  # 换行
 
-        # 4. 合并
-        print("\n🔄 正在合并...")
-        if completed >= total * 0.95 and self.merge_segments(final_mp4):
-            print(f"✅ 下载完成: {final_mp4}")
-            # 成功后清理临时文件
-            shutil.rmtree(self.temp_dir, ignore_errors=True)
-            return True
+def rendition_policy(lessons=None):
+    """
+    按 RENDITION_* 配置创建码率策略；budget / deadline 需要课程数来分摊额度，
+    lessons 为 None（queue / daemon 模式课程数未知）时退回最高码率
+    """
+    allowance = None
+    if RENDITION_POLICY in ("budget", "deadline"):
+        budget = COURSE_DISK_BUDGET if RENDITION_POLICY == "budget" else None
+        deadline = COURSE_DEADLINE if RENDITION_POLICY == "deadline" else None
+        if lessons and (budget or deadline):
+            allowance = CourseAllowance(lessons, budget=budget, deadline=deadline, meter=ThroughputMeter())
         else:
-            print("❌ 合并失败，保留临时文件以便检查")
-            return False
+            logger.warning(f"码率策略 {RENDITION_POLICY} 需要课程列表和额度（COURSE_DISK_BUDGET / COURSE_DEADLINE），"
+                           f"选择最高码率")
+    return RenditionPolicy(RENDITION_POLICY, height=RENDITION_HEIGHT, max_bitrate=RENDITION_MAX_BITRATE,
+                           allowance=allowance)
+
+
+def check_ffmpeg():
+    """检查 FFmpeg（python 合并后端不需要）"""
+    if MERGE_BACKEND == "python":
+        return True
+    try:
+        subprocess.run(['ffmpeg', '-version'], capture_output=True)
+    except FileNotFoundError:
+        print("❌ 错误: 未找到 ffmpeg，请先安装 ffmpeg 并添加到环境变量 PATH 中。")
+        return False
+    return True
+
+
+def run_queue_worker(worker=None, wait=True):
+    """queue 模式的 worker：从 JOB_QUEUE_DB 领取课程下载，直到队列中没有未完成的课程"""
+    from job_queue import JobQueue, work
+    if not check_ffmpeg():
+        return None
+    queue = JobQueue(JOB_QUEUE_DB, lease=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS)
+    policy = rendition_policy()
+
+    def make_downloader(job):
+        # 令牌过期时优先使用数据库中重新导入的地址
+        return M3U8Downloader(job.url, job.title, OUTPUT_DIR, refresh_url=lambda title: queue.url(job.id),
+                              policy=policy)
+
+    results = work(queue, make_downloader, worker=worker, wait=wait)
+    report_connections()
+    return results
+
+
+def run_daemon(tasks=None):
+    """daemon 模式：常驻运行，通过 http://DAEMON_HOST:DAEMON_PORT/lessons 接收课程，Ctrl+C 停止"""
+    from daemon import LessonDaemon
+    if not check_ffmpeg():
+        return
+    if OUTPUT_DIR.exists():
+        freed = reclaim_orphans(OUTPUT_DIR, ORPHAN_TTL_DAYS,
+                                   shared_index(OUTPUT_DIR) if COMPLETED_INDEX else None)
+        if freed:
+            print(f"🧹 已清理孤立临时目录，释放 {freed / 1024 / 1024:.1f} MB")
+    if METRICS_EVENTS_FILE:
+        metrics.registry.open_events(METRICS_EVENTS_FILE)
+
+    policy = rendition_policy()
+
+    def make_downloader(url, title, refresh_url):
+        return M3U8Downloader(url, title, OUTPUT_DIR, refresh_url=refresh_url, policy=policy)
+
+    daemon = LessonDaemon(make_downloader, host=DAEMON_HOST, port=DAEMON_PORT,
+                          parse_workers=PIPELINE_PARSE_WORKERS, download_workers=PIPELINE_DOWNLOAD_WORKERS,
+                          merge_workers=PIPELINE_MERGE_WORKERS, cleanup_workers=PIPELINE_CLEANUP_WORKERS,
+                          queue_size=PIPELINE_QUEUE_SIZE)
+    port = daemon.start()
+    print(f"🛰️ 常驻服务已启动: POST http://{DAEMON_HOST}:{port}/lessons，状态 http://{DAEMON_HOST}:{port}/status")
+    if tasks:
+        daemon.submit(tasks)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("\n⏹️ 停止接收新课程，等待已受理的课程完成（再次 Ctrl+C 强制退出）...")
+        try:
+            daemon.stop()
+        except KeyboardInterrupt:
+            pass
+    report_connections()
+    metrics.registry.close()
 
 
 def main():
+    if RUN_MODE == "daemon":
+        # 常驻模式下课程列表文件可选，启动时一并提交
+        tasks = None
+        if Path(INPUT_FILE).exists():
+            with open(INPUT_FILE, 'r', encoding='utf-8') as f:
+                tasks = json.load(f)
+        run_daemon(tasks)
+        return
     if not Path(INPUT_FILE).exists():
         # 创建示例文件
         with open(INPUT_FILE, 'w', encoding='utf-8') as f:
@@ -330,26 +1365,61 @@ def main():
         print(f"请在 {INPUT_FILE} 中填入视频信息")
         return
 
-    # 检查 FFmpeg
-    try:
-        subprocess.run(['ffmpeg', '-version'], capture_output=True)
-    except FileNotFoundError:
-        print("❌ 错误: 未找到 ffmpeg，请先安装 ffmpeg 并添加到环境变量 PATH 中。")
+    if not check_ffmpeg():
         return
 
     with open(INPUT_FILE, 'r', encoding='utf-8') as f:
         tasks = json.load(f)
 
+    # 清理之前运行遗留的孤立临时目录
+    if OUTPUT_DIR.exists():
+        freed = reclaim_orphans(OUTPUT_DIR, ORPHAN_TTL_DAYS,
+                                   shared_index(OUTPUT_DIR) if COMPLETED_INDEX else None)
+        if freed:
+            print(f"🧹 已清理孤立临时目录，释放 {freed / 1024 / 1024:.1f} MB")
+
     print(f"🚀 加载了 {len(tasks)} 个任务")
 
+    if METRICS_EVENTS_FILE:
+        metrics.registry.open_events(METRICS_EVENTS_FILE)
+    if METRICS_PORT:
+        port = metrics.registry.serve(METRICS_PORT)
+        print(f"📈 指标端点: http://127.0.0.1:{port}/metrics")
+
+    if RUN_MODE == "queue":
+        from job_queue import JobQueue
+        added, updated = JobQueue(JOB_QUEUE_DB).enqueue(tasks)
+        print(f"📥 任务队列 {JOB_QUEUE_DB}: 新增 {added} 节课，更新地址 {updated} 节课")
+        run_queue_worker()
+        metrics.registry.close()
+        return
+
+    # 所有课程共享一个码率策略，budget / deadline 按课程时长分摊整门课的额度
+    policy = rendition_policy(len(tasks))
+    downloaders = []
     for task in tasks:
         # 修正：优先取 title 字段
         raw_title = task.get('title') or task.get('name') or "untitled_video"
         m3u8_url = task.get('m3u8')
 
         if m3u8_url:
-            downloader = M3U8Downloader(m3u8_url, raw_title, OUTPUT_DIR)
+            downloaders.append(M3U8Downloader(m3u8_url, raw_title, OUTPUT_DIR, policy=policy))
+
+    if RUN_MODE == "pipeline":
+        from pipeline import LessonPipeline
+        LessonPipeline(downloaders, parse_workers=PIPELINE_PARSE_WORKERS,
+                       download_workers=PIPELINE_DOWNLOAD_WORKERS, merge_workers=PIPELINE_MERGE_WORKERS,
+                       cleanup_workers=PIPELINE_CLEANUP_WORKERS, queue_size=PIPELINE_QUEUE_SIZE).run()
+    elif RUN_MODE == "scheduler":
+        from scheduler import CourseScheduler
+        workers = ADAPTIVE_MAX_THREADS if ADAPTIVE_CONCURRENCY else MAX_THREADS
+        CourseScheduler(downloaders, max_workers=workers,
+                        max_active_lessons=MAX_ACTIVE_LESSONS).run()
+    else:
+        for downloader in downloaders:
             downloader.run()
+    report_connections()
+    metrics.registry.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分阶段耗时统计
+
+下载慢的时候需要知道时间花在哪里：DNS、建连、首字节（TTFB）、传输、AES 解密、写盘还是合并。
+- 每节课每个阶段一个固定桶的直方图（对数间隔，记录一次只是一次二分查找和几次加法，可以常开）
+- 分片粒度的事件写成 JSON Lines（可选），便于事后分析单个慢分片
+- 可选的 Prometheus 文本格式端点 /metrics
+- 每节课结束时输出各阶段的 p50 / p90 / p99 和累计耗时
+建连和 DNS 由 http_pool 在发生时记录，不区分课程（连接在课程之间复用）。
+每个下载器有自己的一份统计，课程结束后从登记表中移除并归入 (finished) 汇总，常驻运行时登记表不会随课程数增长，
+重新提交的同名课程也不会累加到旧记录上。
+"""
+
+import bisect
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# 0.25ms ~ 约 3 分钟，相邻桶相差 √2 倍
+BUCKETS = tuple(0.00025 * 2 ** (i / 2) for i in range(40))
+STAGES = ("dns", "connect", "ttfb", "transfer", "decrypt", "write", "segment", "merge")
+NETWORK = "(network)"  # 不属于某节课的阶段（DNS、建连）
+FINISHED = "(finished)"  # 已结束课程的汇总
+
+_local = threading.local()  # 当前线程正在下载的分片的各阶段耗时
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # 最后一个桶是 +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """按桶线性插值的近似分位数"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = BUCKETS[i - 1] if i else 0.0
+                high = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return low + (high - low) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+
+class LessonMetrics:
+    """一节课的各阶段直方图和字节数"""
+
+    def __init__(self, registry, lesson, key=None):
+        self.registry = registry
+        self.lesson = lesson
+        self.key = key or lesson  # 登记表中的键
+        self.histograms = {}
+        self.bytes = 0
+        self.segments = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+        current = getattr(_local, "stages", None)
+        if current is not None:
+            current[stage] = current.get(stage, 0.0) + seconds
+
+    def timer(self, stage):
+        return _Timer(self, stage)
+
+    def segment(self, idx):
+        """包住一次分片下载：期间当前线程记录的各阶段耗时汇总为一条事件"""
+        return _SegmentSpan(self, idx)
+
+    def record_segment(self, idx, seconds, nbytes, ok, stages=None, attempts=1):
+        """记录一个分片的结果（线程池引擎由 segment() 调用，async 引擎直接调用）"""
+        self.observe("segment", seconds)
+        with self.lock:
+            self.segments += 1
+            self.failed += not ok
+            self.bytes += nbytes
+        self.registry.event("segment", lesson=self.lesson, index=idx, ok=ok, bytes=nbytes,
+                            attempts=attempts, seconds=round(seconds, 6),
+                            **{k: round(v, 6) for k, v in (stages or {}).items()})
+
+    def summary(self):
+        """各阶段的 {次数, p50, p90, p99, 累计秒数}"""
+        with self.lock:
+            histograms = dict(self.histograms)
+        result = {}
+        for stage in STAGES:
+            h = histograms.get(stage) or self.registry.network.histograms.get(stage)
+            if h and h.count:
+                result[stage] = {"count": h.count, "p50": h.quantile(0.5), "p90": h.quantile(0.9),
+                                 "p99": h.quantile(0.99), "total": h.sum}
+        return result
+
+    def format_table(self):
+        """每节课结束时打印的汇总表"""
+        rows = self.summary()
+        if not rows:
+            return ""
+        lines = [f"{'阶段':<10}{'次数':>8}{'p50(ms)':>10}{'p90(ms)':>10}{'p99(ms)':>10}{'累计(s)':>10}"]
+        for stage, r in rows.items():
+            name = stage + ("*" if stage in ("dns", "connect") else "")
+            lines.append(f"{name:<10}{r['count']:>8}{r['p50'] * 1000:>10.1f}{r['p90'] * 1000:>10.1f}"
+                         f"{r['p99'] * 1000:>10.1f}{r['total']:>10.2f}")
+        lines.append(f"分片 {self.segments} 个（失败 {self.failed}），{self.bytes / 1024 / 1024:.1f} MB；"
+                     f"* 为进程内所有课程共享的连接统计")
+        return "\n".join(lines)
+
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+
+
+class _SegmentSpan:
+    def __init__(self, metrics, idx):
+        self.metrics = metrics
+        self.idx = idx
+        self.nbytes = 0
+        self.ok = False
+        self.attempts = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.outer = getattr(_local, "stages", None)
+        _local.stages = {}
+        return self
+
+    def __exit__(self, *exc):
+        stages = _local.stages
+        _local.stages = self.outer
+        self.metrics.record_segment(self.idx, time.perf_counter() - self.start, self.nbytes,
+                                    self.ok and exc[0] is None, stages, self.attempts)
+
+
+class Registry:
+    def __init__(self):
+        self.lessons = {}
+        self.network = LessonMetrics(self, NETWORK)
+        self.finished = LessonMetrics(self, FINISHED)
+        self.lock = threading.Lock()
+        self.events = None  # JSON Lines 文件
+        self.server = None
+
+    def lesson(self, name, key=None):
+        """
+        新建一节课的统计并登记；key（默认为 name）相同的旧记录（同一节课重新提交、上次没有正常结束）先归档，
+        不会把两次运行的字节数累加在一起
+        """
+        metrics = LessonMetrics(self, name, key)
+        with self.lock:
+            old = self.lessons.get(metrics.key)
+            self.lessons[metrics.key] = metrics
+        if old is not None:
+            self._archive(old)
+        return metrics
+
+    def finish(self, metrics):
+        """课程结束：从登记表中移除，直方图和计数归入 (finished) 汇总（可重复调用）"""
+        with self.lock:
+            if self.lessons.get(metrics.key) is not metrics:
+                return
+            del self.lessons[metrics.key]
+        self._archive(metrics)
+
+    def _archive(self, metrics):
+        with metrics.lock:
+            histograms = dict(metrics.histograms)
+            nbytes, segments, failed = metrics.bytes, metrics.segments, metrics.failed
+        total = self.finished
+        with total.lock:
+            for stage, histogram in histograms.items():
+                total.histograms.setdefault(stage, Histogram()).merge(histogram)
+            total.bytes += nbytes
+            total.segments += segments
+            total.failed += failed
+
+    def open_events(self, path):
+        """开始把事件写入 JSON Lines 文件（追加）"""
+        self.events = open(path, "a", encoding="utf-8")
+
+    def event(self, kind, **fields):
+        if self.events is None:
+            return
+        line = json.dumps({"ts": round(time.time(), 3), "event": kind, **fields}, ensure_ascii=False)
+        with self.lock:
+            self.events.write(line + "\n")
+
+    def close(self):
+        if self.events is not None:
+            with self.lock:
+                self.events.close()
+                self.events = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def prometheus(self):
+        """Prometheus 文本格式"""
+        out = ["# HELP xet_stage_seconds 各阶段耗时", "# TYPE xet_stage_seconds histogram"]
+        with self.lock:
+            lessons = [self.network] + list(self.lessons.values()) + [self.finished]
+        for metrics in lessons:
+            label = metrics.lesson.replace("\\", "\\\\").replace('"', '\\"')
+            with metrics.lock:
+                histograms = {stage: (list(h.counts), h.count, h.sum) for stage, h in metrics.histograms.items()}
+            for stage, (counts, count, total) in histograms.items():
+                labels = f'lesson="{label}",stage="{stage}"'
+                cumulative = 0
+                for bound, n in zip(BUCKETS, counts):
+                    cumulative += n
+                    out.append(f'xet_stage_seconds_bucket{{{labels},le="{bound:.6g}"}} {cumulative}')
+                out.append(f'xet_stage_seconds_bucket{{{labels},le="+Inf"}} {count}')
+                out.append(f"xet_stage_seconds_sum{{{labels}}} {total:.6f}")
+                out.append(f"xet_stage_seconds_count{{{labels}}} {count}")
+        out += ["# HELP xet_downloaded_bytes 已下载字节数", "# TYPE xet_downloaded_bytes counter"]
+        out += [f'xet_downloaded_bytes{{lesson="{m.lesson}"}} {m.bytes}' for m in lessons[1:]]
+        out += ["# HELP xet_segments 已结束的分片数", "# TYPE xet_segments counter"]
+        for m in lessons[1:]:
+            out.append(f'xet_segments{{lesson="{m.lesson}",result="ok"}} {m.segments - m.failed}')
+            out.append(f'xet_segments{{lesson="{m.lesson}",result="failed"}} {m.failed}')
+        return "\n".join(out) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """在后台线程提供 http://host:port/metrics"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logger.info(f"指标端点: http://{host}:{self.server.server_address[1]}/metrics")
+        return self.server.server_address[1]
+
+
+registry = Registry()
+
+
+def lesson(name, key=None):
+    return registry.lesson(name, key)
+
+
+def finish(lesson_metrics):
+    registry.finish(lesson_metrics)
+
+
+def observe_network(stage, seconds):
+    """DNS、建连等不属于某节课的阶段"""
+    registry.network.observe(stage, seconds)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+课程级流水线
+
+逐课运行时解析、下载、合并、删除临时目录依次执行，合并（最长 FFMPEG_TIMEOUT 秒）和清理期间网络完全空闲。
+这里把一节课拆成四个阶段，阶段之间用有界队列连接，每个阶段有自己的线程数：
+  解析（预取播放列表）-> 下载分片 -> 合并 / 转封装 -> 校验输出并清理临时目录
+第 N 节课合并时第 N+1 节课已经在下载；队列满时上游阶段阻塞（背压），不会提前解析过多课程。
+结束时输出各阶段的占用率（忙碌时间 / (线程数 × 总耗时)）、下游队列满导致的阻塞时间和队列深度。
+
+与 scheduler.py 的区别：调度器把多节课的分片混在一个线程池里；流水线中每节课仍由 download_all 独立下载，
+只是让不同课程的不同阶段重叠。
+"""
+
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()  # 阶段结束标记
+
+
+class StageQueue:
+    """有界队列，记录峰值深度和按时间加权的平均深度"""
+
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.lock = threading.Lock()
+        self.depth = 0
+        self.peak = 0
+        self.area = 0.0  # 深度对时间的积分
+        self.start = self.last = time.monotonic()
+
+    def _change(self, delta):
+        with self.lock:
+            now = time.monotonic()
+            self.area += self.depth * (now - self.last)
+            self.last = now
+            self.depth += delta
+            self.peak = max(self.peak, self.depth)
+
+    def put(self, item):
+        self.queue.put(item)
+        if item is not _STOP:
+            self._change(1)
+
+    def get(self):
+        item = self.queue.get()
+        if item is not _STOP:
+            self._change(-1)
+        return item
+
+    def average(self):
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.start
+            return (self.area + self.depth * (now - self.last)) / elapsed if elapsed > 0 else 0.0
+
+
+class Stage:
+    def __init__(self, name, func, workers, queue_size):
+        """
+        func(item) -> 交给下一阶段的结果；返回 None 表示该课程到此结束（跳过或失败）
+        queue_size: 本阶段输入队列的容量
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.inbox = StageQueue(queue_size)
+        self.next = None
+        self.lock = threading.Lock()
+        self.busy = 0.0  # 所有线程执行 func 的累计秒数
+        self.blocked = 0.0  # 下一阶段队列满时等待的累计秒数
+        self.items = 0
+        self.errors = 0
+        self.running = self.workers
+
+    def work(self):
+        while True:
+            item = self.inbox.get()
+            if item is _STOP:
+                break
+            start = time.monotonic()
+            try:
+                result = self.func(item)
+            except Exception as e:
+                logger.exception(f"流水线阶段 [{self.name}] 异常: {e}")
+                result = None
+                with self.lock:
+                    self.errors += 1
+            finished = time.monotonic()
+            with self.lock:
+                self.busy += finished - start
+                self.items += 1
+            if result is not None and self.next is not None:
+                self.next.inbox.put(result)  # 下游队列满时阻塞（背压）
+                with self.lock:
+                    self.blocked += time.monotonic() - finished
+        with self.lock:
+            self.running -= 1
+            last = self.running == 0
+        if last and self.next is not None:
+            # 本阶段最后一个线程退出后，通知下一阶段的所有线程
+            for _ in range(self.next.workers):
+                self.next.inbox.put(_STOP)
+
+
+class Pipeline:
+    def __init__(self, stages):
+        """stages: Stage 列表，按顺序连接"""
+        self.stages = stages
+        for stage, following in zip(stages, stages[1:]):
+            stage.next = following
+        self.elapsed = 0.0
+        self.start = None
+
+    def run(self, items):
+        start = self.start = time.monotonic()
+        threads = [threading.Thread(target=stage.work, name=f"pipeline-{stage.name}-{i}", daemon=True)
+                   for stage in self.stages for i in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+        first = self.stages[0]
+        for item in items:
+            first.inbox.put(item)
+        for _ in range(first.workers):
+            first.inbox.put(_STOP)
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.monotonic() - start
+
+    def stats(self):
+        # 运行中（常驻模式）按已运行的时间计算占用率
+        elapsed = self.elapsed or (time.monotonic() - self.start if self.start else 0.0)
+        result = []
+        for stage in self.stages:
+            capacity = stage.workers * elapsed
+            result.append({
+                "stage": stage.name,
+                "workers": stage.workers,
+                "items": stage.items,
+                "errors": stage.errors,
+                "busy_seconds": round(stage.busy, 2),
+                "occupancy": round(stage.busy / capacity, 3) if capacity else 0.0,
+                "blocked_seconds": round(stage.blocked, 2),
+                "queue_peak": stage.inbox.peak,
+                "queue_average": round(stage.inbox.average(), 2),
+            })
+        return result
+
+    def format_stats(self):
+        lines = [f"{'阶段':<10}{'线程':>6}{'课程':>6}{'忙碌(s)':>10}{'占用率':>8}{'阻塞(s)':>10}{'队列峰值':>10}{'平均队列':>10}"]
+        for s in self.stats():
+            lines.append(f"{s['stage']:<10}{s['workers']:>6}{s['items']:>6}{s['busy_seconds']:>10}"
+                         f"{s['occupancy'] * 100:>7.0f}%{s['blocked_seconds']:>10}{s['queue_peak']:>10}"
+                         f"{s['queue_average']:>10}")
+        return "\n".join(lines)
+
+
+class LessonPipeline:
+    def __init__(self, downloaders, parse_workers=2, download_workers=1, merge_workers=1,
+                 cleanup_workers=1, queue_size=2, on_result=None):
+        """
+        downloaders: M3U8Downloader 的可迭代对象（常驻模式下是阻塞的生成器，逐个产出新提交的课程）
+        parse_workers: 预取、解析播放列表的线程数
+        download_workers: 同时下载的课程数（每节课内部仍按 MAX_THREADS 并发）
+        merge_workers: 同时合并的课程数
+        cleanup_workers: 校验输出、删除临时目录的线程数
+        queue_size: 阶段之间的队列容量（课程数）
+        on_result: on_result(downloader, "success" / "failed" / "skipped")，每节课结束时调用
+        """
+        self.downloaders = downloaders
+        self.on_result = on_result
+        self.results = {"success": 0, "failed": 0, "skipped": 0}
+        self.lock = threading.Lock()
+        self.pipeline = Pipeline([
+            Stage("parse", self._guard(self._parse), parse_workers, queue_size),
+            Stage("download", self._guard(self._download), download_workers, queue_size),
+            Stage("merge", self._guard(self._merge), merge_workers, queue_size),
+            Stage("cleanup", self._guard(self._cleanup), cleanup_workers, queue_size),
+        ])
+
+    def _guard(self, func):
+        """阶段异常时把该课程计为失败，再交给 Stage 记录"""
+        def run(item):
+            try:
+                return func(item)
+            except Exception:
+                self._count("failed", item[0] if isinstance(item, tuple) else item)
+                raise
+        return run
+
+    def _count(self, result, downloader):
+        with self.lock:
+            self.results[result] += 1
+        if self.on_result:
+            self.on_result(downloader, result)
+
+    def _parse(self, downloader):
+        status = downloader.prepare()
+        if status == "skip":
+            print(f"\n✅ 文件已存在，跳过: {downloader.title}")
+            self._count("skipped", downloader)
+            return None
+        if not status:
+            print(f"\n❌ 解析M3U8失败: {downloader.title}")
+            self._count("failed", downloader)
+            return None
+        return downloader
+
+    def _download(self, downloader):
+        print(f"\n🎬 开始任务: {downloader.title} ({len(downloader.segments)} 个分片)")
+        return downloader, downloader.download_all()
+
+    def _merge(self, job):
+        downloader, completed = job
+        if not downloader.finalize(completed, cleanup=False):
+            self._count("failed", downloader)
+            return None
+        return downloader
+
+    def _cleanup(self, downloader):
+        if not downloader.verify_output():
+            print(f"❌ 输出文件校验失败，保留临时文件: {downloader.final_mp4}")
+            downloader.unlock()
+            self._count("failed", downloader)
+            return None
+        downloader.register_output()
+        downloader.cleanup()
+        self._count("success", downloader)
+        return None
+
+    def run(self):
+        self.pipeline.run(self.downloaders)
+        print(f"\n🏁 全部完成: 成功 {self.results['success']}, "
+              f"失败 {self.results['failed']}, 跳过 {self.results['skipped']}，总耗时 {self.pipeline.elapsed:.1f}s")
+        print(f"🏭 流水线阶段:\n{self.pipeline.format_stats()}")
+        logger.info(f"流水线阶段统计: {self.pipeline.stats()}")
+        return self.results
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+字节范围并行下载
+
+- 大分片：单个 GET 的吞吐受限于一条 TCP 连接，超过阈值时把剩余部分拆成多个 Range 请求并发下载
+- EXT-X-BYTERANGE 播放列表：同一个资源上相邻的范围合并成一个 Range 请求，而不是每个分片一个请求
+- 各部分直接读入预先分配好的缓冲区的对应位置（原地重组，不做拼接）
+- 服务器不支持 Range（返回 200）时回退为一次完整 GET，并记住该主机，之后不再尝试拆分
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class RangeNotSupported(Exception):
+    """服务器忽略了 Range 请求头"""
+
+
+def coalesce_ranges(segments, max_bytes, skip=None):
+    """
+    把相邻的字节范围分片分组，返回任务单元列表 [[Segment, ...], ...]
+    同一个 URL 上首尾相接、合计不超过 max_bytes 的分片归为一组；没有字节范围的分片、
+    skip(segment) 为真的分片（例如续传时已完成）各自单独成组
+    """
+    units = []
+    group = []
+    end = None
+    size = 0
+    for segment in segments:
+        if segment.byterange is None or (skip and skip(segment)):
+            if group:
+                units.append(group)
+                group = []
+            units.append([segment])
+            continue
+        offset, length = segment.byterange
+        if group and segment.url == group[-1].url and offset == end and size + length <= max_bytes:
+            group.append(segment)
+            size += length
+        else:
+            if group:
+                units.append(group)
+            group = [segment]
+            size = length
+        end = offset + length
+    if group:
+        units.append(group)
+    return units
+
+
+class RangeFetcher:
+    def __init__(self, session, timeout=30, part_size=4 * 1024 * 1024, workers=8):
+        """
+        session: 共享的 HTTP 会话
+        part_size: 每个 Range 请求的字节数
+        workers: 并发下载各部分的线程数（所有课程共享）
+        """
+        self.session = session
+        self.timeout = timeout
+        self.part_size = part_size
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="range")
+        self.no_range_hosts = set()  # 不支持 Range 的主机
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.split = 0  # 拆分下载的资源数
+        self.fallbacks = 0  # 回退为完整 GET 的次数
+
+    def supports_range(self, url):
+        return urlparse(url).netloc not in self.no_range_hosts
+
+    def splittable(self, resp, threshold):
+        """完整 GET 的响应是否值得改为并发 Range 下载（够大、声明支持 Range、未压缩）"""
+        if resp.status_code != 200 or not threshold:
+            return False
+        length = resp.headers.get("Content-Length", "")
+        return (length.isdigit() and int(length) > threshold
+                and resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+                and not resp.headers.get("Content-Encoding")
+                and self.supports_range(resp.url))
+
+    def _parts(self, start, end):
+        """把 [start, end) 切成不超过 part_size 的 (偏移, 长度) 列表"""
+        return [(offset, min(self.part_size, end - offset)) for offset in range(start, end, self.part_size)]
+
+    def _read_part(self, url, buffer, offset, length):
+        """用一个 Range 请求把 [offset, offset + length) 读入 buffer（长度为 length 的 memoryview）"""
+        headers = {"Range": f"bytes={offset}-{offset + length - 1}"}
+        with self.session.get(url, timeout=self.timeout, stream=True, headers=headers) as resp:
+            with self.lock:
+                self.requests += 1
+            resp.raise_for_status()
+            if resp.status_code != 206:
+                raise RangeNotSupported(url)
+            resp.raw.decode_content = True
+            _fill(resp.raw, buffer)
+
+    def _read_parts(self, url, buffer, base, parts):
+        """并发下载各部分，写入 buffer 中相对 base 的位置；第一部分在当前线程下载"""
+        futures = [self.pool.submit(self._read_part, url, buffer[offset - base:offset - base + length],
+                                    offset, length)
+                   for offset, length in parts[1:]]
+        try:
+            offset, length = parts[0]
+            self._read_part(url, buffer[offset - base:offset - base + length], offset, length)
+        finally:
+            errors = [f.exception() for f in futures]  # 出错时也要等其他部分用完缓冲区
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def _mark_no_range(self, url):
+        with self.lock:
+            self.no_range_hosts.add(urlparse(url).netloc)
+            self.fallbacks += 1
+        logger.info(f"服务器不支持 Range 请求，回退为完整下载: {urlparse(url).netloc}")
+
+    def fetch(self, url, offset, length):
+        """下载资源的 [offset, offset + length)，返回 bytearray；服务器不支持 Range 时用完整 GET 读出该范围"""
+        if self.supports_range(url):
+            buffer = bytearray(length)
+            parts = self._parts(offset, offset + length)
+            try:
+                self._read_parts(url, memoryview(buffer), offset, parts)
+                if len(parts) > 1:
+                    with self.lock:
+                        self.split += 1
+                return buffer
+            except RangeNotSupported:
+                self._mark_no_range(url)
+
+        # 完整 GET：跳过范围之前的数据，读到范围末尾就关闭连接，不读剩下的部分
+        buffer = bytearray(length)
+        with self.session.get(url, timeout=self.timeout, stream=True) as resp:
+            with self.lock:
+                self.requests += 1
+            resp.raise_for_status()
+            resp.raw.decode_content = True
+            scratch = memoryview(bytearray(min(offset, self.part_size)))
+            while offset:
+                n = resp.raw.readinto(scratch[:min(offset, len(scratch))])
+                if not n:
+                    raise IOError(f"资源长度不足，无法读取偏移 {offset} 处的范围")
+                offset -= n
+            _fill(resp.raw, memoryview(buffer))
+        return buffer
+
+    def fetch_rest(self, url, raw, total):
+        """
+        已经发出的完整 GET（长度为 total）：从 raw 读出第一部分，其余部分并发 Range 下载，返回 bytearray
+        服务器实际不支持 Range 时继续从 raw 读完
+        """
+        buffer = bytearray(total)
+        view = memoryview(buffer)
+        head = min(self.part_size, total)
+        _fill(raw, view[:head])
+        try:
+            self._read_parts(url, view, 0, self._parts(head, total))
+        except RangeNotSupported:
+            self._mark_no_range(url)
+            _fill(raw, view[head:])
+            return buffer
+        with self.lock:
+            self.split += 1
+        return buffer
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "split": self.split, "fallbacks": self.fallbacks}
+
+
+def _fill(raw, buffer):
+    """从 raw 读满 buffer，数据不足时抛出 IOError"""
+    filled = 0
+    while filled < len(buffer):
+        n = raw.readinto(buffer[filled:])
+        if not n:
+            raise IOError(f"范围数据不完整: 期望 {len(buffer)} 字节，实际 {filled} 字节")
+        filled += n
+
+
+_fetchers = {}  # (会话, 超时, 每部分字节数, 线程数) -> RangeFetcher
+_fetcher_lock = threading.Lock()
+
+
+def shared_fetcher(session, timeout=30, part_size=4 * 1024 * 1024, workers=8):
+    """进程内共享的 RangeFetcher：会话和参数相同的调用复用同一个"""
+    key = (id(session), timeout, part_size, workers)
+    with _fetcher_lock:
+        fetcher = _fetchers.get(key)
+        if fetcher is None or fetcher.session is not session:
+            if fetcher is not None:
+                fetcher.pool.shutdown(wait=False)  # 原会话已关闭，id 被新会话复用
+            fetcher = _fetchers[key] = RangeFetcher(session, timeout, part_size, workers)
+        return fetcher
+
+
+def reset():
+    """关闭并丢弃所有共享的 RangeFetcher（基准测试在各轮之间调用）"""
+    with _fetcher_lock:
+        for fetcher in _fetchers.values():
+            fetcher.pool.shutdown(wait=True)
+        _fetchers.clear()
+
+
+def stats():
+    """所有共享 RangeFetcher 的合计统计，未创建时返回 None"""
+    with _fetcher_lock:
+        fetchers = list(_fetchers.values())
+    if not fetchers:
+        return None
+    total = {"requests": 0, "split": 0, "fallbacks": 0}
+    for fetcher in fetchers:
+        for name, value in fetcher.stats().items():
+            total[name] += value
+    return total
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+码率选择策略
+
+以前总是选择 BANDWIDTH 最高的码率；讲课类视频画面变化少，最高码率往往要多下载 3-4 倍的字节。
+RenditionPolicy 按以下方式之一从主播放列表中选择码率：
+- best: 最高码率（默认，与以前相同）
+- resolution: 高度不超过目标分辨率的最高码率（都超过时取最低的）
+- bitrate: 平均带宽不超过上限的最高码率
+- budget: 整门课的磁盘预算，按每节课的时长（#EXTINF 之和）分摊，换算成本节课的码率上限
+- deadline: 实测下载吞吐 × 截止时间前的剩余秒数 = 还能下载的字节数，再同 budget 一样按时长分摊
+- audio: 只下载 EXT-X-MEDIA 独立音频轨；没有独立音频轨时选纯音频码率，再没有则选最低码率
+码率都超过上限时选最低码率，不会因为预算不足而放弃下载。
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("best", "resolution", "bitrate", "budget", "deadline", "audio")
+
+
+def effective_bandwidth(variant):
+    """平均带宽（AVERAGE-BANDWIDTH），没有时用峰值带宽"""
+    return variant.average_bandwidth or variant.bandwidth
+
+
+def describe(variant):
+    resolution = f"{variant.resolution[0]}x{variant.resolution[1]} " if variant.resolution else ""
+    return f"{resolution}{effective_bandwidth(variant) / 1e6:.2f} Mbps"
+
+
+class Choice:
+    """选中的码率"""
+
+    __slots__ = ("url", "bandwidth", "best_bandwidth", "label", "policy", "audio")
+
+    def __init__(self, url, bandwidth, best_bandwidth, label, policy, audio=None):
+        self.url = url
+        self.bandwidth = bandwidth  # 平均带宽（bps），独立音频轨未知时为 None
+        self.best_bandwidth = best_bandwidth  # 最高码率的平均带宽，用于计算节省的字节数
+        self.label = label
+        self.policy = policy
+        self.audio = audio  # 独立音频轨 (GROUP-ID, NAME)，刷新播放列表时据此重新定位
+
+    def best_bytes(self, duration):
+        """按最高码率下载本节课的预计字节数"""
+        return int(self.best_bandwidth / 8 * duration) if self.best_bandwidth else 0
+
+    def __repr__(self):
+        return f"Choice({self.policy}, {self.label})"
+
+
+class ThroughputMeter:
+    """下载吞吐（字节/秒）的指数滑动平均，deadline 策略据此估算还能下载多少字节"""
+
+    def __init__(self, alpha=0.5):
+        self.alpha = alpha
+        self.rate = None
+        self.lock = threading.Lock()
+
+    def record(self, nbytes, seconds):
+        if nbytes <= 0 or seconds <= 0:
+            return
+        rate = nbytes / seconds
+        with self.lock:
+            self.rate = rate if self.rate is None else self.alpha * rate + (1 - self.alpha) * self.rate
+
+    def probe(self, fetch):
+        """还没有测量值时，计时下载一个分片（单连接，偏保守）"""
+        if self.rate is not None:
+            return
+        start = time.perf_counter()
+        content = fetch()
+        if content:
+            self.record(len(content), time.perf_counter() - start)
+            logger.info(f"探测下载吞吐: {self.rate / 1024 / 1024:.2f} MB/s")
+
+
+class CourseAllowance:
+    """budget / deadline 策略下整门课可用的字节数，按时长分摊到各节课"""
+
+    def __init__(self, lessons, budget=None, deadline=None, meter=None):
+        """
+        lessons: 课程总数（用已见课程的平均时长估算剩余课程的总时长）
+        budget: 整门课的字节预算
+        deadline: 整门课的截止秒数（从创建时开始计），需要 meter 提供吞吐
+        """
+        self.lessons = max(1, lessons)
+        self.budget = budget
+        self.deadline_at = time.monotonic() + deadline if deadline else None
+        self.meter = meter
+        self.lock = threading.Lock()
+        self.seen = 0
+        self.seen_duration = 0.0
+        self.reserved = 0  # budget 策略下已分配给前面课程的字节数
+
+    def available(self):
+        if self.budget is not None:
+            return max(0, self.budget - self.reserved)
+        rate = self.meter.rate if self.meter else None
+        if rate is None:
+            return None
+        return max(0.0, rate * (self.deadline_at - time.monotonic()))
+
+    def cap(self, duration, reserve):
+        """
+        本节课的码率上限（bps）；reserve(cap) 返回选中码率的预计字节数，在同一把锁内记账，
+        避免并行解析的课程分到同一份额度。无法估算时传入 None
+        """
+        with self.lock:
+            remaining = max(1, self.lessons - self.seen)
+            average = (self.seen_duration + duration) / (self.seen + 1)
+            share = duration / (duration + average * (remaining - 1))
+            available = self.available()
+            cap = available * share * 8 / duration if available is not None and duration > 0 else None
+            nbytes = reserve(cap)
+            self.seen += 1
+            self.seen_duration += duration
+            self.reserved += nbytes
+            return cap
+
+
+class RenditionPolicy:
+    def __init__(self, mode="best", height=None, max_bitrate=None, allowance=None):
+        """
+        mode: POLICIES 之一
+        height: resolution 策略的目标高度（例如 720）
+        max_bitrate: bitrate 策略的码率上限（bps）
+        allowance: budget / deadline 策略共享的 CourseAllowance
+        """
+        if mode not in POLICIES:
+            raise ValueError(f"未知的码率策略: {mode}")
+        self.mode = mode
+        self.height = height
+        self.max_bitrate = max_bitrate
+        self.allowance = allowance
+
+    @property
+    def needs_duration(self):
+        """是否需要先读取时长（budget / deadline 按时长分摊额度）"""
+        return self.mode in ("budget", "deadline") and self.allowance is not None
+
+    def select(self, playlist, duration=None):
+        """从主播放列表中选择码率，返回 Choice"""
+        variants = sorted(playlist.variants, key=effective_bandwidth)
+        best = max(variants, key=lambda v: v.bandwidth)
+        best_bandwidth = effective_bandwidth(best)
+
+        def choice(variant, note=""):
+            return Choice(variant.url, effective_bandwidth(variant), best_bandwidth,
+                          describe(variant) + note, self.mode)
+
+        if self.mode == "audio":
+            return self.select_audio(playlist, group=best.audio) or choice(
+                variants[0], "（没有独立音频轨，选最低码率）")
+        if self.mode == "resolution" and self.height:
+            fitting = [v for v in variants if v.resolution and v.resolution[1] <= self.height]
+            if fitting:
+                return choice(max(fitting, key=effective_bandwidth))
+            sized = [v for v in variants if v.resolution]
+            return choice(min(sized, key=lambda v: v.resolution[1]) if sized else variants[0], "（均高于目标分辨率）")
+        if self.mode == "bitrate" and self.max_bitrate:
+            return self._under(variants, self.max_bitrate, choice)
+        if self.mode in ("budget", "deadline") and self.allowance is not None and duration:
+            picked = {}
+
+            def reserve(cap):
+                picked["choice"] = choice(best) if cap is None else self._under(variants, cap, choice)
+                return int(picked["choice"].bandwidth / 8 * duration)
+
+            cap = self.allowance.cap(duration, reserve)
+            result = picked["choice"]
+            if cap is not None:
+                result.label += f"，本节额度 {cap / 1e6:.2f} Mbps"
+            else:
+                result.label += "（尚无吞吐测量，选最高码率）"
+            return result
+        return choice(best)
+
+    def follow(self, playlist, previous):
+        """刷新播放列表时保持同一选择：同一音频轨，或带宽最接近的码率"""
+        if previous.audio:
+            group, name = previous.audio
+            choice = self.select_audio(playlist, group=group, name=name)
+            if choice is not None:
+                return choice
+        best = max(playlist.variants, key=lambda v: v.bandwidth)
+        variant = min(playlist.variants, key=lambda v: abs(effective_bandwidth(v) - (previous.bandwidth or 0))) \
+            if previous.bandwidth else best
+        return Choice(variant.url, effective_bandwidth(variant), effective_bandwidth(best),
+                      describe(variant), previous.policy)
+
+    def observe(self, nbytes, seconds):
+        """记录一节课的下载字节数和耗时（deadline 策略据此更新吞吐）"""
+        if self.allowance is not None and self.allowance.meter is not None:
+            self.allowance.meter.record(nbytes, seconds)
+
+    def _under(self, variants, cap, choice):
+        fitting = [v for v in variants if effective_bandwidth(v) <= cap]
+        if fitting:
+            return choice(fitting[-1])
+        return choice(variants[0], "（均高于上限，选最低码率）")
+
+    def select_audio(self, playlist, group=None, name=None):
+        """
+        独立音频轨：优先 name 指定的轨道（刷新时），其次最高码率引用的音频组中的默认轨道；
+        都没有时选纯音频码率；仍没有时返回 None
+        """
+        best_bandwidth = effective_bandwidth(max(playlist.variants, key=lambda v: v.bandwidth)) \
+            if playlist.variants else None
+        tracks = [m for m in playlist.media if m.type == "AUDIO" and m.url]
+        if group:
+            tracks = [m for m in tracks if m.group == group] or tracks
+        if name:
+            tracks = [m for m in tracks if m.name == name] or tracks
+        if tracks:
+            track = next((m for m in tracks if m.default), tracks[0])
+            label = f"音频轨 {track.name or track.group}" + (f" [{track.language}]" if track.language else "")
+            return Choice(track.url, None, best_bandwidth, label, "audio", audio=(track.group, track.name))
+        audio_variants = [v for v in playlist.variants if v.audio_only]
+        if audio_variants:
+            variant = max(audio_variants, key=effective_bandwidth)
+            return Choice(variant.url, effective_bandwidth(variant), best_bandwidth,
+                          f"纯音频码率 {effective_bandwidth(variant) / 1000:.0f} kbps", "audio")
+        return None
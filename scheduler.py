@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+跨课程分片调度器
+
+逐课下载时，每节课末尾都有少数慢分片占着线程、其余线程空闲，随后的 ffmpeg 合并期间完全不下载。
+这里把多节课的分片放进同一个线程池，共用一个并发预算：
+- 预先解析后续几节课的播放列表
+- 同时最多 max_active_lessons 节课在下载，按在途分片数最少优先分配（课程间公平）
+- 某节课的分片全部结束后交给独立的合并线程，下载线程继续处理其他课程
+"""
+
+import logging
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+
+class LessonState:
+    """单节课的调度状态"""
+
+    def __init__(self, downloader):
+        self.downloader = downloader
+        self.pending = deque(downloader.download_units())  # 单个分片或合并的相邻字节范围
+        self.total = len(downloader.segments)
+        self.inflight = 0
+        self.finished = 0
+        self.completed = 0
+
+
+class CourseScheduler:
+    def __init__(self, downloaders, max_workers=16, max_active_lessons=3, prefetch=2, merge_workers=1):
+        """
+        downloaders: M3U8Downloader 列表，按顺序处理
+        max_workers: 所有课程共享的下载线程数
+        max_active_lessons: 同时下载的课程数上限
+        prefetch: 额外提前解析的课程数
+        merge_workers: 合并线程数
+        """
+        self.upcoming = deque(downloaders)
+        self.max_workers = max_workers
+        self.max_active_lessons = max(1, max_active_lessons)
+        self.prefetch = prefetch
+        self.merge_workers = merge_workers
+        self.results = {"success": 0, "failed": 0, "skipped": 0}
+
+    def _pick(self, active):
+        """选出在途分片最少、仍有待下载分片的课程"""
+        candidates = [lesson for lesson in active if lesson.pending]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda lesson: lesson.inflight)
+
+    def run(self):
+        parsing = deque()  # (downloader, future)，保持课程顺序
+        active = []
+        inflight = {}  # future -> LessonState
+        inflight_sizes = {}  # future -> 任务单元包含的分片数
+        merges = []
+        done_segments = total_segments = 0
+
+        with ThreadPoolExecutor(max_workers=max(1, self.prefetch)) as parse_pool, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as segment_pool, \
+                ThreadPoolExecutor(max_workers=self.merge_workers) as merge_pool:
+
+            while True:
+                # 1. 预解析后续课程
+                while self.upcoming and len(parsing) + len(active) < self.max_active_lessons + self.prefetch:
+                    downloader = self.upcoming.popleft()
+                    parsing.append((downloader, parse_pool.submit(downloader.prepare)))
+
+                # 2. 按顺序激活已解析完成的课程
+                while parsing and len(active) < self.max_active_lessons and parsing[0][1].done():
+                    downloader, future = parsing.popleft()
+                    try:
+                        status = future.result()
+                    except Exception as e:
+                        logger.error(f"解析失败 [{downloader.title}]: {e}")
+                        status = False
+                    if status == "skip":
+                        print(f"\n✅ 文件已存在，跳过: {downloader.title}")
+                        self.results["skipped"] += 1
+                    elif not status:
+                        print(f"\n❌ 解析M3U8失败: {downloader.title}")
+                        self.results["failed"] += 1
+                    else:
+                        print(f"\n🎬 开始任务: {downloader.title} ({len(downloader.segments)} 个分片)")
+                        downloader.begin_download(self.max_workers)
+                        active.append(LessonState(downloader))
+                        total_segments += len(downloader.segments)
+
+                # 3. 填满共享的并发预算
+                while len(inflight) < self.max_workers:
+                    lesson = self._pick(active)
+                    if lesson is None:
+                        break
+                    unit = lesson.pending.popleft()
+                    future = segment_pool.submit(lesson.downloader.download_unit, unit)
+                    inflight[future] = lesson
+                    inflight_sizes[future] = len(unit)
+                    lesson.inflight += 1
+
+                waiting = list(inflight)
+                if parsing and len(active) < self.max_active_lessons:
+                    waiting.append(parsing[0][1])
+                if not waiting:
+                    if not parsing and not self.upcoming:
+                        break
+                    continue
+
+                # 4. 处理完成的分片
+                finished, _ = wait(waiting, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    lesson = inflight.pop(future, None)
+                    if lesson is None:
+                        continue  # 解析任务完成，下一轮激活
+                    lesson.inflight -= 1
+                    size = inflight_sizes.pop(future)
+                    lesson.finished += size
+                    done_segments += size
+                    try:
+                        lesson.completed += future.result()
+                    except Exception as e:
+                        logger.warning(f"分片下载异常 [{lesson.downloader.title}]: {e}")
+
+                    if lesson.finished == lesson.total:
+                        active.remove(lesson)
+                        merges.append(merge_pool.submit(lesson.downloader.finalize, lesson.completed))
+
+                sys.stdout.write(f"\r进度: {done_segments}/{total_segments} 分片, "
+                                 f"下载中 {len(active)} 课, 合并队列 {sum(not m.done() for m in merges)}")
+                sys.stdout.flush()
+
+            for future in merges:
+                try:
+                    ok = future.result()
+                except Exception as e:
+                    logger.error(f"合并异常: {e}")
+                    ok = False
+                self.results["success" if ok else "failed"] += 1
+
+        print(f"\n🏁 全部完成: 成功 {self.results['success']}, "
+              f"失败 {self.results['failed']}, 跳过 {self.results['skipped']}")
+        return self.results
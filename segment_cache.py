@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+跨课程、跨运行的分片内容缓存
+
+导出的 m3u8 和分片 URL 带有会过期的签名参数，令牌过期后重新导出，URL 全变了，临时目录和续传日志都对不上，
+只能把整节课重新下载一遍。这里按 identity.segment_key（去掉签名参数后的主机、路径、查询参数和字节范围）
+缓存解密、校验后的分片明文：
+- 每个分片一个文件 <键前两位>/<键>.<crc32>.ts，文件名自带校验和，读取时校验，不符则删除
+- 总大小超过上限时按最近使用时间淘汰（命中时更新文件的 mtime，重启后按 mtime 恢复顺序）
+- 分片文件与临时目录在同一文件系统时用硬链接存入，不额外复制
+"""
+
+import logging
+import os
+import shutil
+import threading
+import zlib
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = ".ts"
+
+
+class SegmentCache:
+    def __init__(self, root, max_bytes):
+        """
+        root: 缓存目录
+        max_bytes: 缓存总大小上限
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # 键 -> (字节数, crc32)，按最近使用排序
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.hit_bytes = 0
+        self.evicted = 0
+        self.corrupt = 0
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """扫描缓存目录，按 mtime 恢复最近使用顺序，清理写了一半的临时文件"""
+        found = []
+        for sub in self.root.iterdir():
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub):
+                name = entry.name
+                if not name.endswith(SUFFIX):
+                    if name.endswith(".tmp"):
+                        os.unlink(entry.path)
+                    continue
+                key, _, crc = name[:-len(SUFFIX)].partition(".")
+                try:
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, key, stat.st_size, int(crc, 16)))
+                except (OSError, ValueError):
+                    continue
+        for _, key, size, crc in sorted(found):
+            self.entries[key] = (size, crc)
+            self.size += size
+        if self.entries:
+            logger.info(f"分片缓存: {len(self.entries)} 个分片，{self.size / 1024 / 1024:.1f} MB")
+        self._evict()
+
+    def _path(self, key, crc):
+        return self.root / key[:2] / f"{key}.{crc:08x}{SUFFIX}"
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key):
+        """读取并校验分片，未命中或校验失败时返回 None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+        size, crc = entry
+        path = self._path(key, crc)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            data = None
+        if data is None or len(data) != size or zlib.crc32(data) != crc:
+            logger.warning(f"缓存分片损坏，已删除: {key}")
+            self._drop(key, corrupt=True)
+            return None
+        try:
+            os.utime(path)  # 记录最近使用时间，重启后仍按 LRU 淘汰
+        except OSError:
+            pass
+        with self.lock:
+            self.hits += 1
+            self.hit_bytes += size
+        return data
+
+    def put(self, key, data, crc=None):
+        """存入分片明文"""
+        size = len(data)
+        if not self._admit(key, size):
+            return
+        crc = zlib.crc32(data) if crc is None else crc
+        path = self._path(key, crc)
+        tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"写入分片缓存失败: {e}")
+            tmp.unlink(missing_ok=True)
+            return
+        self._add(key, size, crc)
+
+    def put_file(self, key, source, size, crc):
+        """
+        存入已写盘的分片文件：优先硬链接，跨文件系统时复制
+        硬链接与 source 共用同一份数据，source 之后只能整体替换（写新文件再 os.replace），不能原地改写
+        """
+        if not self._admit(key, size):
+            return
+        path = self._path(key, crc)
+        tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(source, tmp)
+            except OSError:
+                shutil.copyfile(source, tmp)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"写入分片缓存失败: {e}")
+            tmp.unlink(missing_ok=True)
+            return
+        self._add(key, size, crc)
+
+    def _admit(self, key, size):
+        with self.lock:
+            return key not in self.entries and 0 < size <= self.max_bytes
+
+    def _add(self, key, size, crc):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[0]
+            self.entries[key] = (size, crc)
+            self.size += size
+            self.stored += 1
+        self._evict()
+
+    def _drop(self, key, corrupt=False):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return
+            self.size -= entry[0]
+            self.corrupt += corrupt
+        self._path(key, entry[1]).unlink(missing_ok=True)
+
+    def _evict(self):
+        """超过上限时淘汰最久未使用的分片"""
+        victims = []
+        with self.lock:
+            while self.size > self.max_bytes and self.entries:
+                key, (size, crc) = self.entries.popitem(last=False)
+                self.size -= size
+                self.evicted += 1
+                victims.append(self._path(key, crc))
+        for path in victims:
+            path.unlink(missing_ok=True)
+
+    def resize(self, max_bytes):
+        """调整容量上限，超出部分立即淘汰"""
+        with self.lock:
+            self.max_bytes = max_bytes
+        self._evict()
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.size, "hits": self.hits, "misses": self.misses,
+                    "hit_bytes": self.hit_bytes, "stored": self.stored, "evicted": self.evicted,
+                    "corrupt": self.corrupt}
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def shared_cache(root, max_bytes):
+    """进程内每个缓存目录共享一个分片缓存；同一目录以不同的容量再次调用时按新容量淘汰"""
+    key = os.path.abspath(root)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = SegmentCache(root, max_bytes)
+        elif cache.max_bytes != max_bytes:
+            cache.resize(max_bytes)
+        return cache
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+单文件分片存储
+
+每节课的分片不再各自占一个 NNNNN.ts 文件，而是写入临时目录下的一个容器文件 segments.dat：
+- 创建时按已知（EXT-X-BYTERANGE）或估算（码率 × 时长）的总大小预分配，减少碎片
+- 分片完成时在文件末尾分配一段区域，用定位写（os.pwrite）写入，多个线程互不干扰
+- 偏移索引就是续传日志 journal.log，每条记录多一列偏移：<序号> <字节数> <crc32> <偏移>
+合并和续传校验通过 mmap 按序号读取，不需要扫描目录；清理时只需删除几个文件
+"""
+
+import logging
+import mmap
+import os
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+STORE_NAME = "segments.dat"
+
+
+class SegmentStore:
+    def __init__(self, temp_dir, journal, expected_size=0):
+        """
+        temp_dir: 课程临时目录
+        journal: ResumeJournal，兼作偏移索引
+        expected_size: 预计总字节数，0 表示不预分配
+        """
+        self.path = temp_dir / STORE_NAME
+        self.journal = journal
+        self.lock = threading.Lock()
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0))
+        # 续传时从已记录分片的末尾继续分配，记录之后写了一半的区域直接覆盖
+        self.end = max((offset + size for size, _, offset in journal.entries.values() if offset is not None),
+                       default=0)
+        if expected_size > os.fstat(self.fd).st_size:
+            self._preallocate(expected_size)
+
+    def _preallocate(self, size):
+        try:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(self.fd, 0, size)
+            else:
+                os.truncate(self.fd, size)  # 不支持 fallocate 时至少一次性扩展文件
+            logger.info(f"预分配分片存储 {size / 1024 / 1024:.1f} MB")
+        except OSError as e:
+            logger.warning(f"预分配分片存储失败: {e}")
+
+    def _pwrite(self, data, offset):
+        if hasattr(os, "pwrite"):
+            view = memoryview(data)
+            while view:
+                n = os.pwrite(self.fd, view, offset)
+                view, offset = view[n:], offset + n
+        else:
+            # Windows 没有 os.pwrite，退化为加锁的 seek + write
+            with self.lock:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                os.write(self.fd, data)
+
+    def put(self, idx, data):
+        """写入一个分片并记入索引，返回 (字节数, crc32)"""
+        size = len(data)
+        with self.lock:
+            offset = self.end
+            self.end += size
+        self._pwrite(data, offset)
+        crc = zlib.crc32(data)
+        self.journal.record(idx, size, crc, offset)
+        return size, crc
+
+    def _map(self):
+        if os.fstat(self.fd).st_size == 0:
+            return None
+        return mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+
+    def verify(self, idx):
+        """按索引中的大小和 crc32 校验分片"""
+        size, crc, offset = self.journal.entries[idx]
+        if offset is None:
+            return False
+        mm = self._map()
+        if mm is None:
+            return False
+        with mm:
+            return offset + size <= len(mm) and zlib.crc32(mm[offset:offset + size]) == crc
+
+    def iter_segments(self, total):
+        """按序号依次返回 (序号, 数据)，缺失的分片数据为 None"""
+        entries = self.journal.entries
+        mm = self._map()
+        try:
+            for idx in range(total):
+                entry = entries.get(idx)
+                if mm is None or entry is None or entry[2] is None or entry[2] + entry[0] > len(mm):
+                    yield idx, None
+                else:
+                    size, _, offset = entry
+                    yield idx, mm[offset:offset + size]
+        finally:
+            if mm is not None:
+                mm.close()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式合并：边下载边把按序就绪的分片写入 ffmpeg 的标准输入
+
+分片完成顺序是乱序的，这里用一个重排窗口缓存提前到达的分片：
+- 下一个待写入的序号就绪后立即写入管道，并继续写出后面连续就绪的分片
+- 序号超出窗口的分片会阻塞等待（背压），内存占用上限约为 窗口大小 × 分片大小
+- 下载失败的分片用 skip() 标记，合并时跳过
+最后一个分片落地后只需等待 ffmpeg 收尾，不再有单独的合并阶段，也不产生临时 .ts 文件
+backend 为 "python" 时用 ts_remux.TSRemuxer 代替 ffmpeg 进程
+"""
+
+import logging
+import os
+import subprocess
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class StreamMerger:
+    def __init__(self, output_file, window=64, timeout=600, backend="ffmpeg", drop_video=False,
+                 input_format="mpegts"):
+        """
+        output_file: 最终 MP4 路径（写入过程中使用 .part 临时名）
+        window: 重排窗口大小（分片数）
+        timeout: 输入结束后等待 ffmpeg 收尾的超时时间
+        backend: "ffmpeg" 或 "python"
+        drop_video: 只保留音频
+        input_format: ffmpeg 读取管道的格式，packed audio 音频轨为 "aac"（python 后端按内容识别）
+        """
+        self.output_file = output_file
+        self.part_file = output_file.with_name(output_file.name + ".part")
+        self.window = window
+        self.timeout = timeout
+        self.backend = backend
+        self.drop_video = drop_video
+        self.input_format = input_format
+
+        self.next_index = 0
+        self.buffer = {}  # 序号 -> 数据，None 表示跳过
+        self.cond = threading.Condition()
+        self.process = None
+        self.sink = None  # ffmpeg 的标准输入或 TSRemuxer
+        self.error = None
+        self.written = 0
+        self.skipped = 0
+
+    def start(self):
+        if self.backend == "python":
+            from ts_remux import TSRemuxer
+            self.sink = TSRemuxer(self.part_file, drop_video=self.drop_video)
+            return self
+
+        cmd = [
+            "ffmpeg", "-y",
+            "-f", self.input_format,
+            "-i", "pipe:0",
+            "-c", "copy",
+            "-bsf:a", "aac_adtstoasc",  # 修复音频流格式，防止 MP4 没声音
+            "-f", "mp4",
+            str(self.part_file.absolute())
+        ]
+        if self.drop_video:
+            cmd.insert(-3, "-vn")
+
+        # Windows 下隐藏控制台窗口
+        startupinfo = None
+        if os.name == 'nt':
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+
+        self.process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            startupinfo=startupinfo
+        )
+        self.sink = self.process.stdin
+        return self
+
+    def put(self, index, data):
+        """提交一个分片；超出重排窗口时阻塞等待"""
+        with self.cond:
+            while index >= self.next_index + self.window and self.error is None:
+                self.cond.wait()
+            if index < self.next_index:
+                return  # 重复提交
+            self.buffer[index] = data
+            self._flush()
+
+    def skip(self, index):
+        """标记分片下载失败，合并时跳过"""
+        with self.cond:
+            if index >= self.next_index:
+                self.buffer[index] = None
+                self._flush()
+
+    def _flush(self):
+        """按序写出连续就绪的分片（调用方持有锁）"""
+        while self.next_index in self.buffer:
+            data = self.buffer.pop(self.next_index)
+            self.next_index += 1
+            if data is None:
+                self.skipped += 1
+                continue
+            if self.error is None:
+                try:
+                    self.sink.write(data)
+                    self.written += 1
+                except Exception as e:
+                    self.error = e
+                    logger.error(f"流式合并写入失败: {e}")
+        self.cond.notify_all()
+
+    def close(self):
+        """结束输入并等待 ffmpeg 完成，成功后把 .part 重命名为最终文件"""
+        if self.process is None:
+            if self.error is None and self.sink.close():
+                self.part_file.replace(self.output_file)
+                return True
+            return False
+
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+
+        try:
+            self.process.wait(timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            logger.error("ffmpeg 流式合并超时")
+            self.process.kill()
+            return False
+
+        if self.error is None and self.process.returncode == 0 and self.part_file.exists():
+            self.part_file.replace(self.output_file)
+            return True
+        logger.error(f"ffmpeg 流式合并失败，返回码 {self.process.returncode}")
+        return False
+
+    def abort(self):
+        """放弃合并并删除未完成的输出"""
+        with self.cond:
+            self.error = self.error or RuntimeError("aborted")
+            self.cond.notify_all()
+        if self.process is None:
+            self.sink.abort()
+        elif self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.part_file.unlink(missing_ok=True)
@@ -1,13 +1,16 @@
 // ==UserScript==
 // @name         小鹅通 m3u8 导出 / 一键复制工具
 // @namespace    https://tampermonkey.net/
-// @version      1.1
+// @version      1.2
 // @description  自动监听页面请求，识别并评分课程播放过程中出现的 m3u8 地址，智能筛选主播放列表（master m3u8），并支持一键导出 JSON 或复制到剪贴板，适用于小鹅通网页端课程视频分析与下载辅助
 // @author       Eddie7x
 // @license      MIT
 // @match        *://*.xiaoeknow.com/*
 // @match        *://*.h5.xet.citv.cn/*
 // @grant        GM_download
+// @grant        GM_xmlhttpRequest
+// @connect      127.0.0.1
+// @connect      localhost
 // ==/UserScript==
 
 (function () {
@@ -15,6 +18,9 @@
 
     const pool = new Map();
 
+    // 本机常驻下载服务（python main.py，RUN_MODE = "daemon"），端口与 DAEMON_PORT 一致
+    const DAEMON_URL = 'http://127.0.0.1:18710';
+
     function getTitle() {
         const titleEl = document.querySelector(".title-row .title.new_title");
         if (titleEl && titleEl.innerText.trim()) {
@@ -125,4 +131,37 @@
             console.error(e);
         }
     }, '#10b981'); // 绿色
+
+    // 发送到本机常驻下载服务
+    createBtn('发送到下载器', 200, () => {
+        const data = getBestData();
+        if (!data) {
+            alert('请先播放课程');
+            return;
+        }
+
+        GM_xmlhttpRequest({
+            method: 'POST',
+            url: `${DAEMON_URL}/lessons`,
+            headers: { 'Content-Type': 'application/json' },
+            data: JSON.stringify(data),
+            timeout: 5000,
+            onload: (resp) => {
+                let result = null;
+                try {
+                    result = JSON.parse(resp.responseText).results[0].result;
+                } catch (e) {
+                    console.error(e);
+                }
+                const messages = {
+                    accepted: '已加入下载队列',
+                    in_flight: '该课程正在下载（已更新地址）',
+                    done: '该课程已下载完成'
+                };
+                alert(messages[result] || `下载器返回错误: ${resp.status}`);
+            },
+            onerror: () => alert('无法连接下载器，请先运行 python main.py（RUN_MODE = "daemon"）'),
+            ontimeout: () => alert('连接下载器超时')
+        });
+    }, '#8b5cf6'); // 紫色
 })();
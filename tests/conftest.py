@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 仓库是平铺的模块，测试直接按模块名导入
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,32 @@
+import asyncio
+import threading
+
+from async_engine import AsyncSegmentEngine
+from concurrency import AdaptiveLimiter
+
+
+def test_acquire_wakes_on_release_from_another_thread():
+    limiter = AdaptiveLimiter(initial=2, minimum=2, maximum=2)
+    engine = AsyncSegmentEngine(downloader=None)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        engine.released = asyncio.Event()
+        wake = lambda: loop.call_soon_threadsafe(engine.released.set)
+        limiter.subscribe(wake)
+        try:
+            await engine._acquire(limiter)
+            await engine._acquire(limiter)
+            waiter = asyncio.create_task(engine._acquire(limiter))
+            await asyncio.sleep(0.05)
+            assert not waiter.done()  # 窗口已满，挂起等待
+
+            # 名额在其他线程（线程池引擎 / 另一节课）中释放
+            threading.Thread(target=limiter.release, args=(0.01, 1024)).start()
+            await asyncio.wait_for(waiter, 1)
+        finally:
+            limiter.unsubscribe(wake)
+
+    asyncio.run(scenario())
+    assert limiter.inflight == 2
+    assert not limiter.listeners
@@ -0,0 +1,37 @@
+import http.client
+import json
+
+import pytest
+
+from daemon import LessonDaemon
+
+
+@pytest.fixture
+def daemon():
+    service = LessonDaemon(lambda url, title, refresh_url: None, port=0)
+    service.start()
+    yield service
+    service.stop()
+
+
+def request(port, method, path, host, body=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    headers = {"Host": host, "Content-Type": "application/json"}
+    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    resp = conn.getresponse()
+    resp.read()
+    conn.close()
+    return resp.status
+
+
+def test_local_host_is_accepted(daemon):
+    assert request(daemon.port, "GET", "/status", f"127.0.0.1:{daemon.port}") == 200
+    assert request(daemon.port, "GET", "/status", f"localhost:{daemon.port}") == 200
+
+
+@pytest.mark.parametrize("host", ["rebind.attacker.example", "rebind.attacker.example:{port}", "127.0.0.1:1"])
+def test_foreign_host_is_rejected(daemon, host):
+    host = host.format(port=daemon.port)
+    assert request(daemon.port, "GET", "/status", host) == 403
+    assert request(daemon.port, "POST", "/lessons", host, {"title": "第1课", "m3u8": "http://x/a.m3u8"}) == 403
+    assert daemon.lessons == {}
@@ -0,0 +1,48 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from hedge import HedgeAbandoned, HedgeController, HedgeRace
+
+
+class FakeResponse:
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+
+def test_stalled_request_in_first_batch_is_hedged_and_loser_closed():
+    hedger = HedgeController(percentile=95, budget=0.5, min_delay=0.2, workers=64)
+    stalled = FakeResponse()
+
+    def fetch(index):
+        def run(race, tag):
+            if index == 0 and tag == "primary":
+                # 卡住的主请求：读取一直阻塞，直到响应被关闭
+                race.attach(tag, stalled)
+                if not stalled.closed.wait(10):
+                    return 0
+                raise HedgeAbandoned(index) if race.abandoned(tag) else OSError("closed")
+            return 1024 if race.claim(tag) else 0
+        return run
+
+    # 第一个请求开始时还没有任何样本，阈值要在等待过程中武装
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        futures = [pool.submit(hedger.run, fetch(i)) for i in range(32)]
+        sizes = [f.result(timeout=5) for f in futures]
+
+    assert sizes == [1024] * 32
+    stats = hedger.stats()
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+    assert stalled.closed.is_set()  # 对冲胜出后立即关闭落败的响应
+    hedger.close()
+
+
+def test_attach_after_losing_raises():
+    race = HedgeRace()
+    assert race.claim("hedge")
+    with pytest.raises(HedgeAbandoned):
+        race.attach("primary", FakeResponse())
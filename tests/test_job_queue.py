@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import Counter
+
+from job_queue import DONE, RUNNING, Heartbeat, JobQueue, work
+
+
+class FakeDownloader:
+    """不访问网络的下载器替身：run() 记录执行的课程，可选地等到被取消为止"""
+
+    def __init__(self, job, runs, block=None):
+        self.job = job
+        self.runs = runs
+        self.block = block
+        self.progress = 0
+        self.segments = [None] * 4
+        self.final_mp4 = f"{job.title}.mp4"
+        self.cancel = threading.Event()
+
+    def run(self):
+        self.runs.append(self.job.id)
+        if self.block:
+            return not self.cancel.wait(self.block)
+        time.sleep(0.02)
+        self.progress = len(self.segments)
+        return True
+
+
+def enqueue(queue, n):
+    queue.enqueue([{"title": f"第{i}课", "m3u8": f"http://cdn.example.com/{i}/index.m3u8?sign={i}"}
+                   for i in range(n)])
+
+
+def test_two_workers_finish_each_job_once(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db", lease=5)
+    enqueue(queue, 12)
+    runs = []
+    reports = {}
+
+    def run_worker(name):
+        reports[name] = work(queue, lambda job: FakeDownloader(job, runs), worker=name, poll=0.05)
+
+    threads = [threading.Thread(target=run_worker, args=(name,)) for name in ("w1", "w2")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert sorted(Counter(runs).values()) == [1] * 12
+    assert reports["w1"]["success"] + reports["w2"]["success"] == 12
+    assert all(row["status"] == DONE and row["attempts"] == 1 for row in queue.lessons())
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db", lease=0.2)
+    enqueue(queue, 1)
+    stuck = queue.claim("crashed")  # 领取后不再心跳，模拟 worker 崩溃
+    assert queue.claim("alive") is None  # 租约未过期前不能被其他 worker 领取
+    time.sleep(0.3)
+
+    runs = []
+    result = work(queue, lambda job: FakeDownloader(job, runs), worker="alive", wait=False)
+    assert result["success"] == 1 and runs == [stuck.id]
+    row = queue.lessons()[0]
+    assert row["status"] == DONE and row["attempts"] == 2
+    assert not queue.complete(stuck.id, "crashed", "late.mp4")  # 失联的 worker 不能再提交
+
+
+def test_lost_lease_cancels_download(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db", lease=0.3)
+    enqueue(queue, 1)
+    downloaders = []
+
+    def make_downloader(job):
+        downloaders.append(FakeDownloader(job, [], block=10))
+        return downloaders[-1]
+
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(work(queue, make_downloader, worker="slow", wait=False)))
+    thread.start()
+    time.sleep(0.5)  # 心跳间隔 1 秒，租约 0.3 秒后过期
+    job = queue.claim("other")
+    assert job is not None
+
+    with Heartbeat(queue, job, "other", interval=0.1):  # 接手的 worker 保持续租
+        thread.join(5)
+        assert not thread.is_alive()
+    assert downloaders[0].cancel.is_set()
+    assert result == {"success": 0, "failed": 0, "lost": 1}
+    row = queue.lessons()[0]
+    assert row["status"] == RUNNING and row["worker"] == "other"
+    assert queue.complete(job.id, "other", "第0课.mp4")
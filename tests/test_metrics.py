@@ -0,0 +1,30 @@
+from metrics import FINISHED, Registry
+
+
+def test_resubmitted_lesson_starts_from_zero():
+    registry = Registry()
+    first = registry.lesson("第1课", key="temp_第1课_aaaa")
+    first.record_segment(0, 0.1, 1000, True)
+    second = registry.lesson("第1课", key="temp_第1课_aaaa")  # 同一节课重新提交
+    second.record_segment(0, 0.1, 500, True)
+    other = registry.lesson("第1课", key="temp_第1课_bbbb")  # 同名的另一节课
+    other.record_segment(0, 0.1, 200, True)
+
+    assert (first.bytes, second.bytes, other.bytes) == (1000, 500, 200)
+    assert registry.lessons == {"temp_第1课_aaaa": second, "temp_第1课_bbbb": other}
+    assert registry.finished.bytes == 1000
+
+
+def test_finished_lessons_are_archived():
+    registry = Registry()
+    for i in range(50):
+        lesson = registry.lesson(f"第{i}课", key=f"temp_{i}")
+        lesson.record_segment(0, 0.2, 100, True)
+        lesson.record_segment(1, 0.2, 0, False)
+        registry.finish(lesson)
+        registry.finish(lesson)  # 重复调用不会重复归档
+
+    assert registry.lessons == {}
+    assert (registry.finished.bytes, registry.finished.segments, registry.finished.failed) == (5000, 100, 50)
+    assert registry.finished.histograms["segment"].count == 100
+    assert f'xet_downloaded_bytes{{lesson="{FINISHED}"}} 5000' in registry.prometheus()
@@ -0,0 +1,25 @@
+import main
+
+
+def _downloader(tmp_path, url, monkeypatch):
+    d = main.M3U8Downloader(url, "第1课", tmp_path)
+    monkeypatch.setattr(d, "parse_m3u8", lambda: True)
+    return d
+
+
+def test_same_title_lessons_reserve_distinct_outputs(tmp_path, monkeypatch):
+    first = _downloader(tmp_path, "https://cdn.example.com/course/7/index.m3u8", monkeypatch)
+    second = _downloader(tmp_path, "https://cdn.example.com/course/8/index.m3u8", monkeypatch)
+
+    # 流水线模式下两节课都还没有输出文件时先后准备：后者不能选用前者已占用的文件名
+    assert first.prepare() is True
+    assert second.prepare() is True
+    assert first.final_mp4.name == "第1课.mp4"
+    assert second.final_mp4.name == f"第1课_{second.playlist_id[:8]}.mp4"
+
+    first.unlock()
+    second.unlock()
+    third = _downloader(tmp_path, "https://cdn.example.com/course/9/index.m3u8", monkeypatch)
+    assert third.prepare() is True
+    assert third.final_mp4.name == "第1课.mp4"  # 释放后可以再次使用
+    third.unlock()
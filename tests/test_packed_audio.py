@@ -0,0 +1,58 @@
+import struct
+
+import main
+from hls_standin import _adts_frame, make_av_segment
+from ts_remux import TSRemuxer, remux_files
+from ts_validate import TSValidator, validate_ts
+
+
+def _id3(pts):
+    """packed audio 分片开头的时间戳标签（PRIV com.apple.streaming.transportStreamTimestamp）"""
+    body = b"PRIV" + struct.pack(">I", 53) + b"\0\0" + b"com.apple.streaming.transportStreamTimestamp\0" \
+        + struct.pack(">Q", pts)
+    size = bytes((len(body) >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    return b"ID3\x04\x00\x00" + size + body
+
+
+def _packed_segment(index, frames=172):
+    return _id3(index * 4 * 90000) + _adts_frame() * frames
+
+
+def test_packed_audio_passes_validation():
+    data = _packed_segment(0)
+    assert validate_ts(data).ok
+    assert main.align_ts(data) == data
+
+    validator = TSValidator()
+    for pos in range(0, len(data), 100):
+        validator.feed(data[pos:pos + 100])
+    assert validator.finish().ok
+
+    assert validate_ts(b"<html>404</html>").reason == "HTML 错误页"
+
+
+def test_remux_packed_audio(tmp_path):
+    output = tmp_path / "out.m4a"
+    remuxer = TSRemuxer(output)
+    for index in range(3):
+        data = _packed_segment(index)
+        remuxer.write(data[:50])  # ID3 标签跨块
+        remuxer.write(data[50:])
+    assert remuxer.close()
+    assert remuxer.video is None
+    assert len(remuxer.audio.sizes) == 3 * 172
+    assert list(remuxer.audio.dts[:3]) == [0, 1024, 2048]
+
+
+def test_remux_drop_video(tmp_path):
+    files = []
+    for index in range(2):
+        path = tmp_path / f"{index:05d}.ts"
+        path.write_bytes(make_av_segment(index, 50000))
+        files.append(path)
+
+    assert remux_files(files, tmp_path / "av.mp4")
+    assert remux_files(files, tmp_path / "a.m4a", drop_video=True)
+    data = (tmp_path / "a.m4a").read_bytes()
+    assert b"soun" in data and b"avcC" not in data
+    assert b"avcC" in (tmp_path / "av.mp4").read_bytes()
@@ -0,0 +1,57 @@
+import os
+import time
+
+import main
+from identity import lesson_identity
+from journal import ResumeJournal, lock_dir, reclaim_orphans
+
+SIGNED_A = "https://cdn.example.com/course/7/index.m3u8?sign=aaa&t=1700000000&quality=hd"
+SIGNED_B = "https://CDN.example.com/course/7/index.m3u8?quality=hd&t=1800000000&sign=bbb"
+
+
+def test_resigned_url_keeps_identity():
+    assert lesson_identity(SIGNED_A, "第1课") == lesson_identity(SIGNED_B, "第1课")
+    assert lesson_identity(SIGNED_A, "第1课") != lesson_identity(SIGNED_A, "第2课")
+    other = SIGNED_A.replace("course/7", "course/8")
+    assert lesson_identity(SIGNED_A, "第1课") != lesson_identity(other, "第1课")
+
+
+def test_resigned_url_maps_to_same_temp_dir(tmp_path):
+    first = main.M3U8Downloader(SIGNED_A, "第1课", tmp_path)
+    again = main.M3U8Downloader(SIGNED_B, "第1课", tmp_path)
+    assert first.temp_dir == again.temp_dir
+
+
+def _age(path, seconds):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+
+def test_reclaim_skips_locked_dirs(tmp_path):
+    busy = tmp_path / "temp_busy_000000000000"
+    idle = tmp_path / "temp_idle_000000000000"
+    for temp_dir in (busy, idle):
+        temp_dir.mkdir()
+        (temp_dir / "00000.ts").write_bytes(b"\x47" * 188)
+        _age(temp_dir, 2 * 3600)  # 没有续传日志且超过 1 小时
+
+    lock = lock_dir(busy)
+    assert lock is not None
+    assert lock_dir(busy) is None  # 同一进程内的第二个持有者也拿不到
+    try:
+        reclaim_orphans(tmp_path)
+        assert busy.exists()
+        assert not idle.exists()
+    finally:
+        lock.close()
+    _age(busy, 2 * 3600)  # 创建锁文件更新了目录的 mtime
+    reclaim_orphans(tmp_path)
+    assert not busy.exists()
+
+
+def test_reclaim_keeps_resigned_lesson_journal(tmp_path):
+    temp_dir = tmp_path / f"temp_第1课_{lesson_identity(SIGNED_A, '第1课')}"
+    temp_dir.mkdir()
+    ResumeJournal(temp_dir, lesson_identity(SIGNED_A, "第1课"), "第1课", SIGNED_A).close()
+    reclaim_orphans(tmp_path)
+    assert temp_dir.exists()
@@ -0,0 +1,25 @@
+import zlib
+from types import SimpleNamespace
+
+import main
+from segment_cache import SegmentCache
+
+
+def test_rewriting_segment_keeps_cached_copy(tmp_path):
+    d = main.M3U8Downloader("http://cdn.example.com/1/index.m3u8?sign=a", "第1课", tmp_path)
+    d.temp_dir.mkdir(parents=True)
+    d.cache = SegmentCache(tmp_path / "cache", 1024 * 1024)
+    segment = SimpleNamespace(index=0, url="http://cdn.example.com/1/00000.ts?sign=a", byterange=None)
+    key = d.cache_key(segment)
+
+    first = b"\x47" + b"\x01" * 187
+    d.write_segment(segment, first, cache=False)
+    path = d.temp_dir / "00000.ts"
+    d.cache.put_file(key, path, len(first), zlib.crc32(first))  # 同一文件系统上为硬链接
+
+    second = b"\x47" + b"\x02" * 187  # 重试 / 重新校验后再次写入同一个分片
+    d.write_segment(segment, second, cache=False)
+
+    assert path.read_bytes() == second
+    assert d.cache.get(key) == first
+    assert not list(d.temp_dir.glob("*.part"))
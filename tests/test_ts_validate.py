@@ -0,0 +1,30 @@
+import pytest
+
+from hls_standin import make_av_segment
+from ts_validate import HAS_NUMPY, TSValidator, validate_ts
+
+
+def _feed(data, size, use_numpy):
+    validator = TSValidator(use_numpy=use_numpy)
+    for pos in range(0, len(data), size):
+        validator.feed(memoryview(data)[pos:pos + size])
+    return validator.finish()
+
+
+@pytest.mark.parametrize("use_numpy", [False, True] if HAS_NUMPY else [False])
+@pytest.mark.parametrize("size", [1, 100, 187, 188, 189, 1000, 65536])
+def test_chunked_feed_matches_whole(use_numpy, size):
+    good = make_av_segment(0, 20000) + make_av_segment(1, 20000)
+    broken = bytearray(good)
+    broken[188 * 7 + 3] ^= 0x0F  # CC 错误
+    truncated = good[:-50]
+    bad_sync = bytearray(good)
+    bad_sync[188 * 9] = 0x00
+
+    for data in (good, bytes(broken), truncated):
+        assert repr(_feed(data, size, use_numpy)) == repr(validate_ts(data))
+
+    # 有同步错误的块不再检查 CC，CC 计数随分块位置变化，只比较其余字段
+    whole, chunked = validate_ts(bytes(bad_sync)), _feed(bytes(bad_sync), size, use_numpy)
+    assert (chunked.packets, chunked.sync_errors, chunked.trailing, chunked.reason) == \
+        (whole.packets, whole.sync_errors, whole.trailing, whole.reason)
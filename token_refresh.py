@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下载中途的令牌过期恢复
+
+分片 URL 的签名过期后，剩下的每个分片都会返回 403，以前每个分片白白重试 3 次、每次等 1 秒，
+整节课掉到 95% 的完成率阈值以下，只能从头再来。TokenRecovery 在多个分片上观察鉴权失败：
+- 一段时间内鉴权失败（401 / 403 / 410）达到阈值即判定为令牌过期，暂停所有分片请求
+- 由一个线程刷新播放列表（来源依次为回调、重新导出的课程列表文件、原始 m3u8 地址），其余线程等待
+- 刷新后按媒体序列号把新分片表对齐到原来的分片下标，未完成的分片换用新 URL 继续下载，已完成的分片保留
+因刷新而重试的请求不计入分片的重试次数
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+AUTH_STATUSES = (401, 403, 410)
+
+
+def auth_status(error):
+    """异常对应的鉴权失败状态码（requests 和 aiohttp），不是鉴权失败时返回 None"""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) if response is not None else getattr(error, "status", None)
+    return status if status in AUTH_STATUSES else None
+
+
+def remap_segments(old, new):
+    """
+    按媒体序列号把新分片表对齐到旧下标，返回 {旧下标: 新下标}
+    两边序列号没有交集但分片数和时长一致时（例如重新生成的播放列表从 0 重新编号）按位置对齐
+    """
+    positions = {sequence: i for i, sequence in enumerate(new.sequences)}
+    mapping = {i: positions[sequence] for i, sequence in enumerate(old.sequences) if sequence in positions}
+    if not mapping and len(old) == len(new) and \
+            all(abs(a - b) < 0.01 for a, b in zip(old.durations, new.durations)):
+        mapping = {i: i for i in range(len(old))}
+    return mapping
+
+
+class TokenRecovery:
+    def __init__(self, refresh, threshold=3, window=30.0, max_refreshes=5):
+        """
+        refresh: refresh() -> bool，刷新播放列表，成功时返回 True
+        threshold: window 秒内鉴权失败达到该次数时判定为令牌过期
+        max_refreshes: 每节课最多刷新的次数，超过后鉴权失败按普通错误重试
+        """
+        self.refresh = refresh
+        self.threshold = threshold
+        self.window = window
+        self.max_refreshes = max_refreshes
+        self.lock = threading.Lock()
+        self.ready = threading.Event()  # 未在刷新时置位；刷新期间所有分片请求在此等待
+        self.ready.set()
+        self.failures = []  # 最近鉴权失败的时间
+        self.generation = 0  # 每刷新一次加 1，用于识别刷新前发出的请求
+        self.refreshing = False
+        self.refreshes = 0
+        self.failed_refreshes = 0
+        self.paused = 0.0  # 暂停的累计秒数
+
+    def wait(self):
+        """刷新期间阻塞，直到可以继续发请求"""
+        self.ready.wait()
+
+    def auth_failure(self, generation):
+        """
+        记录一次鉴权失败（generation 为发出请求时的 self.generation），返回是否应立即重试（不计入重试次数）：
+        请求发出后已经刷新过，或这次失败触发了刷新并成功
+        """
+        with self.lock:
+            if generation != self.generation:
+                return True
+            if self.refreshing:
+                leader = False
+            else:
+                now = time.monotonic()
+                self.failures = [t for t in self.failures if now - t < self.window]
+                self.failures.append(now)
+                if len(self.failures) < self.threshold or self.refreshes + self.failed_refreshes >= self.max_refreshes:
+                    return False
+                leader = self.refreshing = True
+                self.ready.clear()
+
+        if not leader:
+            self.ready.wait()
+            with self.lock:
+                return generation != self.generation
+
+        start = time.monotonic()
+        logger.warning(f"{len(self.failures)} 次鉴权失败，判定为令牌过期，暂停下载并刷新播放列表")
+        try:
+            ok = self.refresh()
+        except Exception as e:
+            logger.warning(f"刷新播放列表失败: {e}")
+            ok = False
+        with self.lock:
+            if ok:
+                self.refreshes += 1
+                self.generation += 1
+            else:
+                self.failed_refreshes += 1
+            self.failures = []
+            self.refreshing = False
+            self.paused += time.monotonic() - start
+            self.ready.set()
+        return ok
+
+    def stats(self):
+        with self.lock:
+            return {"refreshes": self.refreshes, "failed_refreshes": self.failed_refreshes,
+                    "paused_seconds": round(self.paused, 2)}
@@ -0,0 +1,540 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+纯 Python 的 MPEG-TS -> MP4 转封装（H.264 + AAC，不重新编码，不依赖 ffmpeg）
+
+- TSDemuxer: 解析 PAT/PMT，按 PID 组装 PES 包，可逐块喂入数据
+- TSRemuxer: 把 H.264 访问单元转为 AVCC 长度前缀格式、把 ADTS 帧拆成裸 AAC 帧，
+  边解析边写入 mdat，结束时写 moov（渐进式 MP4，样本表只保存在紧凑数组中）
+假设每个视频 PES 承载一个完整的访问单元（HLS 切片器的通常做法）
+packed audio（ID3 标签 + 裸 ADTS 帧，EXT-X-MEDIA 音频轨常见）按第一块数据识别，跳过 TS 解复用直接拆 ADTS 帧
+"""
+
+import logging
+import struct
+import sys
+from array import array
+
+from ts_validate import id3_size, is_packed_audio
+
+logger = logging.getLogger(__name__)
+
+TS_PACKET_SIZE = 188
+STREAM_TYPE_H264 = 0x1B
+STREAM_TYPE_AAC = 0x0F
+AAC_SAMPLE_RATES = [96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050,
+                    16000, 12000, 11025, 8000, 7350]
+PTS_WRAP = 1 << 33
+MOVIE_TIMESCALE = 1000
+VIDEO_TIMESCALE = 90000
+MATRIX = struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+
+
+# ---------------------------------------------------------------- TS 解复用
+
+def _read_timestamp(b, i):
+    return ((((b[i] >> 1) & 0x07) << 30) | (b[i + 1] << 22) | ((b[i + 2] >> 1) << 15)
+            | (b[i + 3] << 7) | (b[i + 4] >> 1))
+
+
+class TSDemuxer:
+    def __init__(self, on_pes):
+        """on_pes(stream_type, pts, dts, payload) 在每个完整 PES 到达时调用"""
+        self.on_pes = on_pes
+        self.remainder = b''
+        self.pmt_pids = set()
+        self.streams = {}  # PID -> stream_type
+        self.pes = {}  # PID -> 负载块列表
+
+    def feed(self, data):
+        if self.remainder:
+            data = self.remainder + bytes(data)
+        view = memoryview(data)
+        pos, end = 0, len(data)
+        while end - pos >= TS_PACKET_SIZE:
+            if data[pos] != 0x47:
+                # 失去同步，寻找下一个同步字节
+                pos = data.find(b'\x47', pos + 1)
+                if pos < 0:
+                    pos = end
+                continue
+            self._packet(view[pos:pos + TS_PACKET_SIZE])
+            pos += TS_PACKET_SIZE
+        self.remainder = bytes(view[pos:])
+
+    def flush(self):
+        for pid in list(self.pes):
+            self._flush_pes(pid)
+
+    def _packet(self, pkt):
+        pusi = pkt[1] & 0x40
+        pid = ((pkt[1] & 0x1F) << 8) | pkt[2]
+        afc = (pkt[3] >> 4) & 0x03
+        offset = 4
+        if afc & 0x02:
+            offset += 1 + pkt[4]
+        if not afc & 0x01 or offset >= TS_PACKET_SIZE:
+            return
+        payload = pkt[offset:]
+
+        if pid == 0:
+            if pusi:
+                self._parse_pat(payload)
+        elif pid in self.pmt_pids:
+            if pusi:
+                self._parse_pmt(payload)
+        elif pid in self.streams:
+            if pusi:
+                self._flush_pes(pid)
+                self.pes[pid] = [bytes(payload)]
+            elif pid in self.pes:
+                self.pes[pid].append(bytes(payload))
+
+    @staticmethod
+    def _section(payload):
+        section = payload[1 + payload[0]:]
+        length = ((section[1] & 0x0F) << 8) | section[2]
+        return section, 3 + length - 4  # 去掉 CRC
+
+    def _parse_pat(self, payload):
+        section, end = self._section(payload)
+        for i in range(8, end, 4):
+            program = (section[i] << 8) | section[i + 1]
+            if program != 0:
+                self.pmt_pids.add(((section[i + 2] & 0x1F) << 8) | section[i + 3])
+
+    def _parse_pmt(self, payload):
+        section, end = self._section(payload)
+        i = 12 + (((section[10] & 0x0F) << 8) | section[11])
+        while i + 5 <= end:
+            stream_type = section[i]
+            pid = ((section[i + 1] & 0x1F) << 8) | section[i + 2]
+            if stream_type in (STREAM_TYPE_H264, STREAM_TYPE_AAC) and pid not in self.streams:
+                self.streams[pid] = stream_type
+            i += 5 + (((section[i + 3] & 0x0F) << 8) | section[i + 4])
+
+    def _flush_pes(self, pid):
+        chunks = self.pes.pop(pid, None)
+        if not chunks:
+            return
+        data = b''.join(chunks)
+        if len(data) < 9 or data[:3] != b'\x00\x00\x01':
+            return
+        flags, header_len = data[7], data[8]
+        pts = dts = None
+        if flags & 0x80:
+            pts = dts = _read_timestamp(data, 9)
+        if flags & 0x40:
+            dts = _read_timestamp(data, 14)
+        if pts is None:
+            return
+        start = 9 + header_len
+        length = (data[4] << 8) | data[5]
+        payload = data[start:6 + length] if length else data[start:]
+        self.on_pes(self.streams[pid], pts, dts, payload)
+
+
+# ---------------------------------------------------------------- H.264 / AAC
+
+class _BitReader:
+    def __init__(self, data):
+        self.value = int.from_bytes(data, 'big')
+        self.size = len(data) * 8
+        self.pos = 0
+
+    def u(self, n):
+        self.pos += n
+        if self.pos > self.size:
+            raise ValueError("SPS 数据不完整")
+        return (self.value >> (self.size - self.pos)) & ((1 << n) - 1)
+
+    def ue(self):
+        zeros = 0
+        while self.u(1) == 0:
+            zeros += 1
+        return (1 << zeros) - 1 + self.u(zeros)
+
+    def se(self):
+        v = self.ue()
+        return (v + 1) // 2 if v & 1 else -(v // 2)
+
+
+def parse_sps(nal):
+    """解析 SPS，返回 (width, height, chroma_format_idc, bit_depth_luma, bit_depth_chroma)"""
+    r = _BitReader(nal[1:].replace(b'\x00\x00\x03', b'\x00\x00'))
+    profile = r.u(8)
+    r.u(16)  # constraint flags + level
+    r.ue()  # seq_parameter_set_id
+    chroma, depth_luma, depth_chroma = 1, 8, 8
+    if profile in (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135):
+        chroma = r.ue()
+        if chroma == 3:
+            r.u(1)
+        depth_luma, depth_chroma = r.ue() + 8, r.ue() + 8
+        r.u(1)
+        if r.u(1):  # seq_scaling_matrix_present_flag
+            for i in range(8 if chroma != 3 else 12):
+                if r.u(1):
+                    last = nxt = 8
+                    for _ in range(16 if i < 6 else 64):
+                        if nxt:
+                            nxt = (last + r.se() + 256) % 256
+                        last = nxt or last
+    r.ue()  # log2_max_frame_num_minus4
+    poc_type = r.ue()
+    if poc_type == 0:
+        r.ue()
+    elif poc_type == 1:
+        r.u(1)
+        r.se()
+        r.se()
+        for _ in range(r.ue()):
+            r.se()
+    r.ue()  # max_num_ref_frames
+    r.u(1)
+    width_mbs, height_units = r.ue() + 1, r.ue() + 1
+    frame_mbs_only = r.u(1)
+    if not frame_mbs_only:
+        r.u(1)
+    r.u(1)
+    crop = (0, 0, 0, 0)
+    if r.u(1):
+        crop = (r.ue(), r.ue(), r.ue(), r.ue())
+    crop_x = 2 if chroma in (1, 2) else 1
+    crop_y = (2 if chroma == 1 else 1) * (2 - frame_mbs_only)
+    width = width_mbs * 16 - crop_x * (crop[0] + crop[1])
+    height = (2 - frame_mbs_only) * height_units * 16 - crop_y * (crop[2] + crop[3])
+    return width, height, chroma, depth_luma, depth_chroma
+
+
+def split_nals(data):
+    """按起始码切分 Annex B 字节流"""
+    nals = []
+    i = data.find(b'\x00\x00\x01')
+    while i >= 0:
+        start = i + 3
+        i = data.find(b'\x00\x00\x01', start)
+        nal = data[start:i if i >= 0 else len(data)].rstrip(b'\x00')
+        if nal:
+            nals.append(nal)
+    return nals
+
+
+# ---------------------------------------------------------------- MP4 写入
+
+def _box(kind, *payloads):
+    body = b''.join(payloads)
+    return struct.pack('>I', 8 + len(body)) + kind + body
+
+
+def _full_box(kind, version, flags, *payloads):
+    return _box(kind, struct.pack('>I', (version << 24) | flags), *payloads)
+
+
+def _be(arr):
+    """array 转大端字节"""
+    if sys.byteorder == 'little':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _descriptor(tag, payload):
+    return bytes([tag, len(payload)]) + payload
+
+
+class _Track:
+    def __init__(self, track_id, kind, timescale):
+        self.track_id = track_id
+        self.kind = kind  # 'vide' / 'soun'
+        self.timescale = timescale
+        self.sizes = array('I')
+        self.offsets = array('Q')
+        self.dts = array('q')
+        self.cts = array('i')
+        self.sync = array('I')  # 关键帧样本序号（从 1 开始）
+        self.first_pts = None  # 90kHz
+        self.last_raw = None
+        self.wrap = 0
+        # 视频参数
+        self.sps = self.pps = None
+        self.width = self.height = 0
+        self.sps_info = None
+        # 音频参数
+        self.sample_rate = 0
+        self.channels = 0
+        self.asc = b''
+        self.adts_remainder = b''
+
+    def unwrap(self, ts):
+        """处理 33 位时间戳回绕"""
+        if self.last_raw is not None and ts + PTS_WRAP // 2 < self.last_raw:
+            self.wrap += PTS_WRAP
+        self.last_raw = ts
+        return ts + self.wrap
+
+    def durations(self, default):
+        count = len(self.dts)
+        result = array('I', (max(0, self.dts[i + 1] - self.dts[i]) for i in range(count - 1)))
+        if count:
+            result.append(result[-1] if result else default)
+        return result
+
+    def duration(self, default):
+        if not self.dts:
+            return 0
+        return self.dts[-1] - self.dts[0] + (self.dts[-1] - self.dts[-2] if len(self.dts) > 1 else default)
+
+
+class TSRemuxer:
+    def __init__(self, output_file, drop_video=False):
+        """drop_video: 丢弃 H.264 轨，只输出音频（.m4a）"""
+        self.output_file = output_file
+        self.drop_video = drop_video
+        self.file = open(output_file, 'wb')
+        self.file.write(_box(b'ftyp', b'isom', struct.pack('>I', 0x200), b'isomiso2avc1mp41'))
+        self.mdat_start = self.file.tell()
+        self.file.write(struct.pack('>I4sQ', 1, b'mdat', 0))  # 64 位大小，结束时回填
+        self.pos = self.file.tell()
+        self.video = None
+        self.audio = None
+        self.demuxer = TSDemuxer(self._on_pes)
+        self.packed = None  # 是否为 packed audio，由第一块数据决定
+
+    def write(self, data):
+        """喂入任意长度的 TS 数据（或 packed audio 数据）"""
+        if self.packed is None and len(data):
+            self.packed = is_packed_audio(data)
+        if self.packed:
+            # 没有 PES 时间戳，各帧按 1024 个采样连续排列
+            self._on_audio(0, data)
+        else:
+            self.demuxer.feed(data)
+
+    def _add_sample(self, track, data, dts, cts, sync):
+        self.file.write(data)
+        track.sizes.append(len(data))
+        track.offsets.append(self.pos)
+        track.dts.append(dts)
+        track.cts.append(cts)
+        if sync:
+            track.sync.append(len(track.sizes))
+        self.pos += len(data)
+
+    def _on_pes(self, stream_type, pts, dts, payload):
+        if stream_type == STREAM_TYPE_H264:
+            if not self.drop_video:
+                self._on_video(pts, dts, payload)
+        else:
+            self._on_audio(pts, payload)
+
+    def _on_video(self, pts, dts, payload):
+        track = self.video
+        if track is None:
+            track = self.video = _Track(1, 'vide', VIDEO_TIMESCALE)
+        parts = []
+        keyframe = False
+        for nal in split_nals(payload):
+            nal_type = nal[0] & 0x1F
+            if nal_type == 9:  # AUD
+                continue
+            if nal_type == 7:
+                if track.sps is None:
+                    track.sps = nal
+                    track.sps_info = parse_sps(nal)
+                    track.width, track.height = track.sps_info[:2]
+                continue
+            if nal_type == 8:
+                if track.pps is None:
+                    track.pps = nal
+                continue
+            keyframe |= nal_type == 5
+            parts.append(struct.pack('>I', len(nal)))
+            parts.append(nal)
+        if not parts or track.sps is None:
+            return  # 第一个带 SPS 的访问单元之前的数据无法解码，丢弃
+        dts = track.unwrap(dts)
+        pts = dts + ((pts - dts) % PTS_WRAP)
+        if track.first_pts is None or pts < track.first_pts:
+            track.first_pts = pts
+        self._add_sample(track, b''.join(parts), dts, pts - dts, keyframe)
+
+    def _on_audio(self, pts, payload):
+        track = self.audio
+        if track is None:
+            track = self.audio = _Track(2, 'soun', 0)
+        data = track.adts_remainder + payload
+        pts = track.unwrap(pts)
+        frame_index = 0
+        pos = 0
+        while len(data) - pos >= 7:
+            if data[pos:pos + 3] == b"ID3":  # packed audio 每个分片开头的时间戳标签
+                if len(data) - pos < 10 or len(data) - pos < id3_size(data[pos:pos + 10]):
+                    break
+                pos += id3_size(data[pos:pos + 10])
+                continue
+            if data[pos] != 0xFF or data[pos + 1] & 0xF0 != 0xF0:
+                pos += 1
+                continue
+            frame_len = ((data[pos + 3] & 0x03) << 11) | (data[pos + 4] << 3) | (data[pos + 5] >> 5)
+            if frame_len < 7:
+                pos += 1
+                continue
+            if len(data) - pos < frame_len:
+                break
+            header_len = 7 if data[pos + 1] & 0x01 else 9
+            if not track.sample_rate:
+                profile = (data[pos + 2] >> 6) + 1
+                sf_index = (data[pos + 2] >> 2) & 0x0F
+                track.channels = ((data[pos + 2] & 0x01) << 2) | (data[pos + 3] >> 6)
+                track.sample_rate = AAC_SAMPLE_RATES[sf_index]
+                track.timescale = track.sample_rate
+                track.asc = struct.pack('>H', (profile << 11) | (sf_index << 7) | (track.channels << 3))
+                track.first_pts = pts
+            dts = (pts - track.first_pts) * track.sample_rate // VIDEO_TIMESCALE + frame_index * 1024
+            if track.dts and dts <= track.dts[-1]:
+                dts = track.dts[-1] + 1024
+            self._add_sample(track, data[pos + header_len:pos + frame_len], dts, 0, False)
+            frame_index += 1
+            pos += frame_len
+        track.adts_remainder = data[pos:]
+
+    # ------------------------------------------------------------ moov
+
+    def _stbl(self, track, default_duration):
+        if track.kind == 'vide':
+            width, height = track.width, track.height
+            profile = track.sps[1]
+            avcc = bytes([1, profile, track.sps[2], track.sps[3], 0xFF, 0xE1])
+            avcc += struct.pack('>H', len(track.sps)) + track.sps + b'\x01'
+            avcc += struct.pack('>H', len(track.pps)) + track.pps
+            if profile in (100, 110, 122, 144):
+                _, _, chroma, depth_luma, depth_chroma = track.sps_info
+                avcc += bytes([0xFC | chroma, 0xF8 | (depth_luma - 8), 0xF8 | (depth_chroma - 8), 0])
+            entry = _box(b'avc1', bytes(6), struct.pack('>H', 1), bytes(16),
+                         struct.pack('>HHIIIH', width, height, 0x480000, 0x480000, 0, 1),
+                         bytes(32), struct.pack('>Hh', 0x18, -1), _box(b'avcC', avcc))
+        else:
+            dec_config = _descriptor(0x04, bytes([0x40, 0x15]) + bytes(11) + _descriptor(0x05, track.asc))
+            es = _descriptor(0x03, struct.pack('>HB', track.track_id, 0) + dec_config
+                             + _descriptor(0x06, b'\x02'))
+            entry = _box(b'mp4a', bytes(6), struct.pack('>H', 1), bytes(8),
+                         struct.pack('>HHHHI', track.channels, 16, 0, 0, track.sample_rate << 16),
+                         _full_box(b'esds', 0, 0, es))
+
+        # stts: 解码时间间隔（游程编码）
+        stts = array('I')
+        for d in track.durations(default_duration):
+            if stts and stts[-1] == d:
+                stts[-2] += 1
+            else:
+                stts.extend((1, d))
+        boxes = [_full_box(b'stsd', 0, 0, struct.pack('>I', 1), entry),
+                 _full_box(b'stts', 0, 0, struct.pack('>I', len(stts) // 2), _be(stts))]
+
+        if any(track.cts):
+            ctts = array('i')
+            for c in track.cts:
+                if ctts and ctts[-1] == c:
+                    ctts[-2] += 1
+                else:
+                    ctts.extend((1, c))
+            version = 1 if min(track.cts) < 0 else 0
+            boxes.append(_full_box(b'ctts', version, 0, struct.pack('>I', len(ctts) // 2), _be(ctts)))
+        if track.kind == 'vide' and len(track.sync) < len(track.sizes):
+            boxes.append(_full_box(b'stss', 0, 0, struct.pack('>I', len(track.sync)), _be(track.sync)))
+
+        boxes.append(_full_box(b'stsz', 0, 0, struct.pack('>II', 0, len(track.sizes)), _be(track.sizes)))
+        boxes.append(_full_box(b'stsc', 0, 0, struct.pack('>IIII', 1, 1, 1, 1)))
+        boxes.append(_full_box(b'co64', 0, 0, struct.pack('>I', len(track.offsets)), _be(track.offsets)))
+        return _box(b'stbl', *boxes)
+
+    def _trak(self, track, start_pts):
+        default = 3600 if track.kind == 'vide' else 1024
+        media_duration = track.duration(default)
+        movie_duration = media_duration * MOVIE_TIMESCALE // track.timescale
+        delay = (track.first_pts - start_pts) * MOVIE_TIMESCALE // VIDEO_TIMESCALE
+
+        if track.kind == 'vide':
+            media_time = track.first_pts - track.dts[0]  # B 帧导致首帧显示时间晚于解码时间
+            header = _full_box(b'vmhd', 0, 1, bytes(8))
+            handler, volume = b'vide', 0
+            width, height = track.width, track.height
+        else:
+            media_time = 0
+            header = _full_box(b'smhd', 0, 0, bytes(4))
+            handler, volume = b'soun', 0x0100
+            width = height = 0
+
+        edits = []
+        if delay > 0:
+            edits.append(struct.pack('>Iii', delay, -1, 0x10000))
+        edits.append(struct.pack('>Iii', movie_duration, media_time, 0x10000))
+        edts = _box(b'edts', _full_box(b'elst', 0, 0, struct.pack('>I', len(edits)), *edits))
+
+        tkhd = _full_box(b'tkhd', 0, 3, struct.pack('>IIIII', 0, 0, track.track_id, 0, delay + movie_duration),
+                         bytes(8), struct.pack('>hhHH', 0, 0, volume, 0), MATRIX,
+                         struct.pack('>II', width << 16, height << 16))
+        mdhd = _full_box(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, track.timescale, media_duration, 0x55C4, 0))
+        hdlr = _full_box(b'hdlr', 0, 0, bytes(4), handler, bytes(12), handler.title() + b'Handler\x00')
+        dinf = _box(b'dinf', _full_box(b'dref', 0, 0, struct.pack('>I', 1), _full_box(b'url ', 0, 1)))
+        minf = _box(b'minf', header, dinf, self._stbl(track, default))
+        return _box(b'trak', tkhd, edts, _box(b'mdia', mdhd, hdlr, minf)), delay + movie_duration
+
+    def close(self):
+        """结束输入，写入 moov；成功返回 True"""
+        try:
+            self.demuxer.flush()
+            tracks = [t for t in (self.video, self.audio) if t is not None and t.sizes]
+            if not tracks:
+                logger.error("转封装失败: 未找到 H.264 / AAC 数据")
+                self.abort()
+                return False
+
+            # 回填 mdat 大小
+            end = self.file.tell()
+            self.file.seek(self.mdat_start + 8)
+            self.file.write(struct.pack('>Q', end - self.mdat_start))
+            self.file.seek(end)
+
+            start_pts = min(t.first_pts for t in tracks)
+            traks = []
+            duration = 0
+            for track in tracks:
+                trak, track_duration = self._trak(track, start_pts)
+                traks.append(trak)
+                duration = max(duration, track_duration)
+
+            mvhd = _full_box(b'mvhd', 0, 0, struct.pack('>IIII', 0, 0, MOVIE_TIMESCALE, duration),
+                             struct.pack('>IH', 0x10000, 0x0100), bytes(10), MATRIX, bytes(24),
+                             struct.pack('>I', max(t.track_id for t in tracks) + 1))
+            self.file.write(_box(b'moov', mvhd, *traks))
+            self.file.close()
+            return True
+        except Exception as e:
+            logger.error(f"转封装失败: {e}")
+            self.abort()
+            return False
+
+    def abort(self):
+        if not self.file.closed:
+            self.file.close()
+        self.output_file.unlink(missing_ok=True)
+
+
+def remux_files(ts_files, output_file, chunk_size=1024 * 1024, drop_video=False):
+    """按顺序读取 TS 文件并转封装为 MP4"""
+    remuxer = TSRemuxer(output_file, drop_video=drop_video)
+    try:
+        for ts in ts_files:
+            with open(ts, 'rb') as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    remuxer.write(chunk)
+    except Exception as e:
+        logger.error(f"读取分片失败: {e}")
+        remuxer.abort()
+        return False
+    return remuxer.close()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分片完整性校验（边下载边校验，不等 ffmpeg 合并失败才发现）
+
+TSValidator 可以逐块喂入明文数据，检查:
+- 每 188 字节一个同步字节 0x47（NumPy 向量化；未安装 NumPy 时用 memoryview 步长视图）
+- 包数量和末尾不完整的包（截断）
+- 每个 PID 的连续计数器（CC），允许重复包和带不连续标志的包
+- 同步字节错误时区分 HTML 错误页和解密失败（密钥或 IV 错误时整段都是乱码）
+同步错误、截断、HTML 错误页、解密失败视为分片损坏，由下载线程立即重新下载；
+CC 错误通常来自源流本身，重新下载也无法修复，只计入报告。
+EXT-X-MEDIA 音频轨常用 packed audio（ID3 时间戳标签 + 裸 ADTS 帧），不是 TS，按内容识别后跳过 TS 检查。
+IntegrityReport 汇总一节课的校验结果。
+"""
+
+import threading
+from collections import Counter
+
+# 引入 NumPy（可选依赖）
+try:
+    import numpy as np
+
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+TS_PACKET_SIZE = 188
+NULL_PID = 0x1FFF
+HTML_MARKERS = (b"<html", b"<!doctype", b"<?xml", b"<head", b"<body")
+
+
+def id3_size(data):
+    """ID3v2 标签总长度（10 字节头 + 同步安全整数表示的标签体 + 可选的页脚）"""
+    size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | data[9] & 0x7F
+    return 10 + size + (10 if data[5] & 0x10 else 0)
+
+
+def is_packed_audio(data):
+    """数据开头是否为 packed audio：可选的 ID3 标签后紧跟 ADTS 同步字（12 个 1，layer 为 0）"""
+    pos = 0
+    if data[:3] == b"ID3":
+        if len(data) < 10:
+            return True
+        pos = id3_size(data)
+        if len(data) < pos + 2:
+            return True  # 只收到标签，ADTS 帧在后续数据块中
+    return len(data) >= pos + 2 and data[pos] == 0xFF and data[pos + 1] & 0xF6 == 0xF0
+
+
+class SegmentInvalid(Exception):
+    """分片未通过完整性校验；check 为对应的 TSCheck"""
+
+    def __init__(self, message, check=None):
+        super().__init__(message)
+        self.check = check
+
+
+class TSCheck:
+    """一个分片的校验结果"""
+
+    __slots__ = ("packets", "sync_errors", "cc_errors", "trailing", "reason")
+
+    def __init__(self, packets, sync_errors, cc_errors, trailing, reason):
+        self.packets = packets
+        self.sync_errors = sync_errors
+        self.cc_errors = cc_errors
+        self.trailing = trailing  # 末尾不足一个包的字节数
+        self.reason = reason  # 损坏原因，通过时为 None
+
+    @property
+    def ok(self):
+        return self.reason is None
+
+    def __repr__(self):
+        return (f"TSCheck(packets={self.packets}, sync_errors={self.sync_errors}, "
+                f"cc_errors={self.cc_errors}, trailing={self.trailing}, reason={self.reason})")
+
+
+class TSValidator:
+    def __init__(self, encrypted=False, use_numpy=None):
+        """
+        encrypted: 分片是否经过解密（同步字节错误时判断为解密失败）
+        use_numpy: 是否使用 NumPy，默认已安装时使用
+        """
+        self.encrypted = encrypted
+        self.use_numpy = HAS_NUMPY if use_numpy is None else use_numpy and HAS_NUMPY
+        self.head = b""  # 开头的若干字节，用于识别 HTML 错误页
+        self.pending = b""  # 上一块末尾不足一个包的数据
+        self.packets = 0
+        self.sync_errors = 0
+        self.cc_errors = 0
+        self.last_cc = {}  # PID -> 上一个带负载的包的 CC
+        self.packed = None  # 是否为 packed audio，由第一块数据决定
+
+    def feed(self, data):
+        if self.packed is None and len(data):
+            self.packed = is_packed_audio(data)
+        if self.packed:
+            return  # 不是 TS，没有包结构可查
+        if len(self.head) < 512:
+            self.head += bytes(data[:512 - len(self.head)])
+        view = memoryview(data).cast("B")
+        if self.pending:
+            # 只拼接上一块剩下的不足一个包的数据和本块开头，凑成一个包；其余部分不复制
+            need = TS_PACKET_SIZE - len(self.pending)
+            if len(view) < need:
+                self.pending += bytes(view)
+                return
+            # 单个包用步长检查即可，NumPy 的固定开销反而更大
+            self._check_stride(memoryview(self.pending + bytes(view[:need])))
+            view = view[need:]
+        whole = len(view) - len(view) % TS_PACKET_SIZE
+        if whole:
+            if self.use_numpy:
+                self._check_numpy(view[:whole])
+            else:
+                self._check_stride(view[:whole])
+        self.pending = bytes(view[whole:])
+
+    def _check_numpy(self, view):
+        packets = np.frombuffer(view, dtype=np.uint8).reshape(-1, TS_PACKET_SIZE)
+        self.packets += len(packets)
+        sync_errors = int(np.count_nonzero(packets[:, 0] != 0x47))
+        if sync_errors:
+            self.sync_errors += sync_errors
+            return  # 同步错误时包头不可信，不再检查 CC
+
+        pid = ((packets[:, 1].astype(np.uint16) & 0x1F) << 8) | packets[:, 2]
+        afc = (packets[:, 3] >> 4) & 0x03
+        cc = packets[:, 3] & 0x0F
+        # 自适应字段中的不连续标志
+        discontinuity = ((afc & 0x02) != 0) & (packets[:, 4] > 0) & ((packets[:, 5] & 0x80) != 0)
+        payload = ((afc & 0x01) != 0) & (pid != NULL_PID)
+        pid, cc, discontinuity = pid[payload], cc[payload], discontinuity[payload]
+        if not len(pid):
+            return
+
+        # 按 PID 稳定排序后，相邻且同 PID 的包比较 CC
+        order = np.argsort(pid, kind="stable")
+        pid, cc, discontinuity = pid[order], cc[order], discontinuity[order]
+        same = pid[1:] == pid[:-1]
+        step = (cc[1:] - cc[:-1]) & 0x0F
+        bad = same & (step != 1) & (step != 0) & ~discontinuity[1:]
+        self.cc_errors += int(np.count_nonzero(bad))
+
+        # 与上一块的衔接：每个 PID 的第一个包对比上一块最后的 CC
+        firsts = np.flatnonzero(np.concatenate(([True], ~same)))
+        lasts = np.concatenate((firsts[1:] - 1, [len(pid) - 1]))
+        for first, last in zip(firsts.tolist(), lasts.tolist()):
+            key = int(pid[first])
+            self._continue(key, int(cc[first]), bool(discontinuity[first]))
+            self.last_cc[key] = int(cc[last])
+
+    def _check_stride(self, view):
+        count = len(view) // TS_PACKET_SIZE
+        self.packets += count
+        sync_errors = count - view[::TS_PACKET_SIZE].tobytes().count(0x47)
+        if sync_errors:
+            self.sync_errors += sync_errors
+            return
+
+        for pos in range(0, len(view), TS_PACKET_SIZE):
+            b1, b2, b3 = view[pos + 1], view[pos + 2], view[pos + 3]
+            pid = ((b1 & 0x1F) << 8) | b2
+            afc = (b3 >> 4) & 0x03
+            if not afc & 0x01 or pid == NULL_PID:
+                continue
+            discontinuity = bool(afc & 0x02 and view[pos + 4] and view[pos + 5] & 0x80)
+            self._continue(pid, b3 & 0x0F, discontinuity)
+            self.last_cc[pid] = b3 & 0x0F
+
+    def _continue(self, pid, cc, discontinuity):
+        last = self.last_cc.get(pid)
+        if last is not None and not discontinuity and (cc - last) & 0x0F not in (0, 1):
+            self.cc_errors += 1
+
+    def finish(self):
+        """结束校验，返回 TSCheck"""
+        if self.packed:
+            return TSCheck(0, 0, 0, 0, None)
+        reason = None
+        if not self.packets and not self.pending:
+            reason = "空数据"
+        elif self.sync_errors or self.pending:
+            head = self.head.lstrip().lower()
+            if head[:1] == b"<" or any(marker in head for marker in HTML_MARKERS):
+                reason = "HTML 错误页"
+            elif self.sync_errors:
+                # 密钥或 IV 错误时几乎每个包都对不上
+                reason = "解密失败" if self.encrypted and self.sync_errors * 2 > self.packets else "同步字节错误"
+            else:
+                reason = "数据截断"
+        return TSCheck(self.packets, self.sync_errors, self.cc_errors, len(self.pending), reason)
+
+
+def validate_ts(data, encrypted=False):
+    """一次性校验整段数据"""
+    validator = TSValidator(encrypted)
+    validator.feed(data)
+    return validator.finish()
+
+
+class IntegrityReport:
+    """一节课的完整性报告（线程安全）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.passed = {}  # 序号 -> (包数, CC 错误数)，对冲请求重复校验同一分片时只算一次
+        self.failures = Counter()  # 损坏原因 -> 次数
+        self.refetched = set()  # 校验失败过的分片
+        self.missing = set()  # 重试后仍失败的分片
+
+    def record(self, idx, check):
+        with self.lock:
+            if check.ok:
+                self.passed[idx] = (check.packets, check.cc_errors)
+            else:
+                self.failures[check.reason] += 1
+                self.refetched.add(idx)
+
+    def mark_missing(self, idx):
+        with self.lock:
+            self.missing.add(idx)
+
+    def summary(self):
+        with self.lock:
+            return {
+                "passed": len(self.passed),
+                "packets": sum(packets for packets, _ in self.passed.values()),
+                "cc_errors": sum(errors for _, errors in self.passed.values()),
+                "failures": dict(self.failures),
+                "recovered": len(self.refetched - self.missing),
+                "missing": sorted(self.missing),
+            }
+
+    def format(self):
+        """一行可读的报告"""
+        s = self.summary()
+        line = f"校验通过 {s['passed']} 个分片（{s['packets']} 个 TS 包）"
+        if s["failures"]:
+            reasons = "、".join(f"{reason} {count}" for reason, count in s["failures"].items())
+            line += f"，损坏后重新下载 {sum(s['failures'].values())} 次（{reasons}），恢复 {s['recovered']} 个"
+        if s["cc_errors"]:
+            line += f"，连续计数器错误 {s['cc_errors']} 处"
+        if s["missing"]:
+            shown = ", ".join(map(str, s["missing"][:20])) + (" ..." if len(s["missing"]) > 20 else "")
+            line += f"，缺失 {len(s['missing'])} 个分片: {shown}"
+        return line